@@ -0,0 +1,91 @@
+"""Compares loading an Intermediate from a json snapshot against mapping it from the binary format,
+for callers that only need the last revision id, a few blocks, or every block. Each load runs in a
+fresh process, so that its peak RSS is its own; the memory still allocated once the load has
+returned is measured with tracemalloc.
+
+Usage: python -m benchmarks.binary_format [n_revisions]
+"""
+import os
+import sys
+import time
+import random
+import resource
+import tempfile
+import tracemalloc
+import multiprocessing
+
+from revision_pipeline.intermediate import Intermediate
+from benchmarks.memory import build_snapshot
+
+LOOKUPS = 100
+
+
+def last_revision_id(accum: Intermediate) -> None:
+    accum.get_last_revision_id()
+
+
+def lookups(accum: Intermediate) -> None:
+    hashes = sorted(accum.hash_lookup)
+    for h in random.Random(0).sample(hashes, min(LOOKUPS, len(hashes))):
+        if h in accum.blocks:
+            accum.blocks[h].text
+
+
+def iterate(accum: Intermediate) -> None:
+    for _, block in accum.blocks.items():
+        block.text
+
+
+TASKS = {"last revision id": last_revision_id, "%d lookups" % LOOKUPS: lookups, "every block": iterate}
+
+
+def prepare(n_revisions: int, json_path: str, binary_path: str, queue) -> None:
+    """Writes the Intermediate of a synthetic talk page history to json_path and to binary_path."""
+    build_snapshot(n_revisions, json_path)
+    accum = Intermediate(json_path)
+    accum.set_filepath(binary_path)
+    accum.write_to_disk()
+    queue.put(len(accum.blocks))
+
+
+def run(filepath: str, task: str, queue) -> None:
+    """Loads the Intermediate at filepath and runs a task on it, reporting the seconds taken, the
+    bytes still allocated and the peak RSS of the process."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    accum = Intermediate(filepath)
+    TASKS[task](accum)
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    queue.put((elapsed, current, rss))
+
+
+def in_process(target, *args):
+    """Runs target(*args, queue) in a fresh process and returns what it puts in the queue. A process
+    starts with the peak RSS of its parent, so the benchmark itself does no heavy work."""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=target, args=args + (queue,))
+    process.start()
+    res = queue.get()
+    process.join()
+    return res
+
+
+if __name__ == "__main__":
+    n_revisions = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    folder = tempfile.mkdtemp()
+    json_path = os.path.join(folder, "benchmark.json")
+    binary_path = os.path.join(folder, "benchmark.bin")
+    n_blocks = in_process(prepare, n_revisions, json_path, binary_path)
+    print("revisions: %d, blocks: %d, json: %.1f MB, binary: %.1f MB"
+          % (n_revisions, n_blocks, os.path.getsize(json_path) / 1e6, os.path.getsize(binary_path) / 1e6))
+
+    for task in TASKS:
+        print(task + ":")
+        for name, filepath in (("json", json_path), ("binary", binary_path)):
+            elapsed, current, rss = in_process(run, filepath, task)
+            print("  %-6s %8.1f ms %8.1f MB allocated %8.1f MB peak RSS" % (name, 1000 * elapsed, current / 1e6, rss / 1e6))
@@ -0,0 +1,52 @@
+"""Measures resolving block hashes to their most recent edit on a page with long edit
+chains, comparing HashLookup.find (path compression) against following hash_lookup
+links one at a time, as find_ultimate_hash used to.
+
+Usage: python -m benchmarks.hash_lookup [n_blocks] [chain_length]
+"""
+import sys
+import time
+
+from revision_pipeline.helpers import compute_md5
+from revision_pipeline.intermediate import HashLookup
+
+
+def build_chains(n_blocks: int, chain_length: int) -> tuple:
+    """Returns a hash_lookup in which each of n_blocks blocks has been edited chain_length
+    times, along with every hash of every block (oldest first)."""
+    links = {}
+    all_hashes = []
+    for b in range(n_blocks):
+        chain = [compute_md5("block %d edit %d" % (b, e)) for e in range(chain_length)]
+        for old, new in zip(chain, chain[1:]):
+            links[old] = new
+        links[chain[-1]] = chain[-1]
+        all_hashes += chain
+    return links, all_hashes
+
+
+def follow_links(links: dict, h: str) -> str:
+    try:
+        while links[h] != h:
+            h = links[h]
+        return h
+    except KeyError:
+        return None
+
+
+if __name__ == "__main__":
+    n_blocks = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    chain_length = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    links, all_hashes = build_chains(n_blocks, chain_length)
+    hash_lookup = HashLookup(links)
+    print("blocks: %d, edits per block: %d" % (n_blocks, chain_length))
+
+    # each pass resolves every hash once, as a corpus conversion does
+    for name, find in (("following links", lambda h: follow_links(links, h)),
+                       ("path compression", hash_lookup.find)):
+        for i in range(3):
+            start = time.perf_counter()
+            for h in all_hashes:
+                find(h)
+            elapsed = time.perf_counter() - start
+            print("%-17s pass %d: %8.3f s (%6.2f us/lookup)" % (name, i + 1, elapsed, 1e6 * elapsed / len(all_hashes)))
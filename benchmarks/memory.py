@@ -0,0 +1,84 @@
+"""Measures the memory held by the blocks, hash_lookup and reply tree of a loaded Intermediate,
+comparing compact Blocks (__slots__, interned hashes, users and timestamps, array-backed revision
+ids) linked by reply_parents against dict-backed objects holding the json as loaded and each a copy
+of its whole reply chain, as Blocks used to.
+
+Usage: python -m benchmarks.memory [n_revisions]
+"""
+import os
+import sys
+import json
+import tempfile
+import tracemalloc
+
+from revision_pipeline.diff import local_compare
+from revision_pipeline.intermediate import Intermediate
+from revision_pipeline.pipeline import _parse_diff
+from benchmarks.synthetic import generate_talk_page_history
+
+
+class PlainBlock:
+    """A Block as it was before it was made compact."""
+
+    def __init__(self, b: dict, reply_chain: list) -> None:
+        self.text = b["text"]
+        self.timestamp = b["timestamp"]
+        self.user = b["user"]
+        self.ingested = b["ingested"]
+        self.revision_ids = b["revisions"]
+        self.reply_chain = reply_chain
+        self.is_followed = b["is_followed"]
+        self.is_header = b["is_header"]
+        self.root_hash = b["root_hash"]
+
+
+def build_snapshot(n_revisions: int, filepath: str) -> None:
+    """Ingests a synthetic talk page history and writes its Intermediate to filepath."""
+    revisions = generate_talk_page_history(n_revisions)
+    accum = Intermediate()
+    for prev, rev in zip(revisions, revisions[1:]):
+        accum = _parse_diff([prev, rev], local_compare(prev["content"], rev["content"]), accum)
+    accum.set_filepath(filepath)
+    accum.write_to_disk()
+
+
+def load_plain(filepath: str) -> tuple:
+    with open(filepath, "r") as f:
+        obj = json.load(f)
+    blocks = {}
+    for h, b in obj["blocks"].items():
+        reply_chain = [h]
+        while obj["reply_parents"].get(reply_chain[-1]) is not None and len(reply_chain) <= len(obj["reply_parents"]):
+            reply_chain.append(obj["reply_parents"][reply_chain[-1]])
+        blocks[h] = PlainBlock(b, reply_chain[::-1])
+    return obj["hash_lookup"], blocks
+
+
+def load_compact(filepath: str) -> tuple:
+    accum = Intermediate(filepath)
+    return accum.hash_lookup, accum.blocks, accum.reply_parents
+
+
+def measure(load, filepath: str) -> int:
+    """Returns the bytes still allocated once load(filepath) has returned, holding on to its result."""
+    tracemalloc.start()
+    res = load(filepath)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del res
+    return current
+
+
+if __name__ == "__main__":
+    n_revisions = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    filepath = os.path.join(tempfile.mkdtemp(), "benchmark.json")
+    build_snapshot(n_revisions, filepath)
+    hash_lookup, blocks, _ = load_compact(filepath)
+    print("revisions: %d, blocks: %d, hash_lookup entries: %d, snapshot: %.1f MB"
+          % (n_revisions, len(blocks), len(hash_lookup), os.path.getsize(filepath) / 1e6))
+    del hash_lookup, blocks
+
+    plain = measure(load_plain, filepath)
+    compact = measure(load_compact, filepath)
+    print("dict-backed blocks: %8.1f MB" % (plain / 1e6))
+    print("compact blocks:     %8.1f MB (%.0f%% less)" % (compact / 1e6, 100 * (1 - compact / plain)))
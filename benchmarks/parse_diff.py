@@ -0,0 +1,88 @@
+"""Measures the per-revision cost of parsing compare responses, comparing the
+streaming DiffTableParser against the BeautifulSoup tree walk it replaced, and
+how _parse_diff splits between its stateless parse stage and its stateful apply
+stage, the former run in parse_workers processes.
+
+Usage: python -m benchmarks.parse_diff [n_revisions] [parse_workers]
+"""
+import os
+import sys
+import time
+
+from revision_pipeline.diff import parse_diff_table
+from revision_pipeline.intermediate import Intermediate
+from .synthetic import generate_talk_page_history, generate_compare_responses
+
+
+def bench_beautifulsoup(diffs: list) -> float:
+    from bs4 import BeautifulSoup
+    start = time.perf_counter()
+    for _, diff in diffs:
+        soup = BeautifulSoup(diff["compare"]["*"], features="lxml")
+        for tr in soup.find_all("tr")[1:]:
+            all_td = tr.find_all("td")
+            for td in all_td:
+                td.get_text()
+            if len(all_td) == 3 and all_td[1].a and all_td[1].a.get("class", [None])[0] == "mw-diff-movedpara-right":
+                soup.find("a", {"name": all_td[1].a["href"][1:]}).parent.get_text()
+    return time.perf_counter() - start
+
+
+def bench_diff_table_parser(diffs: list) -> float:
+    start = time.perf_counter()
+    for _, diff in diffs:
+        parse_diff_table(diff["compare"]["*"])
+    return time.perf_counter() - start
+
+
+def bench_parse_diff(diffs: list) -> float:
+    from revision_pipeline.pipeline import _parse_diff
+    accum = Intermediate()
+    start = time.perf_counter()
+    for revisions, diff in diffs:
+        _parse_diff(revisions, diff, accum)
+    return time.perf_counter() - start
+
+
+def bench_two_stage(diffs: list, parse_workers: int) -> tuple:
+    """Returns the time spent parsing all diffs into operations and applying them, and the time of
+    a build that parses in parse_workers processes while applying in this one."""
+    from revision_pipeline.pipeline import _parse_operations, _apply_operations, _iter_revision_operations
+    start = time.perf_counter()
+    operations = [_parse_operations(diff) for _, diff in diffs]
+    parse_time = time.perf_counter() - start
+    accum = Intermediate()
+    start = time.perf_counter()
+    for (revisions, _), ops in zip(diffs, operations):
+        _apply_operations(revisions, ops, accum)
+    apply_time = time.perf_counter() - start
+
+    accum = Intermediate()
+    start = time.perf_counter()
+    for revisions, ops in _iter_revision_operations(iter(diffs), parse_workers):
+        _apply_operations(revisions, ops, accum)
+    return parse_time, apply_time, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    parse_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+    diffs = generate_compare_responses(generate_talk_page_history(n))
+    print("revisions:", len(diffs))
+
+    parser_time = bench_diff_table_parser(diffs)
+    print("DiffTableParser:   %8.1f us/revision" % (1e6 * parser_time / len(diffs)))
+    try:
+        soup_time = bench_beautifulsoup(diffs)
+        print("BeautifulSoup:     %8.1f us/revision (%.1fx slower)" % (1e6 * soup_time / len(diffs), soup_time / parser_time))
+    except ImportError:
+        print("BeautifulSoup:     not installed, skipping")
+    try:
+        parse_time = bench_parse_diff(diffs)
+        print("_parse_diff total: %8.1f us/revision" % (1e6 * parse_time / len(diffs)))
+        parse_time, apply_time, two_stage_time = bench_two_stage(diffs, parse_workers)
+        print("  parse stage:     %8.1f us/revision" % (1e6 * parse_time / len(diffs)))
+        print("  apply stage:     %8.1f us/revision" % (1e6 * apply_time / len(diffs)))
+        print("two-stage, %d workers: %6.1f us/revision" % (parse_workers, 1e6 * two_stage_time / len(diffs)))
+    except ImportError as e:
+        print("_parse_diff total: skipped (%s)" % e)
@@ -0,0 +1,44 @@
+"""Records the API responses needed to build the Intermediates of talk pages from scratch into
+fixture files, which benchmarks.suite replays offline. Needs network access.
+
+Usage: python -m benchmarks.record [title ...]
+"""
+import os
+import sys
+import logging
+
+from revision_pipeline import pipeline
+from revision_pipeline.client import APIClient
+from revision_pipeline.fixtures import RecordingClient
+
+# the pages of the placeholder Intermediates in intermediate_format/
+DEFAULT_TITLES = ["Guy_Fieri", "Punk"]
+FIXTURE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+FIXTURE_SUFFIX = ".json.gz"
+
+
+def fixture_path(title: str) -> str:
+    return os.path.join(FIXTURE_FOLDER, title + FIXTURE_SUFFIX)
+
+
+def record(title: str) -> None:
+    """Builds the Intermediate of a page from scratch through a RecordingClient and saves its fixture."""
+    client = RecordingClient(APIClient(pipeline.BASE_API_URL), fixture_path(title))
+    cache = pipeline.get_diff_cache()
+    pipeline.set_client(client)
+    # every compare response has to reach the client to be recorded
+    pipeline.set_diff_cache(None)
+    try:
+        pipeline.generate_intermediate_from_scratch(title, concurrency=4)
+    finally:
+        pipeline.set_client(None)
+        pipeline.set_diff_cache(cache)
+    client.save()
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    os.makedirs(FIXTURE_FOLDER, exist_ok=True)
+    for title in sys.argv[1:] or DEFAULT_TITLES:
+        record(title)
+        print("%s: %.1f MB" % (fixture_path(title), os.path.getsize(fixture_path(title)) / 1e6))
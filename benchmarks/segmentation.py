@@ -0,0 +1,92 @@
+"""Measures segmenting every block of a page with deep threads into utterances, comparing
+Intermediate.segment_reply_chain with a shared cache (one walk of the reply tree) against
+materializing and segmenting the whole reply chain of each block, as the converters used to.
+
+Usage: python -m benchmarks.segmentation [n_threads] [depth]
+"""
+import sys
+import time
+
+from revision_pipeline import helpers
+from revision_pipeline.block import Block
+from revision_pipeline.helpers import compute_md5
+from revision_pipeline.intermediate import Intermediate
+
+USERS = ["Alice", "Bob", "Carol"]
+
+
+def build_deep_threads(n_threads: int, depth: int) -> Intermediate:
+    """Returns an Intermediate holding n_threads sections, each a single chain of depth replies, in
+    which users take turns and every third reply spans two paragraphs."""
+    accum = Intermediate()
+    for t in range(n_threads):
+        parent = None
+        for d in range(depth):
+            h = compute_md5("thread %d reply %d" % (t, d))
+            block = Block()
+            block.text = ":" * d + "reply %d" % d
+            block.timestamp = "2020-01-01T00:00:00Z"
+            block.user = USERS[d % len(USERS)]
+            block.revision_ids = [d + 1]
+            block.ingested = True
+            block.is_header = d == 0
+            block.is_followed = d % 3 == 1 and not block.is_header
+            block.root_hash = compute_md5("thread %d reply 0" % t)
+            if parent is not None and accum.blocks[parent].is_followed:
+                # the second paragraph of the reply above
+                block.user = accum.blocks[parent].user
+            accum.blocks[h] = block
+            accum.hash_lookup[h] = h
+            accum.reply_parents[h] = parent
+            parent = h
+    return accum
+
+
+def segment_per_block(accum: Intermediate) -> set:
+    complete_utterances = set()
+    for block_hash, block in accum.blocks.items():
+        segments = accum.segment_contiguous_blocks(accum.reply_chain(block_hash))
+        for seg in segments[:-1]:
+            complete_utterances.add(helpers.string_of_seg(seg))
+        if block.is_header or not accum.blocks[segments[-1][-1]].is_followed:
+            complete_utterances.add(helpers.string_of_seg(segments[-1]))
+    return complete_utterances
+
+
+def segment_shared(accum: Intermediate) -> set:
+    complete_utterances = set()
+    cache = {}
+    seen = set()
+    for block_hash, block in accum.blocks.items():
+        earlier, last = accum.segment_reply_chain(block_hash, cache)
+        for seg in helpers.unseen_segments(earlier, seen):
+            complete_utterances.add(helpers.string_of_seg(seg))
+        if block.is_header or not accum.blocks[last[-1]].is_followed:
+            complete_utterances.add(helpers.string_of_seg(last))
+    return complete_utterances
+
+
+if __name__ == "__main__":
+    n_threads = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    depth = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    accum = build_deep_threads(n_threads, depth)
+    print("threads: %d, depth: %d, blocks: %d" % (n_threads, depth, len(accum.blocks)))
+
+    results = []
+    for name, segment in (("per-block chains", segment_per_block), ("shared prefixes", segment_shared)):
+        # reply chains are cached by the Intermediate, so start each run from a cold cache
+        accum.reply_parents._chains.clear()
+        start = time.perf_counter()
+        results.append(segment(accum))
+        elapsed = time.perf_counter() - start
+        print("%-16s %8.3f s (%6.2f us/block)" % (name, elapsed, 1e6 * elapsed / len(accum.blocks)))
+    assert(results[0] == results[1])
+    print("utterances: %d" % len(results[0]))
+
+    # linking a cached root below another chain must not leave the chains through it stale
+    first, last = compute_md5("thread 1 reply 0"), compute_md5("thread 0 reply %d" % (depth - 1))
+    leaf = compute_md5("thread 1 reply %d" % (depth - 1))
+    del accum.reply_parents[first]
+    assert(accum.reply_chain(leaf)[0] == first)
+    accum.reply_parents[first] = last
+    assert(accum.reply_chain(leaf)[:depth] == accum.reply_chain(last))
@@ -0,0 +1,137 @@
+"""Replays recorded API fixtures (see benchmarks.record) to measure the throughput of each stage
+of the pipeline offline: revisions/sec for _parse_diff, blocks/sec for convert_intermediate_to_corpus
+and rough_convert_intermediate_to_corpus, and MB/sec for writing and loading Intermediate snapshots.
+Without fixtures, a synthetic talk page history is measured instead. Results can be saved and
+compared against those of an earlier run, flagging the throughputs that dropped by more than the
+threshold (the exit status is then 1).
+
+Usage: python -m benchmarks.suite [--repeat N] [--save results.json] [--compare baseline.json]
+                                  [--threshold 0.1] [--synthetic n_revisions] [fixture ...]
+"""
+import os
+import sys
+import glob
+import json
+import time
+import platform
+import argparse
+import tempfile
+
+from revision_pipeline import pipeline
+from revision_pipeline.fixtures import ReplayClient
+from revision_pipeline.intermediate import Intermediate
+from .record import FIXTURE_FOLDER, FIXTURE_SUFFIX
+from .synthetic import generate_talk_page_history, generate_compare_responses
+
+
+def replay_diffs(filepath: str) -> list:
+    """Returns the ([previous revision, revision], diff) pairs of the page recorded in a fixture."""
+    title = "Talk:" + os.path.basename(filepath)[:-len(FIXTURE_SUFFIX)]
+    pipeline.set_client(ReplayClient(filepath))
+    pipeline.set_diff_cache(None)
+    try:
+        revisions = pipeline._get_revisions_since_revid(title, pipeline._get_first_revision_id(title))
+        return list(pipeline._iter_revision_diffs(title, revisions))
+    finally:
+        pipeline.set_client(None)
+
+
+def best_time(f, repeat: int) -> tuple:
+    """Returns the shortest of repeat timed calls of f, and the result of the last one."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        res = f()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, res
+
+
+def measure(diffs: list, repeat: int) -> dict:
+    """Measures each stage of the pipeline on the revisions of a single page."""
+    def build():
+        accum = Intermediate()
+        for revisions, diff in diffs:
+            pipeline._parse_diff(revisions, diff, accum)
+        return accum
+
+    parse_time, accum = best_time(build, repeat)
+    convert_time, _ = best_time(lambda: pipeline.convert_intermediate_to_corpus(accum), repeat)
+    rough_time, _ = best_time(lambda: pipeline.rough_convert_intermediate_to_corpus(accum), repeat)
+
+    filepath = os.path.join(tempfile.mkdtemp(), "suite.json")
+    accum.set_filepath(filepath)
+    write_time, _ = best_time(accum.compact, repeat)
+    load_time, _ = best_time(lambda: Intermediate(filepath), repeat)
+    snapshot_mb = os.path.getsize(filepath) / 1e6
+    os.remove(filepath)
+
+    return {
+        "revisions": len(diffs),
+        "blocks": len(accum.blocks),
+        "snapshot_mb": snapshot_mb,
+        "throughput": {
+            "parse_diff_revisions_per_sec": len(diffs) / parse_time,
+            "convert_blocks_per_sec": len(accum.blocks) / convert_time,
+            "rough_convert_blocks_per_sec": len(accum.blocks) / rough_time,
+            "write_mb_per_sec": snapshot_mb / write_time,
+            "load_mb_per_sec": snapshot_mb / load_time,
+        },
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Prints the throughputs of results relative to those of baseline, returning the
+    (page, metric) pairs that dropped by more than threshold."""
+    regressions = []
+    for page, res in results.items():
+        if page not in baseline:
+            continue
+        for metric, value in res["throughput"].items():
+            old = baseline[page]["throughput"].get(metric)
+            if not old:
+                continue
+            ratio = value / old
+            flag = ""
+            if ratio < 1 - threshold:
+                flag = "  REGRESSION"
+                regressions.append((page, metric))
+            print("%-12s %-30s %12.1f -> %12.1f (%+.0f%%)%s" % (page, metric, old, value, 100 * (ratio - 1), flag))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark suite replaying recorded API fixtures.")
+    parser.add_argument("fixtures", nargs="*", help="fixture files (default: all in %s)" % FIXTURE_FOLDER)
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each measurement, the fastest of which is kept")
+    parser.add_argument("--save", help="file to save the results to, as json")
+    parser.add_argument("--compare", help="results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative drop in throughput reported as a regression")
+    parser.add_argument("--synthetic", type=int, default=1000,
+                        help="revisions of the synthetic history measured when there are no fixtures")
+    args = parser.parse_args()
+
+    fixtures = args.fixtures or sorted(glob.glob(os.path.join(FIXTURE_FOLDER, "*" + FIXTURE_SUFFIX)))
+    pages = {}
+    for filepath in fixtures:
+        pages[os.path.basename(filepath)[:-len(FIXTURE_SUFFIX)]] = lambda filepath=filepath: replay_diffs(filepath)
+    if len(pages) == 0:
+        print("no fixtures found (record some with python -m benchmarks.record); using a synthetic history")
+        pages["synthetic"] = lambda: generate_compare_responses(generate_talk_page_history(args.synthetic))
+
+    results = {}
+    for page, load_diffs in pages.items():
+        results[page] = res = measure(load_diffs(), args.repeat)
+        print("%s: %d revisions, %d blocks, %.1f MB snapshot" % (page, res["revisions"], res["blocks"], res["snapshot_mb"]))
+        for metric, value in res["throughput"].items():
+            print("  %-30s %12.1f" % (metric, value))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"python": platform.python_version(), "platform": platform.platform(),
+                       "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "results": results}, f, indent=2)
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)["results"]
+        if len(compare(results, baseline, args.threshold)) > 0:
+            sys.exit(1)
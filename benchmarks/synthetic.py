@@ -0,0 +1,72 @@
+import random
+
+USERS = ["Alice", "Bob", "Carol", "Dan", "Erin", "Frank"]
+WORDS = ("the article should mention that sources disagree about this claim and "
+         "i think we need a better citation before it goes back in agreed").split()
+
+
+def _sentence(rnd: random.Random, n: int = 25) -> str:
+    return " ".join(rnd.choice(WORDS) for _ in range(n))
+
+
+def generate_talk_page_history(n_revisions: int, seed: int = 0, max_depth: int = 6) -> list:
+    """Generates a deterministic synthetic talk page history: sections are opened, replied to
+    at increasing depth, edited, moved and occasionally removed.
+
+    :param n_revisions: number of revisions to generate
+    :type n_revisions: int
+    :param seed: random seed
+    :type seed: int
+    :param max_depth: maximum reply depth (number of ":")
+    :type max_depth: int
+
+    :return: list of revisions, each with revid, timestamp, user and content (wikitext)
+    """
+    rnd = random.Random(seed)
+    lines = []
+    revisions = []
+    for r in range(n_revisions):
+        op = rnd.random()
+        if not lines or op < 0.1:
+            lines += ["== Section %d ==" % r, "%s --~~~~" % _sentence(rnd)]
+        elif op < 0.65:
+            i = rnd.randrange(len(lines))
+            depth = min(max_depth, len(lines[i]) - len(lines[i].lstrip(":")) + 1)
+            lines.insert(i + 1, ":" * depth + "%s (reply %d)" % (_sentence(rnd), r))
+        elif op < 0.75:
+            i = rnd.randrange(len(lines))
+            depth = min(max_depth, len(lines[i]) - len(lines[i].lstrip(":")) + 1)
+            lines[i + 1:i + 1] = [":" * depth + "%s (reply %d)" % (_sentence(rnd), r),
+                                  ":" * depth + "%s (continued %d)" % (_sentence(rnd), r)]
+        elif op < 0.9:
+            i = rnd.randrange(len(lines))
+            if not lines[i].startswith("="):
+                lines[i] = lines[i] + " %s (edit %d)" % (rnd.choice(WORDS), r)
+        elif op < 0.95 and len(lines) > 4:
+            i = rnd.randrange(len(lines))
+            if not lines[i].startswith("="):
+                lines.insert(rnd.randrange(len(lines)), lines.pop(i))
+        elif len(lines) > 4:
+            i = rnd.randrange(len(lines))
+            if not lines[i].startswith("="):
+                del lines[i]
+        revisions.append({
+            "revid": 1000 + r,
+            "timestamp": "2020-01-%02dT%02d:%02d:00Z" % (1 + r // 1440, (r // 60) % 24, r % 60),
+            "user": rnd.choice(USERS),
+            "content": "\n".join(lines),
+        })
+    return revisions
+
+
+def generate_compare_responses(revisions: list) -> list:
+    """Computes action=compare-shaped responses for each consecutive pair of revisions.
+
+    :param revisions: revisions as returned by generate_talk_page_history
+    :type revisions: list
+
+    :return: list of ([previous revision, revision], diff) pairs
+    """
+    from revision_pipeline.diff import local_compare
+    return [([revisions[i-1], revisions[i]], local_compare(revisions[i-1]["content"], revisions[i]["content"]))
+            for i in range(1, len(revisions))]
@@ -0,0 +1,276 @@
+import os
+import sys
+import json
+import mmap
+import struct
+import tempfile
+from collections.abc import MutableMapping
+from .block import Block, RevisionIds
+
+BINARY_SUFFIX = ".bin"
+MAGIC = b"RPINTBIN"
+FORMAT_VERSION = 1
+
+# magic, format version, length of the json metadata, number of blocks
+HEADER = struct.Struct("<8sIQQ")
+# md5 digest of the block's text (its hash), offset and length of its record
+INDEX_ENTRY = struct.Struct("<16sQI")
+# flags, lengths of the text, timestamp, user and root_hash (NONE_LENGTH for None), number of revision ids
+RECORD_HEADER = struct.Struct("<BIHHHI")
+NONE_LENGTH = 0xFFFF
+NONE_TEXT_LENGTH = 0xFFFFFFFF
+
+INGESTED_KNOWN = 1
+INGESTED = 2
+IS_FOLLOWED = 4
+IS_HEADER = 8
+
+
+def is_binary_path(filepath: str) -> bool:
+    """Returns whether filepath names an Intermediate to be stored in the binary format."""
+    return filepath is not None and filepath.endswith(BINARY_SUFFIX)
+
+
+def is_binary_file(filepath: str) -> bool:
+    """Returns whether the file at filepath holds an Intermediate in the binary format."""
+    with open(filepath, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class BinaryBlocks(MutableMapping):
+    """Dict-like view of the blocks of an Intermediate stored in the binary format. The file is
+    memory-mapped and a block record is only decoded into a Block when the block is first accessed;
+    Blocks accessed or assigned are kept, so that in-place modifications of them are written by the
+    next write_binary. Hashes are looked up by binary search in the index of the file, which is
+    sorted by digest.
+
+    :param filepath: location of the file (None for no file)
+    :type filepath: str
+
+    :ivar dirty: the hashes of blocks set or deleted since it was last cleared
+    :type dirty: set
+    """
+
+    def __init__(self, filepath: str = None) -> None:
+        self._cache = {}
+        self._deleted = set()
+        # the hashes of blocks of the file that are in _cache or _deleted
+        self._shadowed = set()
+        self.dirty = set()
+        self._mmap = None
+        self._count = 0
+        self._index_offset = 0
+        if filepath is not None:
+            self.remap(filepath)
+
+    def remap(self, filepath: str) -> None:
+        """Maps the file at filepath, which must hold every block of this mapping (e.g. just written by
+        write_binary), in place of the current one.
+
+        :return: None
+        """
+        with open(filepath, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, meta_length, count = HEADER.unpack_from(mm, 0)
+        assert(magic == MAGIC and version == FORMAT_VERSION)
+        if self._mmap is not None:
+            self._mmap.close()
+        self._mmap = mm
+        self._count = count
+        self._index_offset = HEADER.size + meta_length
+        self._deleted = set()
+        self._shadowed = set(self._cache)
+
+    def __getitem__(self, h: str) -> Block:
+        if h in self._cache:
+            return self._cache[h]
+        if h in self._deleted:
+            raise KeyError(h)
+        entry = self._find(h)
+        if entry is None:
+            raise KeyError(h)
+        block = decode_block(self._mmap, entry[0])
+        self._cache[h] = block
+        self._shadowed.add(h)
+        return block
+
+    def __setitem__(self, h: str, block: Block) -> None:
+        if h not in self._cache and self._find(h) is not None:
+            self._shadowed.add(h)
+        self._cache[h] = block
+        self._deleted.discard(h)
+        self.dirty.add(h)
+
+    def __delitem__(self, h: str) -> None:
+        if h not in self:
+            raise KeyError(h)
+        self._cache.pop(h, None)
+        if self._find(h) is not None:
+            self._deleted.add(h)
+            self._shadowed.add(h)
+        self.dirty.add(h)
+
+    def __contains__(self, h) -> bool:
+        if h in self._cache:
+            return True
+        return h not in self._deleted and self._find(h) is not None
+
+    def __iter__(self):
+        keys = list(self._cache)
+        for digest, _, _ in INDEX_ENTRY.iter_unpack(self._index()):
+            h = digest.hex()
+            if h not in self._shadowed:
+                keys.append(sys.intern(h))
+        return iter(keys)
+
+    def __len__(self) -> int:
+        return len(self._cache) + self._count - len(self._shadowed)
+
+    def items(self):
+        """Iterates over (hash, Block) pairs, decoding the blocks that have not been accessed without keeping them."""
+        # blocks accessed while iterating are still yielded from the file
+        shadowed = set(self._shadowed)
+        for h, block in list(self._cache.items()):
+            yield h, block
+        for digest, offset, _ in INDEX_ENTRY.iter_unpack(self._index()):
+            h = digest.hex()
+            if h not in shadowed:
+                yield sys.intern(h), decode_block(self._mmap, offset)
+
+    def values(self):
+        for _, block in self.items():
+            yield block
+
+    def raw_records(self):
+        """Iterates over (digest, record) pairs of the blocks of the file that have not been accessed, assigned or
+        deleted, whose records can be copied as they are."""
+        for digest, offset, length in INDEX_ENTRY.iter_unpack(self._index()):
+            if digest.hex() not in self._shadowed:
+                yield digest, self._mmap[offset:offset + length]
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+            self._count = 0
+
+    def _index(self) -> bytes:
+        """Returns a copy of the index of the file (a view would keep the file from being unmapped)."""
+        if self._count == 0:
+            return b""
+        return self._mmap[self._index_offset:self._index_offset + self._count * INDEX_ENTRY.size]
+
+    def _find(self, h: str) -> tuple:
+        """Returns the (offset, length) of the record of h in the file, or None."""
+        if self._count == 0:
+            return None
+        try:
+            digest = bytes.fromhex(h)
+        except (TypeError, ValueError):
+            return None
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self._index_offset + mid * INDEX_ENTRY.size
+            key = self._mmap[start:start + 16]
+            if key < digest:
+                lo = mid + 1
+            elif key > digest:
+                hi = mid
+            else:
+                _, offset, length = INDEX_ENTRY.unpack_from(self._mmap, start)
+                return offset, length
+        return None
+
+
+def encode_block(block: Block) -> bytes:
+    """Returns the binary record of a Block."""
+    flags = 0
+    if block.ingested is not None:
+        flags |= INGESTED_KNOWN
+        if block.ingested:
+            flags |= INGESTED
+    if block.is_followed:
+        flags |= IS_FOLLOWED
+    if block.is_header:
+        flags |= IS_HEADER
+    text, timestamp, user, root_hash = (None if s is None else s.encode("utf-8")
+                                        for s in (block.text, block.timestamp, block.user, block.root_hash))
+    revision_ids = b"" if block.revision_ids is None else block.revision_ids.tobytes()
+    header = RECORD_HEADER.pack(flags, NONE_TEXT_LENGTH if text is None else len(text),
+                                *(NONE_LENGTH if s is None else len(s) for s in (timestamp, user, root_hash)),
+                                len(revision_ids) // 8)
+    return b"".join([header, text or b"", timestamp or b"", user or b"", root_hash or b"", revision_ids])
+
+
+def decode_block(buf, offset: int) -> Block:
+    """Returns the Block whose record starts at offset in buf."""
+    flags, text_length, timestamp_length, user_length, root_length, n_revisions = RECORD_HEADER.unpack_from(buf, offset)
+    offset += RECORD_HEADER.size
+    fields = []
+    for length, none_length in ((text_length, NONE_TEXT_LENGTH), (timestamp_length, NONE_LENGTH),
+                                (user_length, NONE_LENGTH), (root_length, NONE_LENGTH)):
+        if length == none_length:
+            fields.append(None)
+        else:
+            fields.append(buf[offset:offset + length].decode("utf-8"))
+            offset += length
+    block = Block()
+    block.text, block.timestamp, block.user, block.root_hash = fields
+    block.ingested = bool(flags & INGESTED) if flags & INGESTED_KNOWN else None
+    block.is_followed = bool(flags & IS_FOLLOWED)
+    block.is_header = bool(flags & IS_HEADER)
+    block.revision_ids = RevisionIds.frombytes(buf[offset:offset + 8 * n_revisions])
+    return block
+
+
+def read_metadata(filepath: str) -> dict:
+    """Returns the hash_lookup, reply_parents, revisions and generation stored in a binary file, without its blocks."""
+    with open(filepath, "rb") as f:
+        magic, version, meta_length, _ = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("%s is not a binary Intermediate" % filepath)
+        if version != FORMAT_VERSION:
+            raise ValueError("%s has unsupported binary format version %d" % (filepath, version))
+        return json.loads(f.read(meta_length))
+
+
+def write_binary(filepath: str, metadata: dict, blocks) -> None:
+    """Writes an Intermediate in the binary format to a temporary file next to filepath, then renames it
+    over filepath. Records of a BinaryBlocks that were not accessed are copied without being decoded.
+
+    :param filepath: the destination of the file
+    :type filepath: str
+    :param metadata: the json-serializable hash_lookup, reply_parents, revisions and generation
+    :type metadata: dict
+    :param blocks: the blocks of the Intermediate
+    :type blocks: dict
+
+    :return: None
+    """
+    records = []
+    if isinstance(blocks, BinaryBlocks):
+        records += blocks.raw_records()
+        records += ((bytes.fromhex(h), encode_block(b)) for h, b in blocks._cache.items())
+    else:
+        records += ((bytes.fromhex(h), encode_block(b)) for h, b in blocks.items())
+    records.sort(key=lambda r: r[0])
+
+    meta = json.dumps(metadata).encode("utf-8")
+    offset = HEADER.size + len(meta) + INDEX_ENTRY.size * len(records)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filepath)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(meta), len(records)))
+            f.write(meta)
+            for digest, record in records:
+                f.write(INDEX_ENTRY.pack(digest, offset, len(record)))
+                offset += len(record)
+            for _, record in records:
+                f.write(record)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
@@ -1,8 +1,87 @@
+import sys
+from array import array
+
+UNKNOWN_REVISION = "unknown"
+
+
+class RevisionIds:
+    """A compact list of revision ids, backed by an array of 64-bit integers. Behaves like the
+    list it replaces, including the "unknown" placeholder for blocks that were on the page
+    before the first ingested revision (stored as 0, which is never a revision id).
+
+    :param ids: the initial revision ids
+    :type ids: iterable
+    """
+
+    __slots__ = ("_ids",)
+
+    def __init__(self, ids=()) -> None:
+        self._ids = array("q", (self._encode(i) for i in ids))
+
+    def append(self, revision_id) -> None:
+        self._ids.append(self._encode(revision_id))
+
+    def to_list(self) -> list:
+        """Returns the revision ids as a json-serializable list."""
+        return [self._decode(i) for i in self._ids]
+
+    def tobytes(self) -> bytes:
+        """Returns the revision ids as little-endian 64-bit integers (0 for "unknown")."""
+        ids = self._ids
+        if sys.byteorder != "little":
+            ids = array("q", ids)
+            ids.byteswap()
+        return ids.tobytes()
+
+    @classmethod
+    def frombytes(cls, data) -> "RevisionIds":
+        """Returns the revision ids stored in data by tobytes."""
+        res = cls()
+        res._ids.frombytes(data)
+        if sys.byteorder != "little":
+            res._ids.byteswap()
+        return res
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._decode(x) for x in self._ids[i]]
+        return self._decode(self._ids[i])
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __iter__(self):
+        return (self._decode(i) for i in self._ids)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, RevisionIds):
+            return self._ids == other._ids
+        return self.to_list() == other
+
+    def __repr__(self) -> str:
+        return repr(self.to_list())
+
+    @staticmethod
+    def _encode(revision_id) -> int:
+        return 0 if revision_id == UNKNOWN_REVISION else revision_id
+
+    @staticmethod
+    def _decode(i: int):
+        return UNKNOWN_REVISION if i == 0 else i
+
+
 class Block:
     """Represents a single edit block as viewable in the revision history window
     on Wikipedia. Most revisions modify several blocks, as usually each paragraph
     constitutes its own block.
 
+    The chain of blocks a block replies to is not stored in the Block but in the reply_parents
+    of its Intermediate (see Intermediate.reply_chain).
+
+    Blocks are compact: attributes live in __slots__, hashes, usernames and timestamps
+    are interned so that each distinct value is stored once however many blocks refer
+    to it, and revision ids are kept in a RevisionIds array.
+
     :ivar text: the text contained in the block
     :type text: str
     :ivar timestamp: the time of the revision in which the block was last edited
@@ -11,26 +90,60 @@ class Block:
     :ivar ingested: whether this block was added in a revision or just recognized to have been on the page before the revisions ingested
     :type ingested: bool
     :ivar revision_ids: a list of page revisions that edited this block, chronologically
-    :type revision_ids: list
-    :ivar reply_chain: the list of blocks that this block is in a reply_chain with. Includes blocks before this block that were added in the same revision.
-    :type reply_chain: list
+    :type revision_ids: RevisionIds
     :ivar is_followed: whether this block has another text block following it in the same revision (e.g. if this is the first of two paragraphs added in a revision)
     :type is_followed: bool
     :ivar is_header: whether this block is a signifier of a new header / discussion
     :type is_header: bool
     """
 
+    __slots__ = ("text", "_timestamp", "_user", "ingested", "_revision_ids",
+                 "is_followed", "is_header", "_root_hash")
+
     def __init__(self):
         self.text = None
         self.timestamp = None
         self.user = None
         self.ingested = None
         self.revision_ids = None
-        self.reply_chain = None
         self.is_followed = False
         self.is_header = False
         self.root_hash = None
 
+    @property
+    def timestamp(self) -> str:
+        return self._timestamp
+
+    @timestamp.setter
+    def timestamp(self, timestamp: str) -> None:
+        self._timestamp = _intern(timestamp)
+
+    @property
+    def user(self) -> str:
+        return self._user
+
+    @user.setter
+    def user(self, user: str) -> None:
+        self._user = _intern(user)
+
+    @property
+    def revision_ids(self) -> RevisionIds:
+        return self._revision_ids
+
+    @revision_ids.setter
+    def revision_ids(self, revision_ids) -> None:
+        if revision_ids is not None and not isinstance(revision_ids, RevisionIds):
+            revision_ids = RevisionIds(revision_ids)
+        self._revision_ids = revision_ids
+
+    @property
+    def root_hash(self) -> str:
+        return self._root_hash
+
+    @root_hash.setter
+    def root_hash(self, root_hash: str) -> None:
+        self._root_hash = _intern(root_hash)
+
     def __str__(self):
         res = "-----------------------------\n"
         res += "text: " + self.text + "\n"
@@ -38,9 +151,13 @@ class Block:
         res += "user: " + (self.user if self.user else "None") + "\n"
         res += "ingested: " + str(self.ingested) + "\n"
         res += "revision_ids: " + str(self.revision_ids) + "\n"
-        res += "reply_chain: " + str(self.reply_chain) + "\n"
         res += "is_followed: " + str(self.is_followed) + "\n"
         res += "is_header: " + str(self.is_header) + "\n"
         res += "root_hash: " + self.root_hash + "\n"
         res += "-----------------------------"
         return res
+
+
+def _intern(s):
+    """Interns s if it is a string, so that equal strings share a single object."""
+    return sys.intern(s) if type(s) is str else s
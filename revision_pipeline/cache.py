@@ -0,0 +1,141 @@
+import os
+import json
+import zlib
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = 1024 ** 3
+CACHE_FILE_SUFFIX = ".json.z"
+
+
+class DiffCache:
+    """An on-disk cache of compare API responses keyed by (wiki, fromrev, torev).
+    Revision diffs never change, so entries never expire; they are only evicted,
+    least recently used first, once the cache grows beyond max_bytes. Each response
+    is stored zlib-compressed in its own file named after the hash of its key.
+    Safe to share between threads.
+
+    :param directory: the directory holding the cache files (created if it does not exist)
+    :type directory: str
+    :param max_bytes: the maximum total size of the compressed cache files
+    :type max_bytes: int
+
+    :ivar hits: number of lookups answered from the cache
+    :type hits: int
+    :ivar misses: number of lookups not found in the cache
+    :type misses: int
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index = OrderedDict()
+        self._total_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def get(self, wiki: str, fromid: int, toid: int) -> dict:
+        """Returns the cached compare response for the given revisions, or None.
+
+        :param wiki: identifier of the wiki (e.g. its API url)
+        :type wiki: str
+        :param fromid: the "before" revision
+        :type fromid: int
+        :param toid: the "after" revision
+        :type toid: int
+
+        :return: the json-formatted comparison, or None if it is not cached
+        """
+        name = self._file_name(wiki, fromid, toid)
+        with self._lock:
+            if name not in self._index:
+                self.misses += 1
+                return None
+            self._index.move_to_end(name)
+        try:
+            with open(os.path.join(self.directory, name), "rb") as f:
+                res = json.loads(zlib.decompress(f.read()).decode("utf-8"))
+        except (OSError, zlib.error, ValueError) as e:
+            logging.debug(e, exc_info=True)
+            logging.warning("Dropping unreadable diff cache entry %s", name)
+            self._discard(name)
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        try:
+            os.utime(os.path.join(self.directory, name))
+        except OSError:
+            pass
+        return res
+
+    def put(self, wiki: str, fromid: int, toid: int, response: dict) -> None:
+        """Stores a compare response, evicting the least recently used entries if the cache is full.
+
+        :param wiki: identifier of the wiki (e.g. its API url)
+        :type wiki: str
+        :param fromid: the "before" revision
+        :type fromid: int
+        :param toid: the "after" revision
+        :type toid: int
+        :param response: the json-formatted comparison between the two revisions
+        :type response: dict
+
+        :return: None
+        """
+        name = self._file_name(wiki, fromid, toid)
+        data = zlib.compress(json.dumps(response).encode("utf-8"))
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(self.directory, name))
+        with self._lock:
+            self._total_bytes += len(data) - self._index.pop(name, 0)
+            self._index[name] = len(data)
+            evicted = []
+            while self._total_bytes > self.max_bytes and len(self._index) > 1:
+                old_name, old_size = self._index.popitem(last=False)
+                self._total_bytes -= old_size
+                evicted.append(old_name)
+        for old_name in evicted:
+            try:
+                os.remove(os.path.join(self.directory, old_name))
+            except OSError:
+                pass
+
+    def size(self) -> int:
+        """Returns the total size in bytes of the compressed cache entries."""
+        return self._total_bytes
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def _file_name(self, wiki: str, fromid: int, toid: int) -> str:
+        key = "%s|%s|%s" % (wiki, fromid, toid)
+        return hashlib.sha1(key.encode("utf-8")).hexdigest() + CACHE_FILE_SUFFIX
+
+    def _discard(self, name: str) -> None:
+        with self._lock:
+            self._total_bytes -= self._index.pop(name, 0)
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    def _load_index(self) -> None:
+        """Indexes the entries already on disk, least recently used first."""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(CACHE_FILE_SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._index[name] = size
+            self._total_bytes += size
@@ -0,0 +1,224 @@
+import time
+import random
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+from .metrics import get_metrics
+
+DEFAULT_USER_AGENT = "revision_pipeline/0.1 (https://github.com/lucasvanbramer/4999)"
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """A thread-safe token bucket limiting the rate at which requests are issued.
+
+    :param rate: number of tokens added to the bucket per second
+    :type rate: float
+    :param capacity: maximum number of tokens the bucket can hold (the allowed burst)
+    :type capacity: int
+    """
+
+    def __init__(self, rate: float, capacity: int = 1) -> None:
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self._tokens = float(self.capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Blocks until a token is available, then consumes it.
+
+        :return: None
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class EndpointStats:
+    """Latency and outcome counters for a single API endpoint (the "action" parameter).
+
+    :ivar count: number of requests that received a response
+    :type count: int
+    :ivar errors: number of requests that failed after all retries
+    :type errors: int
+    :ivar retries: number of retried attempts
+    :type retries: int
+    :ivar total_latency: sum of response latencies in seconds
+    :type total_latency: float
+    :ivar min_latency: fastest response latency in seconds
+    :type min_latency: float
+    :ivar max_latency: slowest response latency in seconds
+    :type max_latency: float
+    """
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.total_latency = 0.0
+        self.min_latency = None
+        self.max_latency = None
+
+    def record(self, latency: float) -> None:
+        self.count += 1
+        self.total_latency += latency
+        self.min_latency = latency if self.min_latency is None else min(self.min_latency, latency)
+        self.max_latency = latency if self.max_latency is None else max(self.max_latency, latency)
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "retries": self.retries,
+            "mean_latency": self.total_latency / self.count if self.count else None,
+            "min_latency": self.min_latency,
+            "max_latency": self.max_latency,
+        }
+
+
+class APIClient:
+    """A reusable client for the MediaWiki action API. Keeps connections alive
+    through a pooled requests.Session, limits the request rate with a token
+    bucket, retries transient failures and maxlag responses with jittered
+    exponential backoff, and records per-endpoint latency statistics.
+    Safe to share between threads.
+
+    :param base_url: the api.php endpoint to query
+    :type base_url: str
+    :param rate: maximum sustained requests per second (None for no limit)
+    :type rate: float
+    :param burst: number of requests that may be issued back to back before rate limiting applies
+    :type burst: int
+    :param max_retries: number of times a failed request is retried
+    :type max_retries: int
+    :param backoff: base delay in seconds for exponential backoff between retries
+    :type backoff: float
+    :param max_backoff: upper bound in seconds on a single backoff delay
+    :type max_backoff: float
+    :param maxlag: value of the maxlag parameter sent with each request (None to omit)
+    :type maxlag: int
+    :param pool_size: number of connections kept alive in the pool
+    :type pool_size: int
+    :param timeout: timeout in seconds for each request
+    :type timeout: float
+    :param user_agent: User-Agent header sent with each request
+    :type user_agent: str
+    """
+
+    def __init__(self, base_url: str, rate: float = None, burst: int = 1,
+                 max_retries: int = 5, backoff: float = 0.5, max_backoff: float = 30.0,
+                 maxlag: int = 5, pool_size: int = 16, timeout: float = 30.0,
+                 user_agent: str = DEFAULT_USER_AGENT) -> None:
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.maxlag = maxlag
+        self.timeout = timeout
+        self._bucket = TokenBucket(rate, burst) if rate else None
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = user_agent
+
+    def set_rate(self, rate: float, burst: int = 1) -> None:
+        """Changes the limit on the request rate.
+
+        :param rate: maximum sustained requests per second (None for no limit)
+        :type rate: float
+        :param burst: number of requests that may be issued back to back before rate limiting applies
+        :type burst: int
+
+        :return: None
+        """
+        self._bucket = TokenBucket(rate, burst) if rate else None
+
+    def query(self, params: dict) -> dict:
+        """Queries the API, retrying transient failures.
+
+        :param params: API parameters
+        :type params: dict
+
+        :return: json-formatted response from API
+        """
+        params = dict(params)
+        params["format"] = "json"
+        if self.maxlag is not None:
+            params.setdefault("maxlag", self.maxlag)
+        endpoint = params.get("action", "unknown")
+
+        attempt = 0
+        while True:
+            if self._bucket:
+                self._bucket.acquire()
+            retry_after = None
+            start = time.monotonic()
+            try:
+                response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+                latency = time.monotonic() - start
+                self._endpoint_stats(endpoint, lambda s: s.record(latency))
+                if response.status_code in RETRY_STATUS_CODES:
+                    retry_after = response.headers.get("Retry-After")
+                    raise requests.HTTPError("HTTP %d" % response.status_code, response=response)
+                response.raise_for_status()
+                response_json = response.json()
+                if response_json.get("error", {}).get("code") == "maxlag":
+                    retry_after = response.headers.get("Retry-After")
+                    raise requests.HTTPError("maxlag: " + response_json["error"].get("info", ""), response=response)
+                get_metrics().increment("api_response_bytes_total", len(response.content), action=endpoint)
+                return response_json
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                if attempt >= self.max_retries or not self._is_retryable(e):
+                    self._endpoint_stats(endpoint, lambda s: setattr(s, "errors", s.errors + 1))
+                    raise
+                delay = self._backoff_delay(attempt, retry_after)
+                logging.debug("retrying %s request in %.2fs after: %s", endpoint, delay, e)
+                self._endpoint_stats(endpoint, lambda s: setattr(s, "retries", s.retries + 1))
+                attempt += 1
+                time.sleep(delay)
+
+    def stats(self) -> dict:
+        """Returns the per-endpoint request statistics collected so far.
+
+        :return: a dictionary mapping endpoint names to dicts of statistics
+        """
+        with self._stats_lock:
+            return {k: v.to_dict() for k, v in self._stats.items()}
+
+    def close(self) -> None:
+        self.session.close()
+
+    def _is_retryable(self, e: Exception) -> bool:
+        if isinstance(e, requests.HTTPError) and e.response is not None:
+            return e.response.status_code in RETRY_STATUS_CODES or e.response.status_code == 200
+        return True
+
+    def _backoff_delay(self, attempt: int, retry_after: str = None) -> float:
+        """Returns the delay before the next attempt: the server's Retry-After if given,
+        otherwise exponential backoff with full jitter."""
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def _endpoint_stats(self, endpoint: str, update) -> None:
+        with self._stats_lock:
+            if endpoint not in self._stats:
+                self._stats[endpoint] = EndpointStats()
+            update(self._stats[endpoint])
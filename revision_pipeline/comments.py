@@ -1,7 +1,9 @@
 from .intermediate import Intermediate
 from . import helpers
-from .pipeline import get_intermediate
-import time
+from .client import APIClient
+from .pipeline import get_intermediate, update_intermediate, get_client, set_client, DEFAULT_CHECKPOINT_REVISIONS, DEFAULT_CHECKPOINT_SECONDS
+from .scheduler import PollScheduler, estimate_edit_rate, RATE_ESTIMATE_REVISIONS, DEFAULT_MIN_INTERVAL, DEFAULT_MAX_INTERVAL, DEFAULT_MAX_CONCURRENCY
+import asyncio
 import copy
 
 
@@ -30,6 +32,9 @@ class CommentCorpus:
 
     def __init__(self, title: str = None):
         self.comment_lookup = {}
+        # the hashes of the blocks of each comment, and the comment each block belongs to
+        self.comment_blocks = {}
+        self.reverse_block_index = {}
         if title:
             accum = get_intermediate(title)
             self.convert_intermediate_to_corpus(accum, title)
@@ -42,25 +47,112 @@ class CommentCorpus:
 
         :return: the CommentCorpus generated from accum
         """
-        users = {}
-        utterances = []
-        unknown_len = set()
+        self.comment_lookup = {}
+        self.comment_blocks = {}
+        self.reverse_block_index = {}
+        comments, comment_blocks = self._comments_from_blocks(accum, accum.blocks.items(), title)
+        for u_id, comment in comments.items():
+            self._add_comment(comment, comment_blocks[u_id])
+        return None
+
+    def update(self, accum: Intermediate, title: str, changed_blocks: set) -> list:
+        """Updates the CommentCorpus with the blocks of accum changed since it was last converted or updated,
+        leaving all other comments untouched.
+
+        :param accum: the Intermediate the CommentCorpus was converted from, since updated
+        :type accum: Intermediate
+        :param title: the title of the talk page of the Intermediate
+        :type title: str
+        :param changed_blocks: the hashes of the blocks changed since the last update, from Intermediate.take_changed_blocks()
+        :type changed_blocks: set
+
+        :return: list of the Comments that are new or whose text changed
+        """
+        # as in update_corpus, comments containing a changed block are rebuilt from their remaining
+        # blocks (or dropped), along with the comments replying to them or rooted at them
+        stale_ids = {self.reverse_block_index[h] for h in changed_blocks if h in self.reverse_block_index}
+        stale_ids |= {c.id for c in self.comment_lookup.values() if c.parent_id in stale_ids or c.root in stale_ids}
+        # a comment may only be complete as part of the reply chain of a block replying to it, so the
+        # comments that stale ones reply to are re-evaluated as well, and the replies to stale comments rebuilt
+        stale_ids |= {self.comment_lookup[u_id].parent_id for u_id in stale_ids
+                      if u_id in self.comment_lookup and self.comment_lookup[u_id].parent_id in self.comment_lookup}
+        replies_to_stale = {c.id for c in self.comment_lookup.values() if c.parent_id in stale_ids}
+        to_rebuild = {h for h in changed_blocks if h in accum.blocks}
+        relevant = set(changed_blocks)
+        for u_id in stale_ids | replies_to_stale:
+            for h in self.comment_blocks[u_id]:
+                relevant.add(h)
+                ultimate_hash = accum.find_ultimate_hash(h)
+                if ultimate_hash in accum.blocks:
+                    to_rebuild.add(ultimate_hash)
+                    relevant.add(ultimate_hash)
+
+        blocks = [(h, accum.blocks[h]) for h in to_rebuild]
+        updated, comment_blocks = self._comments_from_blocks(accum, blocks, title, relevant)
+        old_comments = {}
+        for u_id in stale_ids:
+            old_comments[u_id] = self._remove_comment(u_id)
+        res = []
+        for u_id, comment in updated.items():
+            old = old_comments.get(u_id)
+            if old is None:
+                old = self._remove_comment(u_id)
+            if old is None or old.body != comment.body:
+                res.append(comment)
+            self._add_comment(comment, comment_blocks[u_id])
+        return res
+
+    def _add_comment(self, comment: Comment, block_hashes: list) -> None:
+        """Adds a comment made of the given blocks, replacing any comment with the same id."""
+        self.comment_lookup[comment.id] = comment
+        self.comment_blocks[comment.id] = block_hashes
+        for h in block_hashes:
+            self.reverse_block_index[h] = comment.id
+
+    def _remove_comment(self, comment_id: str) -> Comment:
+        """Removes a comment and the entries of its blocks in the reverse block index, returning it (or None)."""
+        for h in self.comment_blocks.pop(comment_id, []):
+            if self.reverse_block_index.get(h) == comment_id:
+                del self.reverse_block_index[h]
+        return self.comment_lookup.pop(comment_id, None)
+
+    def _comments_from_blocks(self, accum: Intermediate, blocks, title: str, changed_blocks: set = None) -> dict:
+        """Builds the complete comments found in the reply chains of the given blocks.
+
+        :param accum: the Intermediate the blocks belong to
+        :type accum: Intermediate
+        :param blocks: iterable of (block hash, Block) pairs
+        :param title: the title of the talk page of the Intermediate
+        :type title: str
+        :param changed_blocks: if given, only comments containing one of these block hashes are built
+        :type changed_blocks: set
+
+        :return: a tuple (dictionary mapping comment ids to Comments, dictionary mapping comment ids to their block hashes)
+        """
+        res = {}
+        comment_blocks = {}
         complete_utterances = set()
         block_hashes_to_segments = {}
-        self.comment_lookup = {}
-        for block_hash, block in accum.blocks.items():
-            segments = accum.segment_contiguous_blocks(block.reply_chain)
-            for seg in segments[:-1]:
+        segmentation_cache = {}
+        seen_segments = set()
+        for block_hash, block in blocks:
+            earlier, last = accum.segment_reply_chain(block_hash, segmentation_cache)
+            for seg in helpers.unseen_segments(earlier, seen_segments):
                 sos = helpers.string_of_seg(seg)
                 complete_utterances.add(sos)
 
-            assert(block_hash == segments[-1][-1])
-            if block.is_header or not accum.blocks[segments[-1][-1]].is_followed:
-                complete_utterances.add(helpers.string_of_seg(segments[-1]))
-            block_hashes_to_segments[block_hash] = segments
+            assert(block_hash == last[-1])
+            if block.is_header or not accum.blocks[last[-1]].is_followed:
+                complete_utterances.add(helpers.string_of_seg(last))
+            block_hashes_to_segments[block_hash] = (earlier, last)
 
         for utt in iter(complete_utterances):
             block_hashes = utt.split(" ")
+            if changed_blocks is not None and changed_blocks.isdisjoint(block_hashes):
+                continue
+            if block_hashes[0] not in block_hashes_to_segments:
+                block_hashes_to_segments[block_hashes[0]] = accum.segment_reply_chain(
+                    block_hashes[0], segmentation_cache)
             belongs_to_segment = block_hashes_to_segments[block_hashes[0]]
             first_block = accum.blocks[block_hashes[0]]
 
@@ -72,25 +164,27 @@ class CommentCorpus:
             u_text = "\n".join([accum.blocks[h].text for h in block_hashes])
             this_comment = Comment(u_id, u_text, u_user,
                                    title, u_timestamp, u_replyto, u_root)
-            self.comment_lookup[u_id] = this_comment
+            res[u_id] = this_comment
+            comment_blocks[u_id] = block_hashes
 
-        return None
+        return res, comment_blocks
 
     def comment_ids(self) -> set:
         return set(self.comment_lookup.keys())
 
-    def _find_reply_to_from_segment(self, segment: list) -> str:
-        """Helper function. Finds the hash of the comment to which a comment given by the last segment in a list is replying.
+    def _find_reply_to_from_segment(self, segment: tuple) -> str:
+        """Helper function. Finds the hash of the comment to which a comment given by the last segment of a reply chain is replying.
 
-        :param segment: a list of block segments produced by Intermediate.segment_continuous_blocks()
-        :type segment: list
+        :param segment: a segmentation (earlier segments, last segment) produced by Intermediate.segment_reply_chain()
+        :type segment: tuple
 
-        :return: the hash of the block to which the last segment in the list is replying.
+        :return: the hash of the block to which the last segment is replying.
         """
-        if len(segment) == 1:
+        earlier = segment[0]
+        if earlier is None:
             return None
         else:
-            return segment[-2][0]
+            return earlier[0][0]
 
     def get_comment(self, comment_id: str) -> Comment:
         return self.comment_lookup.get(comment_id, None)
@@ -98,28 +192,104 @@ class CommentCorpus:
 
 class CommentGenerator():
     """
-    Interface for generator of live Wikipedia Talk page stream
+    Interface for generator of live Wikipedia Talk page stream. Keeps the Intermediate of each
+    topic in memory and, on every poll, only ingests the revisions past the last one it has seen,
+    writing the Intermediate back to disk whenever the poll ingested any.
+    Topics are polled concurrently by a PollScheduler, each at an interval adapted to its edit rate,
+    first estimated from the timestamps of its latest revisions.
+
+    :param topics: titles of the talk pages to be streamed
+    :type topics: list
+    :param client: the APIClient to share across all API queries (Optional)
+    :type client: APIClient
+    :param min_interval: shortest interval in seconds between two polls of a topic
+    :type min_interval: float
+    :param max_interval: longest interval in seconds between two polls of a topic
+    :type max_interval: float
+    :param requests_per_second: global budget of API requests per second across all topics, enforced by the shared APIClient (None for no limit)
+    :type requests_per_second: float
+    :param max_concurrency: maximum number of topics polled at once
+    :type max_concurrency: int
     """
 
-    def __init__(self, topics: list) -> None:
+    def __init__(self, topics: list, client: APIClient = None, min_interval: float = DEFAULT_MIN_INTERVAL,
+                 max_interval: float = DEFAULT_MAX_INTERVAL, requests_per_second: float = None,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY) -> None:
+        if client is not None:
+            set_client(client)
         self.topics = topics
+        self.intermediates = {}
         self.curr_corpora = {}
-        self.old_corpora_comment_ids = {}
+        if requests_per_second is not None:
+            # every API request of every poll takes a token, not just every poll
+            get_client().set_rate(requests_per_second)
         print("generating initial", len(self.topics), "corpora")
+        edit_rates = {}
         for topic in self.topics:
-            self.curr_corpora[topic] = CommentCorpus(topic)
-            self.old_corpora_comment_ids[topic] = self.curr_corpora[topic].comment_ids(
-            )
+            self.intermediates[topic] = get_intermediate(topic)
+            # the changes ingested to bring the Intermediate up to date are covered by the initial corpus
+            self.intermediates[topic].take_changed_blocks()
+            self.curr_corpora[topic] = CommentCorpus()
+            self.curr_corpora[topic].convert_intermediate_to_corpus(self.intermediates[topic], topic)
+            revisions = self.intermediates[topic].revisions
+            latest = [revisions[i] for i in range(max(0, len(revisions) - RATE_ESTIMATE_REVISIONS), len(revisions))]
+            edit_rates[topic] = estimate_edit_rate([r[2] for r in latest if len(r) > 2])
+        self.scheduler = PollScheduler(topics, self._poll_topic, min_interval, max_interval,
+                                       max_concurrency=max_concurrency, edit_rates=edit_rates)
 
-    def stream(self):
-        assert(len(self.topics) > 0)
-        while True:
-            for topic in self.topics:
-                self.old_corpora_comment_ids[topic] = self.curr_corpora[topic].comment_ids(
-                )
-                self.curr_corpora[topic] = CommentCorpus(topic)
-                new_comments = self.curr_corpora[topic].comment_ids(
-                ).difference(self.old_corpora_comment_ids[topic])
+    def poll(self, topic: str) -> list:
+        """Ingests the revisions of a topic made since the last poll.
+
+        :param topic: title of the talk page to poll
+        :type topic: str
+
+        :return: list of the Comments of that topic that are new or whose text changed
+        """
+        return self._poll_topic(topic)[0]
+
+    async def astream(self):
+        """Asynchronously yields, for each poll that found new or changed comments, a list of (topic, Comment) pairs."""
+        polls = self.scheduler.run()
+        try:
+            async for topic, new_comments in polls:
                 if len(new_comments) > 0:
-                    yield [(topic, self.curr_corpora[topic].get_comment[c]) for c in new_comments]
-            time.sleep(2)
+                    yield [(topic, c) for c in new_comments]
+        finally:
+            await polls.aclose()
+
+    def stream(self):
+        """Yields, for each poll that found new or changed comments, a list of (topic, Comment) pairs."""
+        loop = asyncio.new_event_loop()
+        agen = self.astream()
+        try:
+            while True:
+                yield loop.run_until_complete(agen.__anext__())
+        finally:
+            loop.run_until_complete(agen.aclose())
+            loop.close()
+
+    def stats(self) -> dict:
+        """Returns the polling state and lag metrics of every topic (see TopicState).
+
+        :return: a dictionary mapping topics to dicts of metrics
+        """
+        return self.scheduler.stats()
+
+    def _poll_topic(self, topic: str) -> tuple:
+        """Polls a topic, returning a tuple (new or changed Comments, number of revisions ingested,
+        timestamp of the first of them or None)."""
+        accum = self.intermediates[topic]
+        before = len(accum.revisions)
+        accum = update_intermediate(topic, accum, checkpoint_revisions=DEFAULT_CHECKPOINT_REVISIONS,
+                                    checkpoint_seconds=DEFAULT_CHECKPOINT_SECONDS)
+        self.intermediates[topic] = accum
+        new_revisions = len(accum.revisions) - before
+        if new_revisions > 0 and accum.get_filepath() is not None:
+            # persists the streamed revisions, which also empties the in-memory journal
+            accum.write_to_disk()
+        first_revision = accum.revisions[before] if new_revisions > 0 else None
+        first_timestamp = first_revision[2] if first_revision is not None and len(first_revision) > 2 else None
+        changed_blocks = accum.take_changed_blocks()
+        if len(changed_blocks) == 0:
+            return [], new_revisions, first_timestamp
+        return self.curr_corpora[topic].update(accum, topic, changed_blocks), new_revisions, first_timestamp
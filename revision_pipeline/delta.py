@@ -0,0 +1,50 @@
+class RevisionDelta:
+    """The changes a single revision made to the blocks of a talk page, as yielded by
+    pipeline.iter_revision_deltas. Reply targets are resolved to the most recent hash of the
+    block replied to, as of the revision. A revision that failed partway (see is_error) lists the
+    changes made by the operations applied before the failure, which stay in the Intermediate.
+
+    :ivar revid: the id of the revision
+    :type revid: int
+    :ivar parent_revid: the id of the revision it follows
+    :type parent_revid: int
+    :ivar timestamp: datetime of the revision
+    :type timestamp: str
+    :ivar user: the user who made the revision
+    :type user: str
+    :ivar behavior: the behavior recorded for the revision in the Intermediate (["error"] if it failed)
+    :type behavior: list
+    :ivar added: the new blocks, each a dict with hash, text, reply_to and root_hash
+    :type added: list
+    :ivar modified: the edited blocks, each a dict with old_hash, hash, text, reply_to and root_hash
+    :type modified: list
+    :ivar moved: the moved blocks, each a dict with old_hash, hash and root_hash (the section moved to)
+    :type moved: list
+    :ivar removed: the hashes of the removed blocks
+    :type removed: list
+    """
+
+    __slots__ = ("revid", "parent_revid", "timestamp", "user", "behavior", "added", "modified", "moved", "removed")
+
+    def __init__(self, revid: int, parent_revid: int, timestamp: str, user: str, behavior: list) -> None:
+        self.revid = revid
+        self.parent_revid = parent_revid
+        self.timestamp = timestamp
+        self.user = user
+        self.behavior = behavior
+        self.added = []
+        self.modified = []
+        self.moved = []
+        self.removed = []
+
+    def is_error(self) -> bool:
+        """Returns whether the revision could not be processed in full."""
+        return self.behavior == ["error"]
+
+    def to_dict(self) -> dict:
+        """Returns the delta as a json-serializable dictionary."""
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    def __repr__(self) -> str:
+        return "RevisionDelta(%r, +%d ~%d >%d -%d)" % (self.revid, len(self.added), len(self.modified),
+                                                    len(self.moved), len(self.removed))
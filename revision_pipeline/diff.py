@@ -0,0 +1,237 @@
+import html
+import difflib
+from html.parser import HTMLParser
+
+CONTEXT_LINES = 2
+MODIFICATION_THRESHOLD = 0.5
+MOVE_THRESHOLD = 0.9
+
+
+class DiffCell:
+    """Represents a single <td> element of a MediaWiki diff table.
+
+    :ivar cls: the first css class of the cell (e.g. "diff-addedline"), or None
+    :type cls: str
+    :ivar text: the text contained in the cell
+    :type text: str
+    :ivar link_class: the first css class of the first link in the cell, or None
+    :type link_class: str
+    :ivar link_href: the href of the first link in the cell, or None
+    :type link_href: str
+    """
+
+    __slots__ = ("cls", "text", "link_class", "link_href")
+
+    def __init__(self, cls: str = None, text: str = "", link_class: str = None, link_href: str = None) -> None:
+        self.cls = cls
+        self.text = text
+        self.link_class = link_class
+        self.link_href = link_href
+
+    def __eq__(self, other) -> bool:
+        return (isinstance(other, DiffCell) and self.cls == other.cls and self.text == other.text
+                and self.link_class == other.link_class and self.link_href == other.link_href)
+
+    def __repr__(self) -> str:
+        return "DiffCell(%r, %r, %r, %r)" % (self.cls, self.text, self.link_class, self.link_href)
+
+
+class DiffTableParser(HTMLParser):
+    """Single-pass parser for the diff table returned by action=compare. Collects each <tr>
+    as a list of DiffCell records, and indexes the text of the cell containing each
+    named anchor (used to look up the origin of moved paragraphs).
+
+    :ivar rows: list of rows, each a list of DiffCell
+    :type rows: list
+    :ivar anchors: a dictionary mapping anchor names to the text of the cell containing them
+    :type anchors: dict
+    """
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        self.anchors = {}
+        self._row = None
+        self._cell = None
+        self._text = None
+        self._cell_anchors = None
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        if tag == "tr":
+            self._row = []
+        elif tag == "td" and self._row is not None:
+            classes = dict(attrs).get("class")
+            self._cell = DiffCell(cls=classes.split()[0] if classes else None)
+            self._text = []
+            self._cell_anchors = []
+        elif tag == "a" and self._cell is not None:
+            attrs = dict(attrs)
+            if self._cell.link_href is None and self._cell.link_class is None:
+                classes = attrs.get("class")
+                self._cell.link_class = classes.split()[0] if classes else None
+                self._cell.link_href = attrs.get("href")
+            if "name" in attrs:
+                self._cell_anchors.append(attrs["name"])
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == "td" and self._cell is not None:
+            self._cell.text = "".join(self._text)
+            for name in self._cell_anchors:
+                self.anchors[name] = self._cell.text
+            self._row.append(self._cell)
+            self._cell = None
+        elif tag == "tr" and self._row is not None:
+            self.rows.append(self._row)
+            self._row = None
+
+    def handle_data(self, data: str) -> None:
+        if self._cell is not None:
+            self._text.append(data)
+
+
+def parse_diff_table(diff_html: str) -> tuple:
+    """Parses the html of a MediaWiki diff table.
+
+    :param diff_html: the html of the diff table, as in the "*" field of an action=compare response
+    :type diff_html: str
+
+    :return: a tuple (rows, anchors), where rows is a list of rows, each a list of DiffCell, and anchors maps anchor names to the text of the cell containing them
+    """
+    parser = DiffTableParser()
+    parser.feed(diff_html)
+    parser.close()
+    return parser.rows, parser.anchors
+
+
+def local_compare(old_text: str, new_text: str) -> dict:
+    """Diffs two versions of a page's wikitext locally, producing a response in the
+    same format as the API's action=compare (a MediaWiki diff table), so that it can
+    be consumed by pipeline._parse_diff in place of a compare request.
+
+    :param old_text: wikitext of the "before" revision
+    :type old_text: str
+    :param new_text: wikitext of the "after" revision
+    :type new_text: str
+
+    :return: the json-formatted comparison between old_text and new_text
+    """
+    return {"compare": {"*": render_diff_table(diff_lines(old_text.split("\n"), new_text.split("\n")))}}
+
+
+def diff_lines(old_lines: list, new_lines: list) -> list:
+    """Computes the rows of a line-by-line diff of old_lines and new_lines, keeping only
+    CONTEXT_LINES unchanged lines around each change, as MediaWiki does.
+
+    Each row is a tuple (kind, old_text, new_text, anchor) where kind is one of "lineno",
+    "context", "added", "removed", "modified", "moved_left" or "moved_right". For "lineno"
+    rows old_text and new_text are the line numbers at which the following hunk starts.
+    anchor pairs the two rows of a moved paragraph and is None otherwise.
+
+    :param old_lines: lines of the "before" revision
+    :type old_lines: list
+    :param new_lines: lines of the "after" revision
+    :type new_lines: list
+
+    :return: list of diff rows
+    """
+    rows = []
+    matcher = difflib.SequenceMatcher(a=old_lines, b=new_lines, autojunk=False)
+    for group in matcher.get_grouped_opcodes(CONTEXT_LINES):
+        rows.append(("lineno", group[0][1] + 1, group[0][3] + 1, None))
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                rows += [("context", line, line, None) for line in old_lines[i1:i2]]
+            elif tag == "delete":
+                rows += [("removed", line, None, None) for line in old_lines[i1:i2]]
+            elif tag == "insert":
+                rows += [("added", None, line, None) for line in new_lines[j1:j2]]
+            else:
+                rows += _diff_replaced_lines(old_lines[i1:i2], new_lines[j1:j2])
+    _detect_moves(rows)
+    return rows
+
+
+def render_diff_table(rows: list) -> str:
+    """Renders diff rows produced by diff_lines as MediaWiki diff table rows.
+
+    :param rows: list of diff rows
+    :type rows: list
+
+    :return: html of the diff table body
+    """
+    res = []
+    for kind, old, new, anchor in rows:
+        if kind == "lineno":
+            res.append('<tr><td colspan="2" class="diff-lineno">Line %d:</td>'
+                       '<td colspan="2" class="diff-lineno">Line %d:</td></tr>' % (old, new))
+        elif kind == "context":
+            res.append('<tr><td class="diff-marker"></td><td class="diff-context"><div>%s</div></td>'
+                       '<td class="diff-marker"></td><td class="diff-context"><div>%s</div></td></tr>'
+                       % (html.escape(old), html.escape(new)))
+        elif kind == "added":
+            res.append('<tr><td colspan="2" class="diff-empty"></td><td class="diff-marker">+</td>'
+                       '<td class="diff-addedline"><div>%s</div></td></tr>' % html.escape(new))
+        elif kind == "removed":
+            res.append('<tr><td class="diff-marker">−</td><td class="diff-deletedline"><div>%s</div></td>'
+                       '<td colspan="2" class="diff-empty"></td></tr>' % html.escape(old))
+        elif kind == "modified":
+            res.append('<tr><td class="diff-marker">−</td><td class="diff-deletedline"><div>%s</div></td>'
+                       '<td class="diff-marker">+</td><td class="diff-addedline"><div>%s</div></td></tr>'
+                       % (html.escape(old), html.escape(new)))
+        elif kind == "moved_left":
+            res.append('<tr><td class="diff-marker"><a class="mw-diff-movedpara-left" href="#movedpara_%d_rhs">'
+                       '&#x26AB;</a></td><td class="diff-deletedline"><div><a name="movedpara_%d_lhs"></a>%s</div></td>'
+                       '<td colspan="2" class="diff-empty"></td></tr>' % (anchor, anchor, html.escape(old)))
+        elif kind == "moved_right":
+            res.append('<tr><td colspan="2" class="diff-empty"></td><td class="diff-marker">'
+                       '<a class="mw-diff-movedpara-right" href="#movedpara_%d_lhs">&#x26AB;</a></td>'
+                       '<td class="diff-addedline"><div><a name="movedpara_%d_rhs"></a>%s</div></td></tr>'
+                       % (anchor, anchor, html.escape(new)))
+    return "".join(res)
+
+
+def _similarity(a: str, b: str) -> float:
+    """Returns the difflib similarity ratio of two lines, in [0, 1]."""
+    matcher = difflib.SequenceMatcher(a=a, b=b, autojunk=False)
+    if matcher.real_quick_ratio() < MODIFICATION_THRESHOLD or matcher.quick_ratio() < MODIFICATION_THRESHOLD:
+        return 0.0
+    return matcher.ratio()
+
+
+def _diff_replaced_lines(old_lines: list, new_lines: list) -> list:
+    """Pairs up lines of a replaced region, in order, into modifications where they are
+    similar enough, and treats the rest as removals and additions."""
+    rows = []
+    j = 0
+    for old in old_lines:
+        match = None
+        for k in range(j, len(new_lines)):
+            if _similarity(old, new_lines[k]) >= MODIFICATION_THRESHOLD:
+                match = k
+                break
+        if match is None:
+            rows.append(("removed", old, None, None))
+            continue
+        rows += [("added", None, new, None) for new in new_lines[j:match]]
+        rows.append(("modified", old, new_lines[match], None))
+        j = match + 1
+    rows += [("added", None, new, None) for new in new_lines[j:]]
+    return rows
+
+
+def _detect_moves(rows: list) -> None:
+    """Marks pairs of removed and added non-empty lines with (nearly) identical text as a
+    moved paragraph, in place."""
+    removed = [i for i, row in enumerate(rows) if row[0] == "removed" and row[1].strip()]
+    anchor = 0
+    for j, row in enumerate(rows):
+        if row[0] != "added" or not row[2].strip():
+            continue
+        for k, i in enumerate(removed):
+            old = rows[i][1]
+            if old == row[2] or _similarity(old, row[2]) >= MOVE_THRESHOLD:
+                anchor += 1
+                rows[i] = ("moved_left", old, None, anchor)
+                rows[j] = ("moved_right", None, row[2], anchor)
+                del removed[k]
+                break
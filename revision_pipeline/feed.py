@@ -0,0 +1,210 @@
+import json
+import time
+import logging
+from datetime import datetime, timezone
+
+from . import pipeline
+
+TALK_NAMESPACE = 1
+RECENT_CHANGES_LIMIT = 500
+RECENT_CHANGES_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+class Change:
+    """A new revision of a page, as announced by a change feed.
+
+    :ivar title: the title of the page, including its namespace prefix (e.g. "Talk:Cornell University")
+    :type title: str
+    :ivar revid: the id of the new revision
+    :type revid: int
+    :ivar old_revid: the id of the revision it follows (0 for a new page)
+    :type old_revid: int
+    :ivar timestamp: datetime of the revision
+    :type timestamp: str
+    """
+
+    __slots__ = ("title", "revid", "old_revid", "timestamp")
+
+    def __init__(self, title: str, revid: int, old_revid: int, timestamp: str) -> None:
+        self.title = title
+        self.revid = revid
+        self.old_revid = old_revid
+        self.timestamp = timestamp
+
+    def __repr__(self) -> str:
+        return "Change(%r, %r, %r, %r)" % (self.title, self.revid, self.old_revid, self.timestamp)
+
+
+class RecentChangesFeed:
+    """Reads new revisions of every page in a namespace from the list=recentchanges API,
+    picking up where the previous poll left off.
+
+    :param namespace: the namespace to follow (1 for Talk pages)
+    :type namespace: int
+    :param start: the timestamp from which changes are read (defaults to now)
+    :type start: str
+    """
+
+    def __init__(self, namespace: int = TALK_NAMESPACE, start: str = None) -> None:
+        self.namespace = namespace
+        self._start = start or datetime.now(timezone.utc).strftime(RECENT_CHANGES_TIMESTAMP_FORMAT)
+        # rcstart is inclusive, so changes at the cursor timestamp that were already returned are remembered
+        self._seen_at_start = set()
+
+    def poll(self) -> list:
+        """Returns the changes made since the previous poll, oldest first.
+
+        :return: list of Change
+        """
+        params = {}
+        params["action"] = "query"
+        params["list"] = "recentchanges"
+        params["rcnamespace"] = self.namespace
+        params["rctype"] = "edit|new"
+        params["rcprop"] = "title|ids|timestamp"
+        params["rcdir"] = "newer"
+        params["rcstart"] = self._start
+        params["rclimit"] = RECENT_CHANGES_LIMIT
+        params["formatversion"] = "2"
+
+        changes = []
+        response = pipeline._query_api(params)
+        while True:
+            for rc in response["query"]["recentchanges"]:
+                if rc["rcid"] in self._seen_at_start:
+                    continue
+                if rc["timestamp"] != self._start:
+                    self._start = rc["timestamp"]
+                    self._seen_at_start = set()
+                self._seen_at_start.add(rc["rcid"])
+                changes.append(Change(rc["title"], rc["revid"], rc["old_revid"], rc["timestamp"]))
+            if "continue" not in response:
+                break
+            params["rccontinue"] = response["continue"]["rccontinue"]
+            response = pipeline._query_api(params)
+        return changes
+
+
+class ReplayFeed:
+    """Reads new revisions from a file of recentchange events, one json object per line, in the
+    format of the Wikimedia EventStreams recentchange stream. Lines appended to the file are
+    picked up by later polls, so it can stand in for a live event stream.
+
+    :param filepath: location of the event file
+    :type filepath: str
+    :param namespace: the namespace to follow (1 for Talk pages)
+    :type namespace: int
+    :param wiki: if given, only events of this wiki (e.g. "enwiki") are read
+    :type wiki: str
+    """
+
+    def __init__(self, filepath: str, namespace: int = TALK_NAMESPACE, wiki: str = None) -> None:
+        self.filepath = filepath
+        self.namespace = namespace
+        self.wiki = wiki
+        self._offset = 0
+
+    def poll(self) -> list:
+        """Returns the changes appended to the file since the previous poll, in file order.
+
+        :return: list of Change
+        """
+        changes = []
+        with open(self.filepath, "rb") as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # an event still being written
+                    break
+                self._offset += len(line)
+                if not line.strip():
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    logging.warning("Skipping malformed event in %s", self.filepath)
+                    continue
+                if (event.get("type") not in ("edit", "new") or event.get("namespace") != self.namespace
+                        or (self.wiki is not None and event.get("wiki") != self.wiki)):
+                    continue
+                timestamp = datetime.fromtimestamp(event["timestamp"], timezone.utc).strftime(RECENT_CHANGES_TIMESTAMP_FORMAT)
+                changes.append(Change(event["title"], event["revision"]["new"],
+                                      event["revision"].get("old") or 0, timestamp))
+        return changes
+
+
+class FeedDriver:
+    """Keeps the Intermediates of many talk pages up to date from a single change feed. Each poll
+    reads the feed once and only updates the Intermediates of the watched pages that have new
+    revisions, so the number of API requests scales with edit volume rather than with the number
+    of watched pages.
+
+    :param titles: titles of the watched talk pages (may or may not include "Talk:" prefix)
+    :type titles: list
+    :param feed: the change feed, e.g. a RecentChangesFeed or ReplayFeed
+    :param folder: Directory containing Intermediate .jsons
+    :type folder: str
+    :param write_intermediate_to_disk: Whether to write each Intermediate to disk after updating it
+    :type write_intermediate_to_disk: bool
+
+    :ivar intermediates: the Intermediate of each watched title
+    :type intermediates: dict
+    """
+
+    def __init__(self, titles: list, feed, folder: str = "./intermediate_format",
+                 write_intermediate_to_disk: bool = True) -> None:
+        self.feed = feed
+        self.write_intermediate_to_disk = write_intermediate_to_disk
+        self._titles = {}
+        self._pending = {}
+        for title in titles:
+            self._titles[_normalize_title(title)] = title
+        self.intermediates = pipeline.get_intermediates(titles, folder, write_intermediate_to_disk,
+                                                        logging.getLogger().level)
+
+    def poll(self) -> dict:
+        """Reads the feed once and ingests the new revisions of the watched pages.
+
+        :return: a dictionary mapping the titles whose Intermediate was updated to the updated Intermediate
+        """
+        latest = self._pending
+        self._pending = {}
+        for change in self.feed.poll():
+            title = self._titles.get(_normalize_title(change.title))
+            if title is not None:
+                latest[title] = max(latest.get(title, 0), change.revid)
+
+        updated = {}
+        for title, revid in latest.items():
+            accum = self.intermediates[title]
+            if revid <= accum.get_last_revision_id():
+                continue
+            try:
+                accum = pipeline.update_intermediate(title, accum)
+            except Exception as e:
+                logging.debug(e, exc_info=True)
+                logging.warning("Could not update intermediate of %s, retrying on next poll: %s", title, e)
+                # the feed will not announce these revisions again
+                self._pending[title] = revid
+                continue
+            if self.write_intermediate_to_disk:
+                accum.write_to_disk()
+            self.intermediates[title] = accum
+            updated[title] = accum
+        return updated
+
+    def run(self, interval: float = 2):
+        """Polls the feed every interval seconds, yielding the result of each poll that updated an Intermediate."""
+        while True:
+            updated = self.poll()
+            if len(updated) > 0:
+                yield updated
+            time.sleep(interval)
+
+
+def _normalize_title(title: str) -> str:
+    """Returns the title of an article's talk page as MediaWiki normalizes it, without the "Talk:" prefix."""
+    if title[:5].lower() == "talk:":
+        title = title[5:]
+    title = title.replace("_", " ").strip()
+    return title[:1].upper() + title[1:]
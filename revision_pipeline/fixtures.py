@@ -0,0 +1,112 @@
+import gzip
+import json
+import threading
+from collections import OrderedDict
+
+# parameters that are added or varied by the client and do not change the response
+IGNORED_PARAMS = ("format", "maxlag")
+
+
+class RecordingClient:
+    """Wraps an APIClient, recording every response it receives so that they can be saved to a
+    fixture file and replayed offline by a ReplayClient. Install it with pipeline.set_client.
+    Only queries made in this process are recorded, so pages should be recorded with a single worker.
+
+    :param client: the APIClient that queries the API
+    :type client: APIClient
+    :param filepath: location of the fixture file written by save (gzip-compressed json)
+    :type filepath: str
+    """
+
+    def __init__(self, client, filepath: str) -> None:
+        self.client = client
+        self.filepath = filepath
+        self.base_url = client.base_url
+        self._responses = OrderedDict()
+        self._lock = threading.Lock()
+
+    def query(self, params: dict) -> dict:
+        """Queries the API through the wrapped client and records the response.
+
+        :param params: API parameters
+        :type params: dict
+
+        :return: json-formatted response from API
+        """
+        response = self.client.query(params)
+        with self._lock:
+            self._responses[fixture_key(params)] = (dict(params), response)
+        return response
+
+    def save(self) -> None:
+        """Writes the responses recorded so far to the fixture file.
+
+        :return: None
+        """
+        with self._lock:
+            responses = [{"params": params, "response": response} for params, response in self._responses.values()]
+        with gzip.open(self.filepath, "wt", encoding="utf-8") as f:
+            json.dump({"base_url": self.base_url, "responses": responses}, f)
+
+    def stats(self) -> dict:
+        return self.client.stats()
+
+    def close(self) -> None:
+        self.client.close()
+
+
+class ReplayClient:
+    """Answers API queries from the responses recorded in a fixture file, without network access.
+    Install it with pipeline.set_client. A query that was not recorded raises a KeyError.
+
+    :param filepath: location of a fixture file written by RecordingClient.save
+    :type filepath: str
+
+    :ivar hits: number of queries answered from the fixture
+    :type hits: int
+    :ivar misses: number of queries that were not recorded
+    :type misses: int
+    """
+
+    def __init__(self, filepath: str) -> None:
+        self.filepath = filepath
+        with gzip.open(filepath, "rt", encoding="utf-8") as f:
+            fixture = json.load(f)
+        self.base_url = fixture["base_url"]
+        self._responses = {fixture_key(r["params"]): r["response"] for r in fixture["responses"]}
+        self.hits = 0
+        self.misses = 0
+
+    def query(self, params: dict) -> dict:
+        """Returns the recorded response to a query.
+
+        :param params: API parameters
+        :type params: dict
+
+        :return: json-formatted response from API, as recorded
+        """
+        try:
+            response = self._responses[fixture_key(params)]
+        except KeyError:
+            self.misses += 1
+            raise KeyError("No recorded response in %s for %s" % (self.filepath, fixture_key(params)))
+        self.hits += 1
+        return response
+
+    def stats(self) -> dict:
+        return {"replay": {"count": self.hits, "errors": self.misses}}
+
+    def close(self) -> None:
+        pass
+
+
+def fixture_key(params: dict) -> str:
+    """Returns the key under which the response to a query is recorded: its parameters, as strings,
+    in a canonical order.
+
+    :param params: API parameters
+    :type params: dict
+
+    :return: the key of the query
+    """
+    return json.dumps({k: str(v) for k, v in params.items() if k not in IGNORED_PARAMS}, sort_keys=True)
@@ -1,3 +1,4 @@
+import sys
 import hashlib
 
 
@@ -6,10 +7,92 @@ def compute_md5(s) -> str:
 
     :param s: data to be hashed
 
-    :return: md5 hash of s
+    :return: md5 hash of s, interned so that each distinct hash is stored once
     """
 
-    return hashlib.md5(str(s).strip().encode('utf-8')).hexdigest()
+    return sys.intern(hashlib.md5(str(s).strip().encode('utf-8')).hexdigest())
+
+
+def find_root(h: str, get_link, compressed: dict) -> str:
+    """Follows the links given by get_link from h to a hash that links to itself, union-find style:
+    compressed holds shortcuts from hashes to the roots previously found for them, and is updated with
+    a shortcut for every hash on the path walked. A shortcut may point to a root that has since been
+    linked onward (the walk simply continues from it) or removed (the result is None), but the
+    caller must clear compressed whenever a link that is not to itself is removed or redirected.
+
+    :param h: the hash to resolve
+    :type h: str
+    :param get_link: function returning the hash h links to, or None if h has no link
+    :param compressed: shortcuts from hashes to previously found roots
+    :type compressed: dict
+
+    :return: the root hash reached from h, or None if the chain of links is broken
+    """
+    path = []
+    while True:
+        nxt = compressed.get(h)
+        if nxt is None:
+            nxt = get_link(h)
+            if nxt is None:
+                return None
+        if nxt == h:
+            break
+        path.append(h)
+        h = nxt
+    for p in path:
+        compressed[p] = h
+    return h
+
+
+def materialize_chain(h: str, get_parent, cache: dict) -> tuple:
+    """Follows the links given by get_parent from h up to the root of its reply tree, and returns the
+    hashes on the way from the root down to h. Chains already in cache are reused, and the chain of
+    every hash on the path walked is added to it, so the caller must clear cache whenever a link is
+    removed or redirected. A hash met twice (a cycle) is treated as a root.
+
+    :param h: the hash whose chain is sought
+    :type h: str
+    :param get_parent: function returning the hash h replies to, or None if h is a root
+    :param cache: chains previously materialized, by hash
+    :type cache: dict
+
+    :return: tuple of hashes, ending with h
+    """
+    path = []
+    seen = set()
+    prefix = ()
+    while h is not None:
+        if h in cache:
+            prefix = cache[h]
+            break
+        if h in seen:
+            break
+        seen.add(h)
+        path.append(h)
+        h = get_parent(h)
+    for p in reversed(path):
+        prefix = prefix + (p,)
+        cache[p] = prefix
+    return prefix
+
+
+def add_reply_chain_links(reply_chains: dict, reply_parents) -> None:
+    """Adds to reply_parents the links given by reply chains stored in the format of earlier versions,
+    where each block held a copy of its whole reply chain. A block's own chain gives its parent; the
+    blocks of a chain that are not described by their own keep the parent they had in it.
+
+    :param reply_chains: a dictionary mapping block hashes to their reply chain
+    :type reply_chains: dict
+    :param reply_parents: mapping from block hashes to the hash of their parent, added to
+
+    :return: None
+    """
+    for h, chain in reply_chains.items():
+        reply_parents[sys.intern(h)] = sys.intern(chain[-2]) if len(chain) > 1 else None
+    for chain in reply_chains.values():
+        for i in range(len(chain)):
+            if chain[i] not in reply_parents:
+                reply_parents[sys.intern(chain[i])] = sys.intern(chain[i - 1]) if i > 0 else None
 
 
 def compute_text_depth(text: str) -> int:
@@ -30,38 +113,59 @@ def is_new_section_text(added_text: str) -> bool:
 
 
 def is_unedited_tr(all_td: list) -> bool:
-    """Returns whether the list of <td> elements in all_td describe an unedited block from one revision to the next."""
+    """Returns whether the list of DiffCell records in all_td describe an unedited block from one revision to the next."""
     return len(all_td) == 4 and all_td[0] == all_td[2]
 
 
 def is_new_content_tr(all_td: list) -> bool:
-    """Returns whether the list of <td> elements in all_td describe the addition of a block from one revision to the next."""
-    return (len(all_td) == 3 and all_td[0]["class"][0] == "diff-empty" and all_td[2]["class"][0] == "diff-addedline")
+    """Returns whether the list of DiffCell records in all_td describe the addition of a block from one revision to the next."""
+    return (len(all_td) == 3 and all_td[0].cls == "diff-empty" and all_td[2].cls == "diff-addedline")
 
 
 def is_removal_tr(all_td: list) -> bool:
-    """Returns whether the list of <td> elements in all_td describe the removal of a block from one revision to the next."""
-    return (len(all_td) == 3 and all_td[1]["class"][0] == "diff-deletedline" and all_td[2]["class"][0] == "diff-empty")
+    """Returns whether the list of DiffCell records in all_td describe the removal of a block from one revision to the next."""
+    return (len(all_td) == 3 and all_td[1].cls == "diff-deletedline" and all_td[2].cls == "diff-empty")
 
 
 def is_modification_tr(all_td: list) -> bool:
-    """Returns whether the list of <td> elements in all_td describe the modification of a block from one revision to the next."""
-    return (len(all_td) == 4 and all_td[1]["class"][0] == "diff-deletedline" and all_td[3]["class"][0] == "diff-addedline")
+    """Returns whether the list of DiffCell records in all_td describe the modification of a block from one revision to the next."""
+    return (len(all_td) == 4 and all_td[1].cls == "diff-deletedline" and all_td[3].cls == "diff-addedline")
 
 
 def is_line_number_tr(all_td: list) -> bool:
-    """Returns whether the list of <td> elements in all_td describe a line number block from one revision to the next."""
-    return (len(all_td) == 2 and all_td[0]["class"][0] == "diff-lineno" and all_td[1]["class"][0] == "diff-lineno")
+    """Returns whether the list of DiffCell records in all_td describe a line number block from one revision to the next."""
+    return (len(all_td) == 2 and all_td[0].cls == "diff-lineno" and all_td[1].cls == "diff-lineno")
 
 
 def is_moved_right_tr(all_td: list) -> bool:
-    """Returns whether the list of <td> elements in all_td describes the movement of a block to that position from one revision to the next."""
-    return (len(all_td) == 3 and all_td[1].a and all_td[1].a["class"][0] == "mw-diff-movedpara-right")
+    """Returns whether the list of DiffCell records in all_td describes the movement of a block to that position from one revision to the next."""
+    return (len(all_td) == 3 and all_td[1].link_class == "mw-diff-movedpara-right")
 
 
 def is_moved_left_tr(all_td: list) -> bool:
-    """Returns whether the list of <td> elements in all_td describes the movement of a block from that position from one revision to the next."""
-    return (len(all_td) == 3 and all_td[0].a and all_td[0].a["class"][0] == "mw-diff-movedpara-left")
+    """Returns whether the list of DiffCell records in all_td describes the movement of a block from that position from one revision to the next."""
+    return (len(all_td) == 3 and all_td[0].link_class == "mw-diff-movedpara-left")
+
+
+def unseen_segments(earlier: tuple, seen: set) -> list:
+    """Returns the segments in earlier, a chain of nested pairs (segment, earlier segments) from
+    Intermediate.segment_reply_chain, that come before the first pair whose id is in seen, and adds the
+    ids of the pairs walked to seen. As the pairs are shared between blocks, collecting the earlier
+    segments of every block this way visits each pair once.
+
+    :param earlier: nested pairs of segments, or None
+    :type earlier: tuple
+    :param seen: ids of the pairs already visited
+    :type seen: set
+
+    :return: list of segments
+    """
+    res = []
+    while earlier is not None and id(earlier) not in seen:
+        seen.add(id(earlier))
+        res.append(earlier[0])
+        earlier = earlier[1]
+    return res
 
 
 def string_of_seg(seg: list) -> str:
@@ -1,7 +1,180 @@
 import os
+import sys
 import json
+import logging
+import tempfile
+import struct
 from .block import Block
-from .helpers import compute_text_depth
+from .helpers import compute_text_depth, find_root, materialize_chain, add_reply_chain_links
+from .storage import SQLiteStorage, is_sqlite_path
+from .binary import BinaryBlocks, is_binary_path, is_binary_file, read_metadata, write_binary
+
+JOURNAL_SUFFIX = ".journal"
+JOURNAL_COMPACTION_RATIO = 1.0
+REPLY_CHAIN_CACHE_SIZE = 65536
+MANIFEST_SUFFIX = ".manifest"
+# the attributes of an Intermediate whose loading was deferred that make it load (see Intermediate.__getattr__)
+DEFERRED_ATTRIBUTES = frozenset(("hash_lookup", "blocks", "reply_parents", "revisions", "_journal", "_generation"))
+
+
+def read_manifest(filepath: str, verify: bool = False) -> dict:
+    """Returns the manifest written next to the Intermediate at filepath, if it describes the
+    Intermediate files currently on disk, or None. Only the sizes and modification times of the
+    files are compared unless verify is set, in which case the Intermediate is also loaded (reading
+    its files in full) and checked against the manifest.
+
+    :param filepath: the location of the Intermediate
+    :type filepath: str
+    :param verify: whether to also check the contents of the files
+    :type verify: bool
+
+    :return: dictionary with last_revision_id, timestamp, revisions, blocks, generation and files, or None
+    """
+    try:
+        with open(filepath + MANIFEST_SUFFIX, "r") as f:
+            manifest = json.load(f)
+        paths = _manifest_paths(filepath)
+        if manifest["files"] != _stat_files(paths):
+            return None
+        if verify and not _matches_manifest(filepath, manifest):
+            return None
+    except (OSError, ValueError, KeyError, struct.error):
+        return None
+    return manifest
+
+
+def _manifest_paths(filepath: str) -> list:
+    """Returns the files on disk holding the Intermediate at filepath (its snapshot and journal, if any)."""
+    paths = [filepath]
+    if os.path.exists(filepath + JOURNAL_SUFFIX):
+        paths.append(filepath + JOURNAL_SUFFIX)
+    return paths
+
+
+def _stat_files(paths: list) -> list:
+    """Returns the [size, modification time in ns] of each of the files at paths."""
+    res = []
+    for path in paths:
+        st = os.stat(path)
+        res.append([st.st_size, st.st_mtime_ns])
+    return res
+
+
+def _matches_manifest(filepath: str, manifest: dict) -> bool:
+    """Returns whether the Intermediate loaded from filepath is the one the manifest describes."""
+    accum = Intermediate(filepath)
+    return (accum._generation == manifest["generation"] and accum.get_last_revision_id() == manifest["last_revision_id"]
+            and len(accum.revisions) == manifest["revisions"] and len(accum.blocks) == manifest["blocks"])
+
+
+class TrackedDict(dict):
+    """A dict that records which keys have been set or deleted since its dirty set was last cleared.
+
+    :ivar dirty: the keys set or deleted since the last clear
+    :type dirty: set
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.dirty = set()
+
+    def __setitem__(self, key, value) -> None:
+        super().__setitem__(key, value)
+        self.dirty.add(key)
+
+    def __delitem__(self, key) -> None:
+        super().__delitem__(key)
+        self.dirty.add(key)
+
+    def pop(self, key, *default):
+        if key in self:
+            self.dirty.add(key)
+        return super().pop(key, *default)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs) -> None:
+        for k, v in dict(*args, **kwargs).items():
+            self[k] = v
+
+
+class HashLookup(TrackedDict):
+    """The hash_lookup of an Intermediate: a TrackedDict of links from block hashes to the hash of
+    their next edit, resolved to the most recent edit by find() with path compression. The links
+    themselves are stored as is; the compressed shortcuts are kept alongside them and discarded
+    whenever a link in the middle of a chain is removed or redirected.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._compressed = {}
+
+    def __setitem__(self, key, value) -> None:
+        old = dict.get(self, key)
+        if old is not None and old != key and old != value:
+            self._compressed.clear()
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key) -> None:
+        old = dict.get(self, key)
+        if old is not None and old != key:
+            self._compressed.clear()
+        super().__delitem__(key)
+
+    def pop(self, key, *default):
+        old = dict.get(self, key)
+        if old is not None and old != key:
+            self._compressed.clear()
+        return super().pop(key, *default)
+
+    def find(self, h: str) -> str:
+        """Returns the hash of the most recent edit of the block given by h, or None if it has been removed."""
+        root = self._compressed.get(h, h)
+        if dict.get(self, root) == root:
+            return root
+        return find_root(h, self._get_link, self._compressed)
+
+    def _get_link(self, h: str) -> str:
+        return dict.get(self, h)
+
+
+class ReplyParents(TrackedDict):
+    """The reply tree of an Intermediate: a TrackedDict mapping each block hash to the hash of the block
+    it replies to (or follows, for the later paragraphs of a comment), or None for the first block of a
+    thread. Like hash_lookup, entries outlive the blocks they describe, so that the chains of replies to
+    a removed block still reach above it. chain() materializes reply chains on demand, caching them until
+    a link is added above a cached chain, redirected or removed.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._chains = {}
+
+    def __setitem__(self, key, value) -> None:
+        # a hash without a link may have been cached as the root of its chain
+        if dict.get(self, key) != value and (dict.__contains__(self, key) or key in self._chains):
+            self._chains.clear()
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key) -> None:
+        self._chains.clear()
+        super().__delitem__(key)
+
+    def pop(self, key, *default):
+        self._chains.clear()
+        return super().pop(key, *default)
+
+    def chain(self, h: str) -> tuple:
+        """Returns the reply chain of the block given by h: the hashes from the first block of its thread down to h."""
+        if len(self._chains) > REPLY_CHAIN_CACHE_SIZE:
+            self._chains.clear()
+        return materialize_chain(h, self._get_parent, self._chains)
+
+    def _get_parent(self, h: str) -> str:
+        return dict.get(self, h)
 
 
 class Intermediate:
@@ -9,7 +182,14 @@ class Intermediate:
     easily convertible to convokit Corpus.
 
     :param filepath: the location of the Intermediate on disk, if applicable. (Optional)
+    A filepath ending in ".sqlite" stores the Intermediate in a SQLite database instead of a json
+    snapshot, in which case blocks, hash_lookup, reply_parents and revisions are database-backed views with the same interface.
+    A filepath ending in ".bin" stores it in the binary format of binary.py, whose blocks are memory-mapped and only
+    decoded when accessed; such a file is recognized by its contents when loaded, whatever its name.
     :type filepath: str
+    :param manifest: the manifest of the Intermediate at filepath (see read_manifest), if its loading is to be deferred:
+    get_last_revision_id is then answered from the manifest, and the Intermediate is only loaded once its data is needed. (Optional)
+    :type manifest: dict
 
     :ivar hash_lookup: a dictionary mapping block hashes (the md5 hash of the block's 
     text) to the hash of the next edit of that same block in the case that it was 
@@ -18,6 +198,9 @@ class Intermediate:
     :ivar blocks: a dictionary mapping block hashes (the md5 hash of the block's text)
     to the Block object representing that block.
     :type blocks: dict
+    :ivar reply_parents: a dictionary mapping block hashes to the hash (as it was at the time) of the block
+    they reply to or follow, or None. Reply chains are materialized from it by reply_chain().
+    :type reply_parents: dict
     :ivar revisions: a list of triples describing the revisions that form this Intermediate, 
     where each triple is (revision's id, list of behaviors of the blocks modified in that revision, 
     datetime of that revision) 
@@ -26,16 +209,43 @@ class Intermediate:
     :type revisions: list
     :ivar _filepath: the filepath of the Intermediate on disk; where it will be written to
     :type _filepath: str
+    :ivar _journal: the per-revision changes (as json strings) not yet written to the journal on disk,
+    if the Intermediate is based on a snapshot at _filepath (otherwise None)
+    :type _journal: list
+    :ivar _generation: the generation of the snapshot at _filepath; a journal belongs to the snapshot of the same generation
+    :type _generation: int
+    :ivar _storage: the SQLite storage backing this Intermediate, if any
+    :type _storage: SQLiteStorage
+    :ivar _changed_blocks: hashes of the blocks created, modified or removed since the last call to take_changed_blocks
+    :type _changed_blocks: set
+    :ivar _manifest: the manifest of the Intermediate at _filepath while its loading is deferred (otherwise None)
+    :type _manifest: dict
     """
 
-    def __init__(self, filepath: str = None) -> None:
-        if filepath:
+    def __init__(self, filepath: str = None, manifest: dict = None) -> None:
+        self._storage = None
+        self._changed_blocks = set()
+        self._manifest = None
+        if filepath and manifest is not None:
+            self._filepath = filepath
+            self._manifest = manifest
+        elif filepath:
             self.load_from_disk(filepath)
         else:
-            self.hash_lookup = {}
-            self.blocks = {}
+            self.hash_lookup = HashLookup()
+            self.blocks = TrackedDict()
+            self.reply_parents = ReplyParents()
             self.revisions = []
             self._filepath = None
+            self._journal = None
+            self._generation = 0
+
+    def __getattr__(self, name: str):
+        # only called for attributes that are not set, such as those of an Intermediate whose loading was deferred
+        if name in DEFERRED_ATTRIBUTES and self.__dict__.get("_manifest") is not None:
+            self._load_deferred()
+            return getattr(self, name)
+        raise AttributeError("'Intermediate' object has no attribute '%s'" % name)
 
     def __str__(self) -> str:
         res = "HASH_LOOKUP---------------------------\n"
@@ -56,41 +266,175 @@ class Intermediate:
         return res
 
     def set_filepath(self, fp: str) -> None:
+        if self._manifest is not None:
+            self._load_deferred()
+        if fp != self._filepath:
+            # the next write must be a full snapshot
+            self._journal = None
         self._filepath = fp
 
     def get_filepath(self) -> str:
         return self._filepath
 
     def load_from_disk(self, filepath: str) -> None:
-        """Loads from a json at filepath the Intermediate data stored in it.
+        """Loads from a json at filepath the Intermediate data stored in it, then
+        replays the changes recorded in its journal, if any. A binary file is mapped
+        instead, leaving its blocks to be decoded as they are accessed.
 
         :return: None
         """
+        if is_sqlite_path(filepath):
+            self._use_storage(SQLiteStorage(filepath))
+            return
+        if is_binary_file(filepath):
+            self._load_binary(filepath)
+            return
         with open(filepath, "r") as f:
             obj = json.load(f)
-            self.hash_lookup = obj["hash_lookup"]
-            self.blocks = self._deserialize_blocks(obj["blocks"])
+            self.hash_lookup = HashLookup({sys.intern(h): sys.intern(v) for h, v in obj["hash_lookup"].items()})
+            self.blocks = TrackedDict(self._deserialize_blocks(obj["blocks"]))
+            if "reply_parents" in obj:
+                self.reply_parents = ReplyParents({sys.intern(h): None if p is None else sys.intern(p)
+                                                   for h, p in obj["reply_parents"].items()})
+            else:
+                # written before reply chains were stored as parent links
+                self.reply_parents = ReplyParents()
+                add_reply_chain_links({h: b["reply_chain"] for h, b in obj["blocks"].items()}, self.reply_parents)
             self.revisions = obj["revisions"]
+            self._generation = obj.get("generation", 0)
             self._filepath = filepath
+        self._replay_journal()
+        self.hash_lookup.dirty.clear()
+        self.blocks.dirty.clear()
+        self.reply_parents.dirty.clear()
+        self._journal = []
 
     def write_to_disk(self) -> None:
-        """Writes intermediate to self._filepath as a json
+        """Writes intermediate to self._filepath. If the Intermediate was loaded from or
+        already written to self._filepath, only the revisions ingested since are appended
+        to the journal next to it; a full json snapshot is written otherwise, or once the
+        journal has grown past JOURNAL_COMPACTION_RATIO times the size of the snapshot.
 
         :return: None
         """
         assert(self._filepath is not None)
-        with open(self._filepath, "w") as f:
-            obj = {}
-            obj["hash_lookup"] = self.hash_lookup
-            obj["blocks"] = self._serialize_blocks()
-            obj["revisions"] = self.revisions
-            json.dump(obj, f)
+        if is_sqlite_path(self._filepath):
+            if self._storage is not None and self._storage.filepath == self._filepath:
+                self._storage.commit()
+            else:
+                storage = SQLiteStorage(self._filepath)
+                storage.import_intermediate(self.hash_lookup, self.blocks, self.revisions, self.reply_parents)
+                self._use_storage(storage)
+            return
+        if self._is_binary_target():
+            self._write_binary()
+            self._write_manifest()
+            return
+        if self._journal is None or not os.path.exists(self._filepath):
+            self.compact()
+            return
+
+        journal_path = self._filepath + JOURNAL_SUFFIX
+        if self._journal:
+            new_journal = not os.path.exists(journal_path)
+            with open(journal_path, "a") as f:
+                if new_journal:
+                    f.write(json.dumps({"generation": self._generation}) + "\n")
+                for record in self._journal:
+                    f.write(record + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._journal = []
+
+        if (os.path.exists(journal_path) and
+                os.path.getsize(journal_path) > JOURNAL_COMPACTION_RATIO * os.path.getsize(self._filepath)):
+            self.compact()
+        else:
+            self._write_manifest()
+
+    def compact(self) -> None:
+        """Writes a full json snapshot of the Intermediate to self._filepath, folding in and
+        removing its journal. The snapshot is written atomically, and its generation number
+        is bumped so that a journal left behind by a crash is recognized as stale.
+
+        :return: None
+        """
+        assert(self._filepath is not None)
+        obj = {}
+        obj["hash_lookup"] = dict(self.hash_lookup.items())
+        obj["blocks"] = self._serialize_blocks()
+        obj["reply_parents"] = dict(self.reply_parents.items())
+        obj["revisions"] = list(self.revisions)
+        obj["generation"] = self._generation + 1
+        self._atomic_write_json(obj)
+        self._generation += 1
+        try:
+            os.remove(self._filepath + JOURNAL_SUFFIX)
+        except FileNotFoundError:
+            pass
+        self.hash_lookup.dirty.clear()
+        self.blocks.dirty.clear()
+        self.reply_parents.dirty.clear()
+        self._journal = []
+        self._write_manifest()
+
+    def add_revision(self, revision_id: int, behavior: list, timestamp: str) -> None:
+        """Records that a revision has been ingested, closing the set of block changes it made.
+
+        :param revision_id: the id of the revision
+        :type revision_id: int
+        :param behavior: list of behaviors of the blocks modified in that revision
+        :type behavior: list
+        :param timestamp: datetime of that revision
+        :type timestamp: str
+
+        :return: None
+        """
+        self.revisions.append((revision_id, behavior, timestamp))
+        self._changed_blocks |= self.blocks.dirty
+        if self._storage is not None:
+            self._storage.commit()
+            return
+        if self._journal is not None:
+            record = {}
+            record["revision"] = [revision_id, behavior, timestamp]
+            record["hash_lookup"] = {h: self.hash_lookup.get(h) for h in self.hash_lookup.dirty}
+            record["blocks"] = {h: self._serialize_block(self.blocks[h]) if h in self.blocks else None
+                                for h in self.blocks.dirty}
+            record["reply_parents"] = {h: self.reply_parents[h] for h in self.reply_parents.dirty if h in self.reply_parents}
+            # serialized now, as blocks keep being mutated in place by later revisions
+            self._journal.append(json.dumps(record))
+        self.hash_lookup.dirty.clear()
+        self.blocks.dirty.clear()
+        self.reply_parents.dirty.clear()
+
+    def take_changed_blocks(self) -> set:
+        """Returns the hashes of the blocks created, modified or removed by the revisions ingested
+        since the last call (or since the Intermediate was created or loaded), and starts tracking anew.
+
+        :return: set of block hashes
+        """
+        res = self._changed_blocks
+        self._changed_blocks = set()
+        return res
+
+    def touch_block(self, h: str) -> None:
+        """Records that the block given by h was modified in place (without being reassigned in self.blocks).
+
+        :param h: the hash of the block
+        :type h: str
+
+        :return: None
+        """
+        self.blocks.dirty.add(h)
 
     def get_last_revision_id(self) -> int:
         """Returns the id of last revision that contributed to this Intermediate.
 
         :return: revision id (int)
         """
+        if self._manifest is not None:
+            return self._manifest["last_revision_id"]
         last_revision = self.revisions[-1]
         return last_revision[0]
 
@@ -105,12 +449,20 @@ class Intermediate:
 
         :return: the hash of the most recent block to which h was modified 
         """
-        try:
-            while self.hash_lookup[h] != h:
-                h = self.hash_lookup[h]
-            return h
-        except KeyError:
-            return None
+        return self.hash_lookup.find(h)
+
+    def reply_chain(self, h: str) -> tuple:
+        """Returns the reply chain of the block given by h: the hashes of the blocks it is in a reply chain with,
+        from the first block of its thread down to h, including the blocks before it that were added in the
+        same revision. Hashes are as they were when each block replied, so may need to be resolved with
+        find_ultimate_hash.
+
+        :param h: the hash of some block in self.blocks
+        :type h: str
+
+        :return: tuple of block hashes, ending with h
+        """
+        return self.reply_parents.chain(h)
 
     def compute_reply_hash(self, reply_to_hash: str, reply_to_depth: int, this_depth: int) -> str:
         """Returns the hash of the block to which a block is replying.
@@ -141,6 +493,53 @@ class Intermediate:
                     return None
             return reply_to_hash
 
+    def segment_reply_chain(self, h: str, cache: dict) -> tuple:
+        """Segments the reply chain of the block given by h into utterances, as segment_contiguous_blocks does,
+        but walking the reply tree: the segmentation of the chain up to each block is kept in cache and extended
+        by one block for each of its replies, so segmenting all the blocks of a thread with a shared cache does
+        constant work per block instead of work proportional to its depth.
+
+        :param h: the hash of some block in self.blocks
+        :type h: str
+        :param cache: the segmentations computed so far, by hash (only valid while the Intermediate is unchanged)
+        :type cache: dict
+
+        :return: a tuple (earlier segments, last segment), where the last segment is a tuple of block hashes and the earlier segments are nested pairs (segment, earlier segments), closest first, ending with None. The pairs are shared between the segmentations of blocks with a common ancestry.
+        """
+        path = []
+        seen = set()
+        state = None
+        while h is not None:
+            if h in cache:
+                state = cache[h]
+                break
+            if h in seen:
+                # a cycle; the repeated hash is treated as a root, as in reply_chain()
+                break
+            seen.add(h)
+            path.append(h)
+            h = self.reply_parents.get(h)
+        if state is None:
+            state = (None, (), None)
+        for p in reversed(path):
+            state = self._extend_segmentation(state, p)
+            cache[p] = state
+        return state[0], state[1]
+
+    def _extend_segmentation(self, state: tuple, h: str) -> tuple:
+        """Returns the segmentation state (earlier segments, last segment, last resolved hash) of a reply chain
+        extended with h, given the state of the chain without it."""
+        earlier, contig, last_h = state
+        this_h = self.find_ultimate_hash(h)
+        if this_h is None:
+            return state
+        if last_h is None:
+            return (earlier, (this_h,), this_h)
+        last_block = self.blocks[last_h]
+        if self.blocks[this_h].user == last_block.user and not last_block.is_header and last_block.is_followed:
+            return (earlier, contig + (this_h,), this_h)
+        return ((contig, earlier), (this_h,), this_h)
+
     def segment_contiguous_blocks(self, reply_chain: list) -> list:
         """Turns a reply chain into a list of sublists, where each sublist contains
         the blocks that form a single utterance (given by the fact that it is a 
@@ -187,6 +586,186 @@ class Intermediate:
             res.append(contig)
         return res
 
+    def _use_storage(self, storage: SQLiteStorage) -> None:
+        """Switches this Intermediate to be backed by storage."""
+        self._storage = storage
+        self.blocks = storage.blocks
+        self.hash_lookup = storage.hash_lookup
+        self.reply_parents = storage.reply_parents
+        self.revisions = storage.revisions
+        self._filepath = storage.filepath
+        self._journal = None
+        self._generation = 0
+
+    def _load_binary(self, filepath: str) -> None:
+        """Loads the Intermediate stored in the binary format at filepath, mapping its blocks."""
+        obj = read_metadata(filepath)
+        self.hash_lookup = HashLookup({sys.intern(h): sys.intern(v) for h, v in obj["hash_lookup"].items()})
+        self.blocks = BinaryBlocks(filepath)
+        self.reply_parents = ReplyParents({sys.intern(h): None if p is None else sys.intern(p)
+                                           for h, p in obj["reply_parents"].items()})
+        self.revisions = obj["revisions"]
+        self._generation = obj["generation"]
+        self._filepath = filepath
+        # every write rewrites the file, so no per-revision changes are kept
+        self._journal = None
+
+    def _load_deferred(self) -> None:
+        """Loads the Intermediate whose loading was deferred."""
+        manifest = self._manifest
+        self._manifest = None
+        self.load_from_disk(self._filepath)
+        if self._generation != manifest["generation"] or self.get_last_revision_id() != manifest["last_revision_id"]:
+            # the files changed between the manifest being read and the Intermediate being loaded
+            logging.warning("Intermediate at %s no longer matches its manifest", self._filepath)
+
+    def _write_manifest(self) -> None:
+        """Writes the manifest of the Intermediate just written to self._filepath next to it, atomically.
+
+        :return: None
+        """
+        manifest_path = self._filepath + MANIFEST_SUFFIX
+        if len(self.revisions) == 0:
+            # nothing to answer from; the Intermediate is loaded instead
+            try:
+                os.remove(manifest_path)
+            except FileNotFoundError:
+                pass
+            return
+        paths = _manifest_paths(self._filepath)
+        obj = {}
+        obj["last_revision_id"] = self.revisions[-1][0]
+        obj["timestamp"] = self.revisions[-1][2]
+        obj["revisions"] = len(self.revisions)
+        obj["blocks"] = len(self.blocks)
+        obj["generation"] = self._generation
+        obj["files"] = _stat_files(paths)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(manifest_path)), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(obj, f)
+            os.replace(tmp_path, manifest_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _is_binary_target(self) -> bool:
+        """Returns whether self._filepath is to be written in the binary format: it is named so,
+        or it already holds a binary Intermediate."""
+        if is_binary_path(self._filepath):
+            return True
+        return os.path.exists(self._filepath) and is_binary_file(self._filepath)
+
+    def _write_binary(self) -> None:
+        """Writes the Intermediate in the binary format to self._filepath, copying the records of
+        blocks mapped from it that were not accessed.
+
+        :return: None
+        """
+        obj = {}
+        obj["hash_lookup"] = dict(self.hash_lookup.items())
+        obj["reply_parents"] = dict(self.reply_parents.items())
+        obj["revisions"] = list(self.revisions)
+        obj["generation"] = self._generation + 1
+        write_binary(self._filepath, obj, self.blocks)
+        self._generation += 1
+        if isinstance(self.blocks, BinaryBlocks):
+            self.blocks.remap(self._filepath)
+        self.hash_lookup.dirty.clear()
+        self.blocks.dirty.clear()
+        self.reply_parents.dirty.clear()
+        self._journal = None
+
+    def _replay_journal(self) -> None:
+        """Applies the changes recorded in the journal next to self._filepath. A truncated
+        final record (e.g. from a crash mid-write) is dropped and cut from the journal.
+
+        :return: None
+        """
+        journal_path = self._filepath + JOURNAL_SUFFIX
+        if not os.path.exists(journal_path):
+            return
+        with open(journal_path, "rb") as f:
+            lines = f.readlines()
+
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            header = {}
+        if header.get("generation") != self._generation:
+            logging.warning("Discarding stale journal %s", journal_path)
+            os.remove(journal_path)
+            return
+
+        good_bytes = len(lines[0])
+        for line in lines[1:]:
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError("record is missing its terminating newline")
+                record = json.loads(line)
+            except ValueError:
+                logging.warning("Dropping truncated record at the end of journal %s", journal_path)
+                with open(journal_path, "r+b") as f:
+                    f.truncate(good_bytes)
+                break
+            for h, v in record["hash_lookup"].items():
+                if v is None:
+                    self.hash_lookup.pop(h, None)
+                else:
+                    self.hash_lookup[sys.intern(h)] = sys.intern(v)
+            for h, b in record["blocks"].items():
+                if b is None:
+                    self.blocks.pop(h, None)
+                else:
+                    self.blocks[sys.intern(h)] = self._deserialize_block(b)
+            if "reply_parents" in record:
+                for h, p in record["reply_parents"].items():
+                    self.reply_parents[sys.intern(h)] = None if p is None else sys.intern(p)
+            else:
+                add_reply_chain_links({h: b["reply_chain"] for h, b in record["blocks"].items() if b is not None},
+                                      self.reply_parents)
+            self.revisions.append(record["revision"])
+            good_bytes += len(line)
+
+    def _atomic_write_json(self, obj: dict) -> None:
+        """Writes obj as json to a temporary file next to self._filepath, then renames it over self._filepath."""
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self._filepath)), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(obj, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._filepath)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _serialize_block(self, b: Block) -> dict:
+        """Converts a Block object to a json-serializable dict."""
+        block = {}
+        block["text"] = b.text
+        block["timestamp"] = b.timestamp
+        block["user"] = b.user
+        block["ingested"] = b.ingested
+        block["revisions"] = None if b.revision_ids is None else b.revision_ids.to_list()
+        block["is_followed"] = b.is_followed
+        block["is_header"] = b.is_header
+        block["root_hash"] = b.root_hash
+        return block
+
+    def _deserialize_block(self, b: dict) -> Block:
+        """Converts a json-ingested dict to a Block object."""
+        block = Block()
+        block.text = b["text"]
+        block.timestamp = b["timestamp"]
+        block.user = b["user"]
+        block.ingested = b["ingested"]
+        block.revision_ids = b["revisions"]
+        block.is_followed = b["is_followed"]
+        block.is_header = b["is_header"]
+        block.root_hash = b["root_hash"]
+        return block
+
     def _serialize_blocks(self) -> dict:
         """Converts all blocks from a dict of Block objects to a dict of json-serializable dicts.
 
@@ -194,17 +773,7 @@ class Intermediate:
         """
         res = {}
         for h, b in self.blocks.items():
-            block = {}
-            block["text"] = b.text
-            block["timestamp"] = b.timestamp
-            block["user"] = b.user
-            block["ingested"] = b.ingested
-            block["revisions"] = b.revision_ids
-            block["reply_chain"] = b.reply_chain
-            block["is_followed"] = b.is_followed
-            block["is_header"] = b.is_header
-            block["root_hash"] = b.root_hash
-            res[h] = block
+            res[h] = self._serialize_block(b)
         return res
 
     def _deserialize_blocks(self, blocks: dict) -> dict:
@@ -217,15 +786,5 @@ class Intermediate:
         """
         res = {}
         for h, b in blocks.items():
-            block = Block()
-            block.text = b["text"]
-            block.timestamp = b["timestamp"]
-            block.user = b["user"]
-            block.ingested = b["ingested"]
-            block.revision_ids = b["revisions"]
-            block.reply_chain = b["reply_chain"]
-            block.is_followed = b["is_followed"]
-            block.is_header = b["is_header"]
-            block.root_hash = b["root_hash"]
-            res[h] = block
+            res[sys.intern(h)] = self._deserialize_block(b)
         return res
@@ -0,0 +1,216 @@
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+METRIC_PREFIX = "revision_pipeline_"
+# upper bounds in seconds of the buckets of duration histograms, as in Prometheus
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_metrics = None
+
+
+class Histogram:
+    """Distribution of observed values over fixed buckets, with their count and sum.
+
+    :param buckets: upper bounds of the buckets, ascending
+    :type buckets: tuple
+
+    :ivar counts: number of observations in each bucket (not cumulative), the last for values above every bound
+    :type counts: list
+    :ivar count: number of observations
+    :type count: int
+    :ivar sum: sum of the observed values
+    :type sum: float
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self) -> list:
+        """Returns (upper bound, number of observations at most that bound) pairs, ending with "+Inf"."""
+        res = []
+        total = 0
+        for bound, n in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += n
+            res.append((bound, total))
+        return res
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "sum": self.sum,
+                "buckets": {str(bound): n for bound, n in self.cumulative_counts()}}
+
+
+class Metrics:
+    """A thread-safe registry of the counters and histograms recorded by the pipeline: API requests
+    and their latency, bytes downloaded, per-revision parse and apply times, blocks created, modified,
+    removed and moved, revisions skipped because of errors, and conversion times. Every metric may
+    carry labels (e.g. the API action). Listeners are called with each recorded value, so metrics
+    can also be forwarded elsewhere as they happen.
+
+    Metrics are recorded in the process that does the work: those of pages built by the worker
+    processes of pipeline.iter_corpora are not seen by the parent process.
+
+    :param buckets: upper bounds in seconds of the buckets of the histograms
+    :type buckets: tuple
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, listener) -> None:
+        """Registers a function called as listener(kind, name, value, labels) for every value
+        recorded, where kind is "counter" or "histogram".
+
+        :param listener: the function to be called
+        :type listener: callable
+
+        :return: None
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener) -> None:
+        self._listeners.remove(listener)
+
+    def increment(self, name: str, value: float = 1, **labels) -> None:
+        """Adds value to a counter.
+
+        :param name: name of the counter
+        :type name: str
+        :param value: amount added
+        :type value: float
+
+        :return: None
+        """
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        for listener in self._listeners:
+            listener("counter", name, value, labels)
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Records a value in a histogram.
+
+        :param name: name of the histogram
+        :type name: str
+        :param value: the observed value
+        :type value: float
+
+        :return: None
+        """
+        key = (name, _label_key(labels))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(self.buckets)
+            self._histograms[key].observe(value)
+        for listener in self._listeners:
+            listener("histogram", name, value, labels)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Records in a histogram the seconds spent in a with block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self) -> None:
+        """Forgets every value recorded so far.
+
+        :return: None
+        """
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+
+    def to_dict(self) -> dict:
+        """Returns every metric as a json-serializable dictionary, mapping the name of each counter
+        and histogram to a list of its series, one per combination of labels."""
+        res = {"counters": {}, "histograms": {}}
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                res["counters"].setdefault(name, []).append({"labels": dict(labels), "value": value})
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                series = histogram.to_dict()
+                series["labels"] = dict(labels)
+                res["histograms"].setdefault(name, []).append(series)
+        return res
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+    def to_prometheus(self) -> str:
+        """Returns every metric in the Prometheus text exposition format.
+
+        :return: the metrics, one sample per line
+        """
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((k, (h.cumulative_counts(), h.count, h.sum)) for k, h in self._histograms.items())
+        last_name = None
+        for (name, labels), value in counters:
+            if name != last_name:
+                lines.append("# TYPE %s%s counter" % (METRIC_PREFIX, name))
+                last_name = name
+            lines.append("%s%s%s %s" % (METRIC_PREFIX, name, _format_labels(labels), _format_value(value)))
+        for (name, labels), (cumulative_counts, count, total) in histograms:
+            if name != last_name:
+                lines.append("# TYPE %s%s histogram" % (METRIC_PREFIX, name))
+                last_name = name
+            for bound, n in cumulative_counts:
+                lines.append("%s%s_bucket%s %d" % (METRIC_PREFIX, name, _format_labels(labels + (("le", str(bound)),)), n))
+            lines.append("%s%s_sum%s %s" % (METRIC_PREFIX, name, _format_labels(labels), _format_value(total)))
+            lines.append("%s%s_count%s %d" % (METRIC_PREFIX, name, _format_labels(labels), count))
+        return "\n".join(lines) + "\n"
+
+
+def get_metrics() -> Metrics:
+    """Returns the Metrics the pipeline records into, creating it on first use."""
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+    return _metrics
+
+
+def set_metrics(metrics: Metrics) -> None:
+    """Sets the Metrics the pipeline records into (e.g. to start afresh or change the histogram buckets).
+
+    :param metrics: the metrics to be used
+    :type metrics: Metrics
+
+    :return: None
+    """
+    global _metrics
+    _metrics = metrics
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: tuple) -> str:
+    if len(labels) == 0:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join("%s=\"%s\"" % (k, v) for (k, _), v in zip(labels, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -1,21 +1,53 @@
 import os
-import requests
+import json
+import time
 import logging
-from bs4 import BeautifulSoup
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from tqdm import tqdm
 
 from convokit import Corpus, User, Utterance
 
 from . import helpers
 from .block import Block
-from .intermediate import Intermediate
+from .cache import DiffCache
+from .client import APIClient
+from .delta import RevisionDelta
+from .diff import local_compare, parse_diff_table
+from .intermediate import Intermediate, read_manifest
+from .metrics import get_metrics
+from .storage import SQLITE_SUFFIX
+from .binary import BINARY_SUFFIX
 
 BASE_API_URL = "https://en.wikipedia.org/w/api.php"
+DEFAULT_LOOKAHEAD = 32
+DEFAULT_CHECKPOINT_REVISIONS = 1000
+DEFAULT_CHECKPOINT_SECONDS = 300.0
+MAX_CONTENT_REVISIONS_PER_REQUEST = 50
+MAX_TITLES_PER_REQUEST = 50
+# the suffix of the Intermediate file of each storage format
+STORAGE_SUFFIXES = {"json": ".json", "sqlite": SQLITE_SUFFIX, "binary": BINARY_SUFFIX}
+
+# kinds of the operations produced by _parse_operations
+OP_UNEDITED = "unedited"
+OP_ADD = "add"
+OP_MOVE = "move"
+OP_MOVED_AWAY = "moved_away"
+OP_REMOVE = "remove"
+OP_MODIFY = "modify"
+OP_ERROR = "error"
+# the change made to a block by each kind of operation, as counted in the blocks_total metric
+BLOCK_CHANGES = {OP_ADD: "created", OP_MODIFY: "modified", OP_REMOVE: "removed", OP_MOVE: "moved"}
+
+_client = None
+_diff_cache = None
 
 
 def get_corpus(title: str, folder: str = "./intermediate_format",
     write_intermediate_to_disk: bool = True, rough: bool = False,
-    log_level: int = logging.WARNING) -> Corpus:
+    log_level: int = logging.WARNING, concurrency: int = 1,
+    lookahead: int = DEFAULT_LOOKAHEAD, local_diff: bool = False,
+    storage: str = "json", parse_workers: int = 1) -> Corpus:
     """
     The main function of the pipeline: returns a convokit Corpus object built
     from the stream of a Wikipedia talk page's revisions. Makes use of cached
@@ -32,10 +64,22 @@ def get_corpus(title: str, folder: str = "./intermediate_format",
     :type rough: bool
     :param log_level: desired level of logging, from logging library
     :type log_level: int
+    :param concurrency: number of revision diffs fetched from the API in parallel (1 fetches serially)
+    :type concurrency: int
+    :param lookahead: maximum number of revision diffs fetched ahead of the revision being processed
+    :type lookahead: int
+    :param local_diff: whether to fetch revision content in bulk and diff it locally instead of using the compare API
+    :type local_diff: bool
+    :param storage: how the Intermediate is stored on disk: "json" (snapshot plus journal), "sqlite" or "binary"
+    :type storage: str
+    :param parse_workers: number of processes parsing revision diffs ahead of the revision being applied (1 parses them in this process)
+    :type parse_workers: int
     """
     logging.getLogger().setLevel(log_level)
     accum = get_intermediate(
-        title, folder, write_intermediate_to_disk, log_level)
+        title, folder, write_intermediate_to_disk, log_level,
+        concurrency=concurrency, lookahead=lookahead, local_diff=local_diff,
+        storage=storage, parse_workers=parse_workers)
     logging.info("generating corpus...")
     if rough:
         corpus = rough_convert_intermediate_to_corpus(accum)
@@ -45,13 +89,183 @@ def get_corpus(title: str, folder: str = "./intermediate_format",
     return corpus
 
 
+def get_corpora(titles: list, workers: int = 1, folder: str = "./intermediate_format",
+    write_intermediate_to_disk: bool = True, rough: bool = False,
+    log_level: int = logging.WARNING, concurrency: int = 1,
+    lookahead: int = DEFAULT_LOOKAHEAD, local_diff: bool = False,
+    storage: str = "json") -> Corpus:
+    """
+    Returns a single convokit Corpus holding the conversations of many talk pages, each built
+    as get_corpus would in a pool of worker processes. Each utterance records the page it
+    comes from in its "page_title" meta; an utterance whose id is already used by another page
+    gets the id "<title>:<id>". Pages that fail are logged and left out.
+
+    :param titles: Titles of the Wikipedia pages whose talk pages are sought. May include the "Talk:" prefix, but not required.
+    :type titles: list
+    :param workers: number of pages processed in parallel, each in its own process (1 processes them in this process)
+    :type workers: int
+    :param folder: Directory containing Intermediate .jsons and destination of Intermediates if writing to disk.
+    :type folder: str
+    :param write_intermediate_to_disk: Whether to write each Intermediate file to disk after producing or updating it.
+    :type write_intermediate_to_disk: bool
+    :param rough: Whether to use rough or normal conversion of intermediate to corpus
+    :type rough: bool
+    :param log_level: desired level of logging, from logging library
+    :type log_level: int
+    :param concurrency: number of revision diffs of a page fetched from the API in parallel (1 fetches serially)
+    :type concurrency: int
+    :param lookahead: maximum number of revision diffs fetched ahead of the revision being processed
+    :type lookahead: int
+    :param local_diff: whether to fetch revision content in bulk and diff it locally instead of using the compare API
+    :type local_diff: bool
+    :param storage: how the Intermediates are stored on disk: "json" (snapshot plus journal), "sqlite" or "binary"
+    :type storage: str
+
+    :return: the Corpus of all pages that could be processed
+    """
+    corpora = dict(iter_corpora(titles, workers, folder, write_intermediate_to_disk, rough,
+        log_level, concurrency, lookahead, local_diff, storage))
+    utterances = {}
+    failed = []
+    # merged in the order of titles, whatever order the pages finished in
+    for title in titles:
+        corpus = corpora[title]
+        if corpus is None:
+            failed.append(title)
+            continue
+        # utterance ids are block hashes, so pages holding the same text (e.g. a common section header)
+        # share ids; those of the later page are prefixed with its title
+        renamed = {utt.id: title + ":" + utt.id for utt in corpus.iter_utterances() if utt.id in utterances}
+        for utt in corpus.iter_utterances():
+            utt.id = renamed.get(utt.id, utt.id)
+            utt.reply_to = renamed.get(utt.reply_to, utt.reply_to)
+            utt.root = renamed.get(utt.root, utt.root)
+            utt.meta["page_title"] = title
+            utterances[utt.id] = utt
+    if len(failed) > 0:
+        logging.warning("%d of %d pages could not be processed: %s", len(failed), len(titles), ", ".join(failed))
+    return Corpus(utterances=list(utterances.values()))
+
+
+def iter_corpora(titles: list, workers: int = 1, folder: str = "./intermediate_format",
+    write_intermediate_to_disk: bool = True, rough: bool = False,
+    log_level: int = logging.WARNING, concurrency: int = 1,
+    lookahead: int = DEFAULT_LOOKAHEAD, local_diff: bool = False,
+    storage: str = "json"):
+    """
+    Builds or updates the corpora of many talk pages in a pool of worker processes, yielding
+    each page's Corpus as soon as it is ready. Pages are processed independently: a page that
+    fails is logged and yielded with None instead of its Corpus, and the other pages carry on.
+    Which Intermediates on disk are behind is looked up for all pages at once (see get_intermediates).
+
+    Each worker process queries the API through its own copy of the APIClient, so a rate limit
+    set on the client applies to each worker separately.
+
+    :param titles: Titles of the Wikipedia pages whose talk pages are sought. May include the "Talk:" prefix, but not required.
+    :type titles: list
+    :param workers: number of pages processed in parallel, each in its own process (1 processes them in this process)
+    :type workers: int
+    :param folder: Directory containing Intermediate .jsons and destination of Intermediates if writing to disk.
+    :type folder: str
+    :param write_intermediate_to_disk: Whether to write each Intermediate file to disk after producing or updating it.
+    :type write_intermediate_to_disk: bool
+    :param rough: Whether to use rough or normal conversion of intermediate to corpus
+    :type rough: bool
+    :param log_level: desired level of logging, from logging library
+    :type log_level: int
+    :param concurrency: number of revision diffs of a page fetched from the API in parallel (1 fetches serially)
+    :type concurrency: int
+    :param lookahead: maximum number of revision diffs fetched ahead of the revision being processed
+    :type lookahead: int
+    :param local_diff: whether to fetch revision content in bulk and diff it locally instead of using the compare API
+    :type local_diff: bool
+    :param storage: how the Intermediates are stored on disk: "json" (snapshot plus journal), "sqlite" or "binary"
+    :type storage: str
+
+    :return: generator of (title, Corpus or None) pairs, in the order the pages finish
+    """
+    logging.getLogger().setLevel(log_level)
+    assert(storage in STORAGE_SUFFIXES)
+    assert(workers >= 1)
+    filepaths = {title: _intermediate_filepath(title, folder, storage) for title in titles}
+    last_revision_ids = _get_last_revision_ids([title for title in titles if os.path.exists(filepaths[title])])
+    options = (folder, write_intermediate_to_disk, rough, concurrency, lookahead, local_diff, storage)
+
+    show_progress = logging.getLogger().level <= logging.INFO
+    if show_progress:
+        pbar = tqdm(total=len(titles), unit="page")
+    if workers == 1:
+        results = (_build_corpus(title, filepaths[title], last_revision_ids.get(title), options) for title in titles)
+        executor = None
+    else:
+        # the per-revision progress bars of the workers would overwrite each other
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_corpus_worker,
+                                       initargs=(max(log_level, logging.WARNING),))
+        futures = {executor.submit(_build_corpus, title, filepaths[title], last_revision_ids.get(title), options): title
+                   for title in titles}
+        results = (_corpus_result(futures[future], future) for future in as_completed(futures))
+    try:
+        for title, corpus in results:
+            if show_progress:
+                pbar.update(1)
+            yield title, corpus
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if show_progress:
+            pbar.close()
+
+
+def _init_corpus_worker(log_level: int) -> None:
+    """Prepares a worker process of iter_corpora."""
+    logging.getLogger().setLevel(log_level)
+    if _client is not None:
+        # pooled connections inherited from the parent process must not be shared with it
+        _client.close()
+
+
+def _build_corpus(title: str, filepath: str, last_revision_id: int, options: tuple) -> tuple:
+    """Builds or updates the Intermediate of a single page for iter_corpora and converts it to a Corpus.
+
+    :return: a tuple (title, Corpus), with None as the Corpus if the page could not be processed
+    """
+    folder, write_intermediate_to_disk, rough, concurrency, lookahead, local_diff, storage = options
+    try:
+        accum = _get_intermediate(title, folder, filepath, write_intermediate_to_disk, concurrency,
+            lookahead, local_diff, storage, lambda title, accum: accum.get_last_revision_id() == last_revision_id)
+        corpus = rough_convert_intermediate_to_corpus(accum) if rough else convert_intermediate_to_corpus(accum)
+    except Exception as e:
+        logging.debug(e, exc_info=True)
+        logging.warning("Could not process %s: %s", title, e)
+        return title, None
+    return title, corpus
+
+
+def _corpus_result(title: str, future) -> tuple:
+    """Returns the result of a _build_corpus future, or (title, None) if its worker process failed."""
+    try:
+        return future.result()
+    except Exception as e:
+        logging.debug(e, exc_info=True)
+        logging.warning("Could not process %s: %s", title, e)
+        return title, None
+
+
 def get_intermediate(title: str, folder: str = "./intermediate_format",
-    write_intermediate_to_disk: bool = True, log_level: int = logging.WARNING) -> Intermediate:
+    write_intermediate_to_disk: bool = True, log_level: int = logging.WARNING,
+    concurrency: int = 1, lookahead: int = DEFAULT_LOOKAHEAD,
+    local_diff: bool = False, storage: str = "json", parse_workers: int = 1,
+    checkpoint_revisions: int = DEFAULT_CHECKPOINT_REVISIONS,
+    checkpoint_seconds: float = DEFAULT_CHECKPOINT_SECONDS) -> Intermediate:
     """
     Produces the most up-to-date Intermediate possible from the given talk page title and manages
     its storage on disk. Makes use of cached Intermediate data formats on disk if they are available, and will then only
     ingest the latest revisions.
 
+    While writing to disk, the Intermediate is checkpointed every checkpoint_revisions revisions or
+    checkpoint_seconds seconds, so that a build that is interrupted resumes from its last checkpoint
+    when get_intermediate is called again.
+
     :param title: Title of the Wikipedia page whose talk page is sought. May include the "Talk:" prefix, but not required.
     :type title: str
     :param folder: Directory containing Intermediate .jsons and destination of Intermediate if writing to disk.
@@ -60,27 +274,121 @@ def get_intermediate(title: str, folder: str = "./intermediate_format",
     :type write_intermediate_to_disk: bool
     :param log_level: desired level of logging, from logging library
     :type log_level: int
+    :param concurrency: number of revision diffs fetched from the API in parallel (1 fetches serially)
+    :type concurrency: int
+    :param lookahead: maximum number of revision diffs fetched ahead of the revision being processed
+    :type lookahead: int
+    :param local_diff: whether to fetch revision content in bulk and diff it locally instead of using the compare API
+    :type local_diff: bool
+    :param storage: how the Intermediate is stored on disk: "json" (snapshot plus journal), "sqlite" or "binary"
+    :type storage: str
+    :param parse_workers: number of processes parsing revision diffs ahead of the revision being applied (1 parses them in this process)
+    :type parse_workers: int
+    :param checkpoint_revisions: when writing to disk, the Intermediate is also written every this many revisions while it is built or updated (None to only write it at the end)
+    :type checkpoint_revisions: int
+    :param checkpoint_seconds: when writing to disk, the Intermediate is also written at least this often, in seconds, while it is built or updated (None to only write it at the end)
+    :type checkpoint_seconds: float
+    """
+    logging.getLogger().setLevel(log_level)
+    assert(storage in STORAGE_SUFFIXES)
+    return _get_intermediate(title, folder, _intermediate_filepath(title, folder, storage),
+        write_intermediate_to_disk, concurrency, lookahead, local_diff, storage, accum_up_to_date, parse_workers,
+        checkpoint_revisions, checkpoint_seconds)
+
+
+def get_intermediates(titles: list, folder: str = "./intermediate_format",
+    write_intermediate_to_disk: bool = True, log_level: int = logging.WARNING,
+    concurrency: int = 1, lookahead: int = DEFAULT_LOOKAHEAD,
+    local_diff: bool = False, storage: str = "json", parse_workers: int = 1) -> dict:
+    """
+    Produces the most up-to-date Intermediates possible for many talk pages, as get_intermediate does
+    for one. The latest revision ids of the pages with an Intermediate on disk are looked up
+    MAX_TITLES_PER_REQUEST titles per request, and only the Intermediates that are behind are updated.
+
+    :param titles: Titles of the Wikipedia pages whose talk pages are sought. May include the "Talk:" prefix, but not required.
+    :type titles: list
+    :param folder: Directory containing Intermediate .jsons and destination of Intermediates if writing to disk.
+    :type folder: str
+    :param write_intermediate_to_disk: Whether to write each Intermediate file to disk after producing or updating it.
+    :type write_intermediate_to_disk: bool
+    :param log_level: desired level of logging, from logging library
+    :type log_level: int
+    :param concurrency: number of revision diffs fetched from the API in parallel (1 fetches serially)
+    :type concurrency: int
+    :param lookahead: maximum number of revision diffs fetched ahead of the revision being processed
+    :type lookahead: int
+    :param local_diff: whether to fetch revision content in bulk and diff it locally instead of using the compare API
+    :type local_diff: bool
+    :param storage: how the Intermediates are stored on disk: "json" (snapshot plus journal), "sqlite" or "binary"
+    :type storage: str
+    :param parse_workers: number of processes parsing revision diffs ahead of the revision being applied (1 parses them in this process)
+    :type parse_workers: int
+
+    :return: a dictionary mapping each title to its Intermediate
     """
     logging.getLogger().setLevel(log_level)
-    filename=(title[5:] if title[:5].lower() == "talk:" else title) + ".json"
-    filepath=os.path.join(folder, filename)
+    assert(storage in STORAGE_SUFFIXES)
+    filepaths = {title: _intermediate_filepath(title, folder, storage) for title in titles}
+    last_revision_ids = _get_last_revision_ids([title for title in titles if os.path.exists(filepaths[title])])
+    logging.info("%d of %d intermediates found on disk", len(last_revision_ids), len(titles))
+
+    def up_to_date(title, accum):
+        return accum.get_last_revision_id() == last_revision_ids.get(title)
+
+    intermediates = {}
+    for title in titles:
+        intermediates[title] = _get_intermediate(title, folder, filepaths[title], write_intermediate_to_disk,
+            concurrency, lookahead, local_diff, storage, up_to_date, parse_workers)
+    return intermediates
+
+
+def _intermediate_filepath(title: str, folder: str, storage: str) -> str:
+    """Returns the location on disk of the Intermediate of the talk page given by title."""
+    filename=(title[5:] if title[:5].lower() == "talk:" else title) + STORAGE_SUFFIXES[storage]
+    return os.path.join(folder, filename)
+
+
+def _get_intermediate(title: str, folder: str, filepath: str, write_intermediate_to_disk: bool,
+    concurrency: int, lookahead: int, local_diff: bool, storage: str, up_to_date,
+    parse_workers: int = 1, checkpoint_revisions: int = DEFAULT_CHECKPOINT_REVISIONS,
+    checkpoint_seconds: float = DEFAULT_CHECKPOINT_SECONDS) -> Intermediate:
+    """Generates, loads or updates the Intermediate of a talk page stored at filepath, where
+    up_to_date(title, accum) tells whether a loaded Intermediate has every revision. If the
+    Intermediate has a valid manifest, its loading is deferred until its data is needed, so
+    finding it up to date does not load it."""
     is_up_to_date=False
+    if not write_intermediate_to_disk:
+        checkpoint_revisions, checkpoint_seconds = None, None
 
     if not os.path.exists(filepath) and write_intermediate_to_disk:
         if not os.path.exists(folder) and write_intermediate_to_disk:
             os.mkdir(folder)
         logging.info("generating %s talk page intermediate from scratch...", title)
-        accum=generate_intermediate_from_scratch(title)
-        accum.set_filepath(filepath)
+        # a SQLite Intermediate is built directly in its database, committing every revision; a json or
+        # binary Intermediate is checkpointed to filepath, from which an interrupted build resumes below
+        if storage == "sqlite":
+            accum=Intermediate(filepath)
+        else:
+            accum=Intermediate()
+            accum.set_filepath(filepath)
+        accum=generate_intermediate_from_scratch(title, concurrency, lookahead, local_diff, accum, parse_workers,
+            checkpoint_revisions, checkpoint_seconds)
         logging.info("intermediate generated.")
     else:
         logging.info("updating intermediate at %s", filepath)
-        accum=Intermediate(filepath)
-        if accum_up_to_date(title, accum):
+        manifest=read_manifest(filepath)
+        accum=Intermediate(filepath, manifest)
+        # manifests are only written for Intermediates with revisions
+        if manifest is None and len(accum.revisions) == 0:
+            # a SQLite build that was interrupted before its first revision
+            accum=generate_intermediate_from_scratch(title, concurrency, lookahead, local_diff, accum, parse_workers,
+                checkpoint_revisions, checkpoint_seconds)
+        elif up_to_date(title, accum):
             is_up_to_date=True
             logging.info("intermediate already up to date")
         else:
-            accum=update_intermediate(title, accum)
+            accum=update_intermediate(title, accum, concurrency, lookahead, local_diff, parse_workers,
+                checkpoint_revisions, checkpoint_seconds)
             logging.info("intermediate updated.")
     if write_intermediate_to_disk and not is_up_to_date:
         accum.write_to_disk()
@@ -92,35 +400,102 @@ def accum_up_to_date(title: str, accum: Intermediate) -> bool:
     most_recent_in_accum=accum.get_last_revision_id()
     return (most_recent_in_accum == _get_last_revision_id(title))
 
-def update_intermediate(title: str, accum: Intermediate) -> Intermediate:
+def update_intermediate(title: str, accum: Intermediate, concurrency: int = 1,
+    lookahead: int = DEFAULT_LOOKAHEAD, local_diff: bool = False, parse_workers: int = 1,
+    checkpoint_revisions: int = None, checkpoint_seconds: float = None) -> Intermediate:
     """Updates the given Intermediate with the latest uningested revisions.
 
     :param title: the title of the talk page of the Intermediate
     :type title: str
     :param accum: the Intermediate to be updated
     :type accum: Intermediate
+    :param concurrency: number of revision diffs fetched from the API in parallel
+    :type concurrency: int
+    :param lookahead: maximum number of revision diffs fetched ahead of the revision being processed
+    :type lookahead: int
+    :param local_diff: whether to fetch revision content in bulk and diff it locally instead of using the compare API
+    :type local_diff: bool
+    :param parse_workers: number of processes parsing revision diffs ahead of the revision being applied (1 parses them in this process)
+    :type parse_workers: int
+    :param checkpoint_revisions: if accum has a filepath, it is written to disk every this many revisions (None to never write it)
+    :type checkpoint_revisions: int
+    :param checkpoint_seconds: if accum has a filepath, it is written to disk at least this often, in seconds (None to never write it)
+    :type checkpoint_seconds: float
 
     :return: the updated Intermediate
     """
     if title[:5].lower() != "talk:":
         title="Talk:" + title
     last_revid=accum.get_last_revision_id()
-    accum=_process_revisions_since_revid(title, last_revid, accum)
+    accum=_process_revisions_since_revid(title, last_revid, accum, concurrency, lookahead, local_diff, parse_workers,
+        checkpoint_revisions, checkpoint_seconds)
     return accum
 
 
-def generate_intermediate_from_scratch(title: str) -> Intermediate:
+def iter_revision_deltas(title: str, accum: Intermediate = None, concurrency: int = 1,
+    lookahead: int = DEFAULT_LOOKAHEAD, local_diff: bool = False, parse_workers: int = 1):
+    """Ingests the revisions of a talk page one at a time, yielding the changes each one made as soon
+    as it has been applied. Builds upon accum if it has revisions (yielding only the revisions since
+    its last), and from the first revision of the page otherwise. accum is updated in place, as by
+    update_intermediate, and can be written to disk once the generator is exhausted.
+
+    :param title: the title of the talk page (may or may not include "Talk:" prefix)
+    :type title: str
+    :param accum: the Intermediate to be updated (Optional, a new Intermediate by default)
+    :type accum: Intermediate
+    :param concurrency: number of revision diffs fetched from the API in parallel
+    :type concurrency: int
+    :param lookahead: maximum number of revision diffs fetched ahead of the revision being processed
+    :type lookahead: int
+    :param local_diff: whether to fetch revision content in bulk and diff it locally instead of using the compare API
+    :type local_diff: bool
+    :param parse_workers: number of processes parsing revision diffs ahead of the revision being applied (1 parses them in this process)
+    :type parse_workers: int
+
+    :return: generator of RevisionDelta, one per revision, in revision order
+    """
+    if title[:5].lower() != "talk:":
+        title="Talk:" + title
+    if accum is None:
+        accum=Intermediate()
+    fromid=accum.get_last_revision_id() if len(accum.revisions) > 0 else _get_first_revision_id(title)
+    diffs, _ = _revision_diffs_since_revid(title, fromid, concurrency, lookahead, local_diff)
+    for pair, operations in _iter_revision_operations(diffs, parse_workers, lookahead):
+        present = {op[1] for op in operations if op[0] == OP_REMOVE and op[1] in accum.blocks}
+        applied = _apply_revision_operations(pair, operations, accum)
+        yield _revision_delta(pair, operations[:applied], accum, present)
+
+
+def generate_intermediate_from_scratch(title: str, concurrency: int = 1,
+    lookahead: int = DEFAULT_LOOKAHEAD, local_diff: bool = False,
+    accum: Intermediate = None, parse_workers: int = 1, checkpoint_revisions: int = None,
+    checkpoint_seconds: float = None) -> Intermediate:
     """Generates an up-to-date Intermediate from the beginning of a page's revision history.
 
     :param title: the title of the talk page to be processed (may or may not include "Talk:" prefix)
     :type title:
+    :param concurrency: number of revision diffs fetched from the API in parallel
+    :type concurrency: int
+    :param lookahead: maximum number of revision diffs fetched ahead of the revision being processed
+    :type lookahead: int
+    :param local_diff: whether to fetch revision content in bulk and diff it locally instead of using the compare API
+    :type local_diff: bool
+    :param accum: an empty Intermediate to build into, e.g. one backed by SQLite (Optional)
+    :type accum: Intermediate
+    :param parse_workers: number of processes parsing revision diffs ahead of the revision being applied (1 parses them in this process)
+    :type parse_workers: int
+    :param checkpoint_revisions: if accum has a filepath, it is written to disk every this many revisions (None to never write it)
+    :type checkpoint_revisions: int
+    :param checkpoint_seconds: if accum has a filepath, it is written to disk at least this often, in seconds (None to never write it)
+    :type checkpoint_seconds: float
 
     :return: Intermediate formed by processing all of that page's revisions
     """
     if title[:5].lower() != "talk:":
         title="Talk:" + title
     first_revid=_get_first_revision_id(title)
-    accum=_process_revisions_since_revid(title, first_revid, Intermediate())
+    accum=_process_revisions_since_revid(title, first_revid, accum if accum is not None else Intermediate(),
+        concurrency, lookahead, local_diff, parse_workers, checkpoint_revisions, checkpoint_seconds)
     return accum
 
 
@@ -132,61 +507,234 @@ def convert_intermediate_to_corpus(accum: Intermediate) -> Corpus:
 
     :return: the Corpus generated from accum
     """
+    start=time.perf_counter()
+    accum.take_changed_blocks()
     users={}
     utterances=[]
-    unknown_len=set()
+    block_hashes_to_utt_ids={}
+    unconverted_blocks=set()
+    complete_utterances, block_hashes_to_segments=_find_complete_utterances(
+        accum, accum.blocks.items(), users, unconverted_blocks)
+
+    for utt in iter(complete_utterances):
+        this_utterance=_build_utterance(accum, utt, block_hashes_to_segments, users)
+        for each_hash in this_utterance.meta["constituent_blocks"]:
+            block_hashes_to_utt_ids[each_hash]=this_utterance.id
+        utterances.append(this_utterance)
+
+    corpus = Corpus(utterances=utterances)
+    corpus.meta["reverse_block_index"] = block_hashes_to_utt_ids
+    corpus.meta["unconverted_blocks"] = list(unconverted_blocks)
+
+    get_metrics().observe("conversion_seconds", time.perf_counter() - start, converter="full")
+    return corpus
+
+
+def export_intermediate_to_corpus(accum: Intermediate, dirpath: str) -> None:
+    """Converts an Intermediate as convert_intermediate_to_corpus does, writing each utterance to disk
+    in convokit's corpus layout as soon as it is built rather than building a Corpus, so that the text
+    of only one utterance is held at a time. Memory still grows with the number of blocks, as the block
+    hashes of every utterance, their segments and the reverse block index are held while converting.
+    The corpus is then loaded with Corpus(filename=dirpath).
+
+    dirpath receives utterances.jsonl (one utterance per line), users.json and conversations.json (each
+    mapping ids to their empty meta), corpus.json (the reverse_block_index and unconverted_blocks meta)
+    and index.json (the types of the meta fields).
+
+    :param accum: the Intermediate to be converted
+    :type accum: Intermediate
+    :param dirpath: the directory the corpus is written to, created if it does not exist
+    :type dirpath: str
+
+    :return: None
+    """
+    start=time.perf_counter()
+    accum.take_changed_blocks()
+    os.makedirs(dirpath, exist_ok=True)
+    users={}
+    unconverted_blocks=set()
+    complete_utterances, block_hashes_to_segments=_find_complete_utterances(
+        accum, accum.blocks.items(), users, unconverted_blocks)
+
+    # in a single pass, as in a Corpus the last of the utterances sharing an id is kept, and as in
+    # convert_intermediate_to_corpus a block belongs to the last utterance containing it
+    utterances_by_id={}
+    block_hashes_to_utt_ids={}
+    for utt in iter(complete_utterances):
+        block_hashes=utt.split(" ")
+        utterances_by_id[block_hashes[0]]=utt
+        for each_hash in block_hashes:
+            block_hashes_to_utt_ids[each_hash]=block_hashes[0]
+    del complete_utterances
+    with open(os.path.join(dirpath, "corpus.json"), "w") as f:
+        json.dump({"unconverted_blocks": list(unconverted_blocks), "reverse_block_index": block_hashes_to_utt_ids}, f)
+    del block_hashes_to_utt_ids, unconverted_blocks
+
+    roots=set()
+    with open(os.path.join(dirpath, "utterances.jsonl"), "w") as f:
+        while utterances_by_id:
+            _, utt=utterances_by_id.popitem()
+            u=_utterance_fields(accum, utt, block_hashes_to_segments)
+            f.write(json.dumps(u) + "\n")
+            roots.add(u["root"])
+
+    with open(os.path.join(dirpath, "users.json"), "w") as f:
+        json.dump({user: {} for user in users}, f)
+    with open(os.path.join(dirpath, "conversations.json"), "w") as f:
+        json.dump({root: {} for root in roots}, f)
+    with open(os.path.join(dirpath, "index.json"), "w") as f:
+        json.dump({
+            "utterances-index": {"constituent_blocks": str(list), "last_revision": str(int)},
+            "users-index": {},
+            "conversations-index": {},
+            "overall-index": {"reverse_block_index": str(dict), "unconverted_blocks": str(list)},
+            "version": 0}, f)
+
+    get_metrics().observe("conversion_seconds", time.perf_counter() - start, converter="export")
+
+
+def update_corpus(corpus: Corpus, accum: Intermediate) -> Corpus:
+    """Brings a Corpus generated by convert_intermediate_to_corpus up to date with the revisions
+    ingested into accum since then. Only the utterances containing blocks created, modified or
+    removed since the last conversion are rebuilt, along with the utterances replying to them or
+    rooted at them (whose reply_to or root may have changed), and blocks that could not be converted
+    last time are retried; all other utterances are kept as they are.
+
+    :param corpus: the Corpus previously generated from accum (must carry the "reverse_block_index" meta)
+    :type corpus: Corpus
+    :param accum: the Intermediate the Corpus was generated from, updated since
+    :type accum: Intermediate
+
+    :return: the updated Corpus
+    """
+    start=time.perf_counter()
+    changed=accum.take_changed_blocks()
+    block_hashes_to_utt_ids=corpus.meta.get("reverse_block_index")
+    if block_hashes_to_utt_ids is None:
+        logging.warning("Corpus has no reverse block index; converting the whole intermediate")
+        return convert_intermediate_to_corpus(accum)
+
+    utterances={utt.id: utt for utt in corpus.iter_utterances()}
+    stale_ids={block_hashes_to_utt_ids[h] for h in changed if h in block_hashes_to_utt_ids}
+    stale_ids |= {utt.id for utt in utterances.values() if utt.reply_to in stale_ids or utt.root in stale_ids}
+    # an utterance may only be complete as part of the reply chain of a block replying to it, so the
+    # utterances that stale ones reply to are re-evaluated as well
+    stale_ids |= {utterances[u_id].reply_to for u_id in stale_ids
+                  if u_id in utterances and utterances[u_id].reply_to is not None}
+
+    to_rebuild={h for h in changed if h in accum.blocks}
+    to_rebuild |= {h for h in corpus.meta.get("unconverted_blocks", []) if h in accum.blocks}
+    # which is why the replies to stale utterances are rebuilt too (without being dropped)
+    replies_to_stale={utt.id for utt in utterances.values() if utt.reply_to in stale_ids}
+    for u_id in stale_ids | replies_to_stale:
+        if u_id in utterances:
+            for h in utterances[u_id].meta["constituent_blocks"]:
+                ultimate_hash=accum.find_ultimate_hash(h)
+                if ultimate_hash in accum.blocks:
+                    to_rebuild.add(ultimate_hash)
+
+    users={utt.user.id: utt.user for utt in utterances.values()}
+    unconverted_blocks=set()
+    segmentation_cache={}
+    complete_utterances, block_hashes_to_segments=_find_complete_utterances(
+        accum, ((h, accum.blocks[h]) for h in to_rebuild), users, unconverted_blocks, segmentation_cache)
+    for utt in complete_utterances:
+        # utterances formed earlier in a rebuilt reply chain need their own first block's segments
+        first_hash=utt.split(" ")[0]
+        if first_hash not in block_hashes_to_segments:
+            block_hashes_to_segments[first_hash]=accum.segment_reply_chain(first_hash, segmentation_cache)
+
+    for u_id in stale_ids:
+        stale_utterance=utterances.pop(u_id, None)
+        if stale_utterance is not None:
+            for h in stale_utterance.meta["constituent_blocks"]:
+                if block_hashes_to_utt_ids.get(h) == u_id:
+                    del block_hashes_to_utt_ids[h]
+
+    for utt in iter(complete_utterances):
+        this_utterance=_build_utterance(accum, utt, block_hashes_to_segments, users)
+        for each_hash in this_utterance.meta["constituent_blocks"]:
+            block_hashes_to_utt_ids[each_hash]=this_utterance.id
+        utterances[this_utterance.id]=this_utterance
+
+    logging.info("updated %d of %d utterances", len(complete_utterances), len(utterances))
+    corpus = Corpus(utterances=list(utterances.values()))
+    corpus.meta["reverse_block_index"] = block_hashes_to_utt_ids
+    corpus.meta["unconverted_blocks"] = list(unconverted_blocks)
+
+    get_metrics().observe("conversion_seconds", time.perf_counter() - start, converter="update")
+    return corpus
+
+
+def _find_complete_utterances(accum: Intermediate, blocks, users: dict, unconverted_blocks: set = None,
+    segmentation_cache: dict = None) -> tuple:
+    """Segments the reply chains of the given blocks into utterances.
+
+    :param accum: the Intermediate the blocks belong to
+    :type accum: Intermediate
+    :param blocks: iterable of (block hash, Block) pairs
+    :param users: dictionary of User objects by username, added to for each new user
+    :type users: dict
+    :param unconverted_blocks: if given, the hashes of blocks that could not be segmented are added to it
+    :type unconverted_blocks: set
+
+    :param segmentation_cache: if given, the cache of reply chain segmentations to use (see Intermediate.segment_reply_chain)
+    :type segmentation_cache: dict
+
+    :return: a tuple (set of complete utterances, each a string of segment hashes; dictionary mapping block hashes to their segmentation)
+    """
     complete_utterances=set()
     block_hashes_to_segments={}
-    block_hashes_to_utt_ids={}
-    for block_hash, block in accum.blocks.items():
+    if segmentation_cache is None:
+        segmentation_cache={}
+    seen_segments=set()
+    for block_hash, block in blocks:
         try:
             if block.user not in users:
                 users[block.user]=User(id = block.user)
-            segments=accum.segment_contiguous_blocks(block.reply_chain)
-            assert(block_hash == segments[-1][-1])
+            earlier, last=accum.segment_reply_chain(block_hash, segmentation_cache)
+            assert(block_hash == last[-1])
             # any complete contiguous block is a complete utterance
-            for seg in segments[:-1]:
+            for seg in helpers.unseen_segments(earlier, seen_segments):
                 sos=helpers.string_of_seg(seg)
                 complete_utterances.add(sos)
-            if block.is_header or not accum.blocks[segments[-1][-1]].is_followed:
-                complete_utterances.add(helpers.string_of_seg(segments[-1]))
-            block_hashes_to_segments[block_hash]=segments
+            if block.is_header or not block.is_followed:
+                complete_utterances.add(helpers.string_of_seg(last))
+            block_hashes_to_segments[block_hash]=(earlier, last)
         except Exception as e:
             logging.debug(e, exc_info=True)
             logging.warning('Issue with conversion to corpus; skipping adding block "%s..."', block.text[:32])
+            if unconverted_blocks is not None:
+                unconverted_blocks.add(block_hash)
+    return complete_utterances, block_hashes_to_segments
 
-    for utt in iter(complete_utterances):
-        block_hashes=utt.split(" ")
-        belongs_to_segment=block_hashes_to_segments[block_hashes[0]]
-        first_block=accum.blocks[block_hashes[0]]
 
-        u_id=block_hashes[0]
-        u_user=users[first_block.user]
-        u_root=accum.find_ultimate_hash(first_block.root_hash)
-        u_replyto=_find_reply_to_from_segment(belongs_to_segment)
-        u_timestamp=first_block.timestamp
-        u_text="\n".join([accum.blocks[h].text for h in block_hashes])
-        u_meta={}
-        u_meta["constituent_blocks"]=block_hashes
-        u_meta["last_revision"]=first_block.revision_ids[-1] if first_block.revision_ids[-1] != "unknown" else 0
-        for each_hash in block_hashes:
-            block_hashes_to_utt_ids[each_hash]=u_id
+def _build_utterance(accum: Intermediate, utt: str, block_hashes_to_segments: dict, users: dict) -> Utterance:
+    """Builds the Utterance formed by the blocks in utt, a string of segment hashes."""
+    u=_utterance_fields(accum, utt, block_hashes_to_segments)
+    u["user"]=users[u["user"]]
+    return Utterance(**u)
 
-        this_utterance=Utterance(
-            id=u_id,
-            user=u_user,
-            root=u_root,
-            reply_to=u_replyto,
-            timestamp=u_timestamp,
-            text=u_text,
-            meta=u_meta)
 
-        utterances.append(this_utterance)
+def _utterance_fields(accum: Intermediate, utt: str, block_hashes_to_segments: dict) -> dict:
+    """Returns the fields of the Utterance formed by the blocks in utt, a string of segment hashes,
+    with the name of its user as "user"."""
+    block_hashes=utt.split(" ")
+    belongs_to_segment=block_hashes_to_segments[block_hashes[0]]
+    first_block=accum.blocks[block_hashes[0]]
 
-    corpus = Corpus(utterances=utterances)
-    corpus.meta["reverse_block_index"] = block_hashes_to_utt_ids
+    u_meta={}
+    u_meta["constituent_blocks"]=block_hashes
+    u_meta["last_revision"]=first_block.revision_ids[-1] if first_block.revision_ids[-1] != "unknown" else 0
 
-    return corpus
+    return {
+        "id": block_hashes[0],
+        "user": first_block.user,
+        "root": accum.find_ultimate_hash(first_block.root_hash),
+        "reply_to": _find_reply_to_from_segment(belongs_to_segment),
+        "timestamp": first_block.timestamp,
+        "text": "\n".join([accum.blocks[h].text for h in block_hashes]),
+        "meta": u_meta}
 
 
 def rough_convert_intermediate_to_corpus(accum: Intermediate) -> Corpus:
@@ -199,28 +747,9 @@ def rough_convert_intermediate_to_corpus(accum: Intermediate) -> Corpus:
 
     :return: the Corpus generated from accum
     """
+    start=time.perf_counter()
     users={}
-    utterances=[]
-    unknown_len=set()
-    complete_utterances=set()
-    block_hashes_to_segments={}
-    block_hashes_to_utt_ids={}
-    for block_hash, block in accum.blocks.items():
-        try:
-            if block.user not in users:
-                users[block.user]=User(id = block.user)
-            segments=accum.segment_contiguous_blocks(block.reply_chain)
-            assert(block_hash == segments[-1][-1])
-            # any complete contiguous block is a complete utterance
-            for seg in segments[:-1]:
-                sos=helpers.string_of_seg(seg)
-                complete_utterances.add(sos)
-            if block.is_header or not accum.blocks[segments[-1][-1]].is_followed:
-                complete_utterances.add(helpers.string_of_seg(segments[-1]))
-            block_hashes_to_segments[block_hash]=segments
-        except Exception as e:
-            logging.debug(e, exc_info=True)
-            logging.warning('Issue with conversion to corpus; skipping adding block "%s..."', block.text[:32])
+    complete_utterances, block_hashes_to_segments=_find_complete_utterances(accum, accum.blocks.items(), users)
 
     children_of_root = {}
 
@@ -289,20 +818,64 @@ def rough_convert_intermediate_to_corpus(accum: Intermediate) -> Corpus:
         #         utterances.append(utt_list[i])
         
     corpus = Corpus(utterances=utterances)
+    get_metrics().observe("conversion_seconds", time.perf_counter() - start, converter="rough")
     return corpus
 
+def get_client() -> APIClient:
+    """Returns the APIClient shared by all API queries, creating one for BASE_API_URL if none has been set."""
+    global _client
+    if _client is None:
+        _client = APIClient(BASE_API_URL)
+    return _client
+
+
+def set_client(client: APIClient) -> None:
+    """Sets the APIClient shared by all API queries (e.g. to change rate limits or point at another wiki).
+
+    :param client: the client to be used
+    :type client: APIClient
+
+    :return: None
+    """
+    global _client
+    _client = client
+
+
+def get_diff_cache() -> DiffCache:
+    """Returns the DiffCache consulted by _get_revision_diff, or None if caching is disabled."""
+    return _diff_cache
+
+
+def set_diff_cache(cache: DiffCache) -> None:
+    """Sets the DiffCache consulted by _get_revision_diff. Pass None to disable caching.
+
+    :param cache: the cache to be used
+    :type cache: DiffCache
+
+    :return: None
+    """
+    global _diff_cache
+    _diff_cache = cache
+
+
 def _query_api(params: dict) -> dict:
-    """Queries the BASE_API_URL API
+    """Queries the API through the shared APIClient
 
     :param params: API parameters
     :type params: dict
 
     :return: json-formatted response from API
     """
-    url = BASE_API_URL
-    params["format"] = "json"
-    response_json = requests.get(url, params=params).json()
-    return response_json
+    action = params.get("action", "unknown")
+    start = time.perf_counter()
+    try:
+        response = get_client().query(params)
+    except Exception:
+        get_metrics().increment("api_request_errors_total", action=action)
+        raise
+    get_metrics().increment("api_requests_total", action=action)
+    get_metrics().observe("api_request_seconds", time.perf_counter() - start, action=action)
+    return response
 
 
 def _get_revisions_since_revid(title: str, fromid: int) -> list:
@@ -379,6 +952,41 @@ def _get_last_revision_id(title: str) -> int:
     return response["query"]["pages"][0]["revisions"][0]["revid"]
 
 
+def _get_last_revision_ids(titles: list) -> dict:
+    """Returns the most recent revision id of the talk page of each article in titles (None for
+    pages that do not exist), looking up MAX_TITLES_PER_REQUEST pages per request.
+
+    :param titles: titles of the pages to be queried for (may or may not include "Talk:" prefix)
+    :type titles: list
+
+    :return: a dictionary mapping each title as given to its latest revision id
+    """
+    talk_titles = {}
+    for title in titles:
+        talk_titles.setdefault(title if title[:5].lower() == "talk:" else "Talk:" + title, []).append(title)
+    queried = list(talk_titles)
+    last_revision_ids = {}
+    for i in range(0, len(queried), MAX_TITLES_PER_REQUEST):
+        params = {}
+        params["action"] = "query"
+        params["prop"] = "info"
+        params["titles"] = "|".join(queried[i:i + MAX_TITLES_PER_REQUEST])
+        params["formatversion"] = "2"
+        response = _query_api(params)
+        # the API answers with the normalized form of each title
+        normalized = {}
+        for n in response["query"].get("normalized", []):
+            normalized.setdefault(n["to"], []).append(n["from"])
+        for page in response["query"]["pages"]:
+            # a title may have been given both as normalized and in a form normalized to it
+            for talk_title in normalized.get(page["title"], []) + [page["title"]]:
+                for title in talk_titles.get(talk_title, []):
+                    last_revision_ids[title] = page.get("lastrevid")
+    for title in titles:
+        last_revision_ids.setdefault(title, None)
+    return last_revision_ids
+
+
 def _get_revision_diff(title: str, fromid: int, toid: int) -> dict:
     """Returns the API response for comparing two revisions of a particular page
 
@@ -392,17 +1000,191 @@ def _get_revision_diff(title: str, fromid: int, toid: int) -> dict:
     :return: the json-formatted comparison between the page at revision fromid versus at revision toid 
 
     """
+    cache = _diff_cache
+    if cache is not None:
+        wiki = get_client().base_url
+        cached = cache.get(wiki, fromid, toid)
+        if cached is not None:
+            return cached
+
     params = {}
     params["action"] = "compare"
     params["fromrev"] = fromid
     params["torev"] = toid
 
-    return _query_api(params)
+    response = _query_api(params)
+    if cache is not None and "compare" in response:
+        cache.put(wiki, fromid, toid, response)
+    return response
+
 
+def _get_revisions_with_content_since_revid(title: str, fromid: int):
+    """Yields all revisions for a particular talk page since a certain revision, with
+    their wikitext. Content is fetched MAX_CONTENT_REVISIONS_PER_REQUEST revisions per request.
+    Each revision has the revision id, timestamp, user who contributed it and its content
+    (None if the content is hidden).
 
-def _process_revisions_since_revid(title: str, fromid: int, accum: Intermediate) -> Intermediate:
+    :param title: title of the page to be queried for (may or may not include "Talk:" prefix)
+    :type title: str
+    :param fromid: the revision immediately preceding those we wish to retrieve
+    :type fromid: int
+
+    :return: generator of all revisions of that page since revision fromid
+    """
+    if title[:5].lower() != "talk:":
+        title = "Talk:" + title
+    params = {}
+    params["action"] = "query"
+    params["prop"] = "revisions"
+    params["titles"] = title
+    params["rvprop"] = "ids|timestamp|user|content"
+    params["rvslots"] = "main"
+    params["rvlimit"] = MAX_CONTENT_REVISIONS_PER_REQUEST
+    params["rvdir"] = "newer"
+    params["formatversion"] = "2"
+
+    if fromid != -1:
+        params["rvstartid"] = fromid
+
+    while True:
+        response = _query_api(params)
+        for rev in response["query"]["pages"][0]["revisions"]:
+            rev["content"] = rev.pop("slots", {}).get("main", {}).get("content")
+            yield rev
+        if "continue" not in response:
+            break
+        params["rvcontinue"] = response["continue"]["rvcontinue"]
+
+
+def _iter_local_revision_diffs(title: str, fromid: int):
+    """Yields the comparison between each consecutive pair of revisions since fromid, in
+    revision order, computed locally from bulk-fetched revision content. Falls back to the
+    compare API for revisions whose content is hidden.
+
+    :param title: the title of the page to be queried for
+    :type title: str
+    :param fromid: the revision from which we process
+    :type fromid: int
+
+    :return: generator of ([previous revision, revision], diff) pairs
+    """
+    last_rev = None
+    for curr_rev in _get_revisions_with_content_since_revid(title, fromid):
+        if last_rev is not None:
+            last_content, curr_content = last_rev.pop("content"), curr_rev["content"]
+            if last_content is None or curr_content is None:
+                diff = _get_revision_diff(title, last_rev["revid"], curr_rev["revid"])
+            else:
+                diff = local_compare(last_content, curr_content)
+            yield [last_rev, curr_rev], diff
+        last_rev = curr_rev
+
+
+def _iter_revision_diffs(title: str, revisions: list, concurrency: int = 1,
+    lookahead: int = DEFAULT_LOOKAHEAD):
+    """Yields the comparison between each consecutive pair of revisions, in revision order.
+    With concurrency > 1, up to lookahead diffs are fetched ahead of the one being yielded
+    by a pool of concurrency threads.
+
+    :param title: the title of the page to be queried for
+    :type title: str
+    :param revisions: the revisions, chronologically, as returned by _get_revisions_since_revid
+    :type revisions: list
+    :param concurrency: number of diffs fetched from the API in parallel
+    :type concurrency: int
+    :param lookahead: maximum number of diffs fetched but not yet yielded
+    :type lookahead: int
+
+    :return: generator of ([previous revision, revision], diff) pairs
+    """
+    pairs = ([revisions[i-1], revisions[i]] for i in range(1, len(revisions)))
+    if concurrency <= 1:
+        for pair in pairs:
+            yield pair, _get_revision_diff(title, pair[0]["revid"], pair[1]["revid"])
+        return
+
+    lookahead = max(lookahead, concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque()
+        try:
+            for pair in pairs:
+                pending.append((pair, executor.submit(
+                    _get_revision_diff, title, pair[0]["revid"], pair[1]["revid"])))
+                if len(pending) >= lookahead:
+                    pair, future = pending.popleft()
+                    yield pair, future.result()
+            while pending:
+                pair, future = pending.popleft()
+                yield pair, future.result()
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+def _iter_revision_operations(diffs, parse_workers: int = 1, lookahead: int = DEFAULT_LOOKAHEAD):
+    """Yields the operations of each revision diff, in revision order. With parse_workers > 1,
+    up to lookahead diffs are parsed ahead of the one being yielded by a pool of parse_workers
+    processes, so that parsing runs in parallel with applying the operations.
+
+    :param diffs: iterable of ([previous revision, revision], diff) pairs, in revision order
+    :param parse_workers: number of processes parsing diffs in parallel
+    :type parse_workers: int
+    :param lookahead: maximum number of diffs parsed but not yet yielded
+    :type lookahead: int
+
+    :return: generator of ([previous revision, revision], operations) pairs
+    """
+    metrics = get_metrics()
+    if parse_workers <= 1:
+        for pair, diff in diffs:
+            operations, parse_seconds = _timed_parse_operations(diff)
+            metrics.observe("diff_parse_seconds", parse_seconds)
+            yield pair, operations
+        return
+
+    lookahead = max(lookahead, parse_workers)
+    with ProcessPoolExecutor(max_workers=parse_workers) as executor:
+        pending = deque()
+        try:
+            for pair, diff in diffs:
+                pending.append((pair, executor.submit(_timed_parse_operations, diff)))
+                if len(pending) >= lookahead:
+                    pair, future = pending.popleft()
+                    operations, parse_seconds = future.result()
+                    metrics.observe("diff_parse_seconds", parse_seconds)
+                    yield pair, operations
+            while pending:
+                pair, future = pending.popleft()
+                operations, parse_seconds = future.result()
+                metrics.observe("diff_parse_seconds", parse_seconds)
+                yield pair, operations
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+
+def _revision_diffs_since_revid(title: str, fromid: int, concurrency: int, lookahead: int, local_diff: bool) -> tuple:
+    """Returns a generator of the ([previous revision, revision], diff) pairs of a page since revision fromid,
+    and the number of revisions since fromid (None if it is not known in advance)."""
+    if local_diff:
+        return _iter_local_revision_diffs(title, fromid), None
+    revisions = _get_revisions_since_revid(title, fromid)
+    return _iter_revision_diffs(title, revisions, concurrency, lookahead), len(revisions)
+
+
+def _timed_parse_operations(diff: dict) -> tuple:
+    """Returns the operations of a diff, as _parse_operations does, and the seconds spent parsing it."""
+    start = time.perf_counter()
+    operations = _parse_operations(diff)
+    return operations, time.perf_counter() - start
+
+
+def _process_revisions_since_revid(title: str, fromid: int, accum: Intermediate,
+    concurrency: int = 1, lookahead: int = DEFAULT_LOOKAHEAD, local_diff: bool = False,
+    parse_workers: int = 1, checkpoint_revisions: int = None, checkpoint_seconds: float = None) -> Intermediate:
     """Forms an Intermediate for a particular talk page since a particular 
     revision, potentially building upon data from a previous Intermediate.
+    Diffs may be prefetched concurrently and parsed in other processes, but are always applied in revision order.
 
     :param title: the title of the page to be processed
     :type title: str
@@ -410,20 +1192,38 @@ def _process_revisions_since_revid(title: str, fromid: int, accum: Intermediate)
     :type fromid: int
     :param accum: the earlier version of an Intermediate (may be a new Intermediate if generating from scratch)
     :type accum: Intermediate
+    :param concurrency: number of revision diffs fetched from the API in parallel
+    :type concurrency: int
+    :param lookahead: maximum number of revision diffs fetched ahead of the revision being processed
+    :type lookahead: int
+    :param local_diff: whether to fetch revision content in bulk and diff it locally instead of using the compare API
+    :type local_diff: bool
+    :param parse_workers: number of processes parsing revision diffs ahead of the revision being applied (1 parses them in this process)
+    :type parse_workers: int
+    :param checkpoint_revisions: if accum has a filepath, it is written to disk every this many revisions (None to never write it)
+    :type checkpoint_revisions: int
+    :param checkpoint_seconds: if accum has a filepath, it is written to disk at least this often, in seconds (None to never write it)
+    :type checkpoint_seconds: float
 
     :return: the Intermediate of the page given by title formed by building upon accum with all revisions since fromid
     """
     res = accum
-    revisions = _get_revisions_since_revid(title, fromid)
-    i = 1
+    diffs, total = _revision_diffs_since_revid(title, fromid, concurrency, lookahead, local_diff)
     if logging.getLogger().level <= logging.INFO:
-        pbar = tqdm(total=len(revisions))
-    while i < len(revisions):
-        last_rev = revisions[i-1]
-        curr_rev = revisions[i]
-        diff = _get_revision_diff(title, last_rev["revid"], curr_rev["revid"])
-        res = _parse_diff([last_rev, curr_rev], diff, res)
-        i += 1
+        pbar = tqdm(total=total)
+    metrics = get_metrics()
+    checkpointing = res.get_filepath() is not None and (checkpoint_revisions or checkpoint_seconds)
+    since_checkpoint, last_checkpoint = 0, time.monotonic()
+    for pair, operations in _iter_revision_operations(diffs, parse_workers, lookahead):
+        start = time.perf_counter()
+        res = _apply_operations(pair, operations, res)
+        metrics.observe("revision_apply_seconds", time.perf_counter() - start)
+        since_checkpoint += 1
+        if checkpointing and ((checkpoint_revisions and since_checkpoint >= checkpoint_revisions) or
+                              (checkpoint_seconds and time.monotonic() - last_checkpoint >= checkpoint_seconds)):
+            res.write_to_disk()
+            logging.debug("checkpointed %s at revision %s", title, pair[1]["revid"])
+            since_checkpoint, last_checkpoint = 0, time.monotonic()
         if logging.getLogger().level <= logging.INFO:
             pbar.update(1)
     if logging.getLogger().level <= logging.INFO:
@@ -444,141 +1244,208 @@ def _parse_diff(revisions: list, diff: dict, accum: Intermediate) -> Intermediat
 
     :return: the Intermediate resulting from updating accum with the revision given in revisions[1]
     """
+    return _apply_operations(revisions, _parse_operations(diff), accum)
+
+
+def _parse_operations(diff: dict) -> list:
+    """The stateless half of _parse_diff: turns a compare response into the list of operations
+    it makes on the blocks of a page, one per non-empty row of the diff table, in page order.
+    Does not depend on any Intermediate, so diffs can be parsed in any order and in other processes.
+
+    Each operation is a tuple whose first element is its kind:
+
+    - (OP_UNEDITED, text, hash, depth, is_new_section): a block left as it was
+    - (OP_ADD, text, hash, depth, is_new_section): a new block
+    - (OP_MOVE, text, hash, old_hash): a block moved here, whose text was old_hash's before the move
+    - (OP_MOVED_AWAY,): the old position of a moved block
+    - (OP_REMOVE, hash): a removed block
+    - (OP_MODIFY, text, hash, old_hash, depth): a block whose text changed from old_hash's
+    - (OP_ERROR, message): the rest of the diff could not be parsed
+
+    :param diff: the difference json from _get_revision_diff
+    :type diff: dict
+
+    :return: list of operations
+    """
+    operations = []
+    try:
+        rows, anchors = parse_diff_table(diff["compare"]["*"])
+        for all_td in rows[1:]:
+            if helpers.is_unedited_tr(all_td):
+                assert(all_td[1].text == all_td[3].text)
+                unedited_text = all_td[1].text
+                if len(unedited_text.strip(" ")) > 0:
+                    operations.append((OP_UNEDITED, unedited_text, helpers.compute_md5(unedited_text),
+                                       helpers.compute_text_depth(unedited_text),
+                                       helpers.is_new_section_text(unedited_text)))
+
+            elif helpers.is_new_content_tr(all_td):  # block includes new content
+                added_text = all_td[2].text
+                if len(added_text.strip(" ")) > 0:
+                    hashed_text = helpers.compute_md5(added_text)
+                    if helpers.is_moved_right_tr(all_td):
+                        old_text = anchors[all_td[1].link_href[1:]]
+                        operations.append((OP_MOVE, added_text, hashed_text, helpers.compute_md5(old_text)))
+                    else:
+                        operations.append((OP_ADD, added_text, hashed_text, helpers.compute_text_depth(added_text),
+                                           helpers.is_new_section_text(added_text)))
+
+            # block is removing some earlier block
+            elif helpers.is_removal_tr(all_td):
+                removed_text = all_td[1].text
+                if len(removed_text) > 0:
+                    # dont remove if it was just a move
+                    if helpers.is_moved_left_tr(all_td):
+                        operations.append((OP_MOVED_AWAY,))
+                    else:
+                        operations.append((OP_REMOVE, helpers.compute_md5(removed_text)))
+
+            elif helpers.is_modification_tr(all_td):
+                new_text = all_td[3].text
+                operations.append((OP_MODIFY, new_text, helpers.compute_md5(new_text),
+                                   helpers.compute_md5(all_td[1].text), helpers.compute_text_depth(new_text)))
+
+            elif not helpers.is_line_number_tr(all_td):
+                logging.warning(all_td)
+                raise Exception("block has unknown behavior")
+    except Exception as e:
+        logging.debug(e, exc_info=True)
+        operations.append((OP_ERROR, str(e)))
+    return operations
+
+
+def _apply_operations(revisions: list, operations: list, accum: Intermediate) -> Intermediate:
+    """The stateful half of _parse_diff: applies the operations of a revision, as returned by
+    _parse_operations, to an Intermediate. Revisions must be applied in order.
+
+    :param revisions: two revisions
+    :type revisions: list
+    :param operations: the operations turning revisions[0] into revisions[1]
+    :type operations: list
+    :param accum: the Intermediate to be updated
+    :type accum: Intermediate
+
+    :return: the Intermediate resulting from updating accum with the revision given in revisions[1]
+    """
+    _apply_revision_operations(revisions, operations, accum)
+    return accum
+
+
+def _apply_revision_operations(revisions: list, operations: list, accum: Intermediate) -> int:
+    """Applies the operations of a revision to an Intermediate as _apply_operations does. A revision
+    that fails partway is recorded as an error, but the operations before the failure stay applied.
+
+    :return: the number of operations applied in full (all of them, unless the revision failed)
+    """
+    applied = 0
     try:
         assert(len(revisions) == 2)
-        soup = BeautifulSoup(diff["compare"]["*"], features="lxml")
         hashed_text, block_depth, last_hash, last_depth = None, None, None, -1
         last_block_was_ingested = False
         curr_section_hash = None
         behavior = []
 
-        for tr in soup.find_all("tr")[1:]:
-            all_td = tr.find_all("td")
+        for op in operations:
+            kind = op[0]
             block = Block()
-            if helpers.is_unedited_tr(all_td):
-                assert(all_td[1].get_text() == all_td[3].get_text())
-                unedited_text = str(all_td[1].get_text())
-                if len(unedited_text.strip(" ")) > 0:
-                    hashed_text = helpers.compute_md5(unedited_text)
-                    block_depth = helpers.compute_text_depth(unedited_text)
-                    if hashed_text not in accum.blocks:  # this old block has not yet been added to accum
-                        if helpers.is_new_section_text(unedited_text):
-                            block.root_hash = hashed_text
-                            curr_section_hash = hashed_text
-                        block.text = unedited_text
-                        block.timestamp = revisions[0]["timestamp"]
-                        block.user = None
-                        block.ingested = False
-                        block.revision_ids = ["unknown"]
-                        block.reply_chain = [hashed_text]
-                        accum.blocks[hashed_text] = block
-                        accum.hash_lookup[hashed_text] = hashed_text
-                    else:
-                        curr_section_hash = accum.blocks.get(
-                            hashed_text, None).root_hash
-                        # unchanged block has already been added to accum
-                        pass
-                    last_hash = hashed_text
-                    last_depth = block_depth
-                    last_block_was_ingested = False
+            if kind == OP_UNEDITED:
+                _, unedited_text, hashed_text, block_depth, is_new_section = op
+                if hashed_text not in accum.blocks:  # this old block has not yet been added to accum
+                    if is_new_section:
+                        block.root_hash = hashed_text
+                        curr_section_hash = hashed_text
+                    block.text = unedited_text
+                    block.timestamp = revisions[0]["timestamp"]
+                    block.user = None
+                    block.ingested = False
+                    block.revision_ids = ["unknown"]
+                    accum.reply_parents[hashed_text] = None
+                    accum.blocks[hashed_text] = block
+                    accum.hash_lookup[hashed_text] = hashed_text
                 else:
-                    # unchanged block is empty, do not need to record
+                    curr_section_hash = accum.blocks.get(
+                        hashed_text, None).root_hash
+                    # unchanged block has already been added to accum
                     pass
-
-            elif helpers.is_new_content_tr(all_td):  # block includes new content
-                added_text = str(all_td[2].get_text())
-                hashed_text = helpers.compute_md5(added_text)
-                if len(added_text.strip(" ")) > 0:
-                    if helpers.is_moved_right_tr(all_td):
-                        # is a block being moved
-                        behavior.append("move")
-                        lhs_paragraph = all_td[1].a["href"][1:]
-                        old_text = str(
-                            soup.find("a", {"name": lhs_paragraph}).parent.get_text())
-                        old_hash = helpers.compute_md5(old_text)
-                        if old_hash in accum.blocks:
-                            # someone moves comment that has been seen
-                            # kind of treated like modification of block if text has changed
-                            # cannot assume same conversation, so change root hash too
-                            block = accum.blocks.pop(old_hash)
-                            if old_hash != hashed_text:                     # text has changed and moved
-                                block.text = added_text                     # in this case updating text and author
-                                block.user = revisions[1].get("user", "userhidden")
-                            block.timestamp = revisions[1]["timestamp"]
-                            block.revision_ids.append(revisions[1]["revid"])
-                            block.root_hash = curr_section_hash
-                            accum.hash_lookup[old_hash] = hashed_text       # does nothing if text hasn't changed
-                        else:
-                            # someone moves comment that hasn't been seen
-                            # treated like modification of block that hasn't been seen
-                            block.text = added_text
-                            block.timestamp = revisions[1]["timestamp"]
+                last_hash = hashed_text
+                last_depth = block_depth
+                last_block_was_ingested = False
+
+            elif kind == OP_MOVE or kind == OP_ADD:  # block includes new content
+                added_text, hashed_text = op[1], op[2]
+                if kind == OP_MOVE:
+                    # is a block being moved
+                    behavior.append("move")
+                    old_hash = op[3]
+                    if old_hash in accum.blocks:
+                        # someone moves comment that has been seen
+                        # kind of treated like modification of block if text has changed
+                        # cannot assume same conversation, so change root hash too
+                        block = accum.blocks.pop(old_hash)
+                        if old_hash != hashed_text:                     # text has changed and moved
+                            block.text = added_text                     # in this case updating text and author
                             block.user = revisions[1].get("user", "userhidden")
-                            block.ingested = False
-                            block.revision_ids = ["unknown", revisions[1]["revid"]]
-                            block.reply_chain = [hashed_text]
-                            block.root_hash = curr_section_hash
+                        block.timestamp = revisions[1]["timestamp"]
+                        block.revision_ids.append(revisions[1]["revid"])
+                        block.root_hash = curr_section_hash
+                        accum.hash_lookup[old_hash] = hashed_text       # does nothing if text hasn't changed
+                        if old_hash != hashed_text:
+                            accum.reply_parents[hashed_text] = accum.reply_parents.get(old_hash)
                     else:
-                        # is truly a new block
+                        # someone moves comment that hasn't been seen
+                        # treated like modification of block that hasn't been seen
                         block.text = added_text
                         block.timestamp = revisions[1]["timestamp"]
                         block.user = revisions[1].get("user", "userhidden")
-                        block.ingested = True
-                        block.revision_ids = [revisions[1]["revid"]]
-
-                        if helpers.is_new_section_text(added_text):
-                            behavior.append("create_section")
-                            curr_section_hash = hashed_text
-                            block.reply_chain = [hashed_text]
-                            block.is_header = True
-                        else:
-                            behavior.append("add_comment")
-                            block_depth = helpers.compute_text_depth(added_text)
-                            if last_block_was_ingested:     # implies this block's author wrote a block before this one
-                                block.reply_chain = \
-                                    accum.blocks[last_hash].reply_chain.copy()
-                                block.reply_chain.append(hashed_text)
-                                accum.blocks[last_hash].is_followed = True
-                            else:
-                                reply_to_hash = accum.compute_reply_hash(
-                                    last_hash, last_depth, block_depth)
-                                if reply_to_hash is not None:
-                                    block.reply_chain = \
-                                        accum.blocks[reply_to_hash].reply_chain.copy()
-                                    block.reply_chain.append(hashed_text)
-                                else:
-                                    block.reply_chain = [hashed_text]
-                            block.is_header = False
+                        block.ingested = False
+                        block.revision_ids = ["unknown", revisions[1]["revid"]]
+                        accum.reply_parents[hashed_text] = None
                         block.root_hash = curr_section_hash
-                    
-                    accum.blocks[hashed_text] = block
-                    accum.hash_lookup[hashed_text] = hashed_text
-                    last_hash = hashed_text
-                    last_depth = block_depth
-                    last_block_was_ingested = True
                 else:
-                    pass
+                    # is truly a new block
+                    block.text = added_text
+                    block.timestamp = revisions[1]["timestamp"]
+                    block.user = revisions[1].get("user", "userhidden")
+                    block.ingested = True
+                    block.revision_ids = [revisions[1]["revid"]]
 
-            # block is removing some earlier block
-            elif helpers.is_removal_tr(all_td):
-                removed_text = str(all_td[1].get_text())
-                if len(removed_text) > 0:
-                    hashed_removal = helpers.compute_md5(removed_text)
-                    # dont remove if it was just a move
-                    if helpers.is_moved_left_tr(all_td):
-                        behavior.append("removal")
+                    if op[4]:
+                        behavior.append("create_section")
+                        curr_section_hash = hashed_text
+                        accum.reply_parents[hashed_text] = None
+                        block.is_header = True
                     else:
-                        try:
-                            del accum.hash_lookup[hashed_removal]
-                            del accum.blocks[hashed_removal]
-                        except KeyError:
-                            pass
+                        behavior.append("add_comment")
+                        block_depth = op[3]
+                        if last_block_was_ingested:     # implies this block's author wrote a block before this one
+                            accum.reply_parents[hashed_text] = last_hash
+                            accum.blocks[last_hash].is_followed = True
+                            accum.touch_block(last_hash)
+                        else:
+                            accum.reply_parents[hashed_text] = accum.compute_reply_hash(
+                                last_hash, last_depth, block_depth)
+                        block.is_header = False
+                    block.root_hash = curr_section_hash
 
-            elif helpers.is_modification_tr(all_td):
-                old_text = str(all_td[1].get_text())
-                old_hash = helpers.compute_md5(old_text)
-                new_text = str(all_td[3].get_text())
-                new_hash = helpers.compute_md5(new_text)
+                accum.blocks[hashed_text] = block
+                accum.hash_lookup[hashed_text] = hashed_text
+                last_hash = hashed_text
+                last_depth = block_depth
+                last_block_was_ingested = True
+
+            elif kind == OP_MOVED_AWAY:
+                behavior.append("removal")
+
+            elif kind == OP_REMOVE:
+                hashed_removal = op[1]
+                try:
+                    del accum.hash_lookup[hashed_removal]
+                    del accum.blocks[hashed_removal]
+                except KeyError:
+                    pass
+
+            elif kind == OP_MODIFY:
+                _, new_text, new_hash, old_hash, new_depth = op
                 behavior.append("modify")
                 if old_hash in accum.blocks:
                     assert(old_hash in accum.hash_lookup)
@@ -593,21 +1460,14 @@ def _parse_diff(revisions: list, diff: dict, accum: Intermediate) -> Intermediat
                     accum.hash_lookup[old_hash] = new_hash
 
                     # the modification may be editing who this comment is replying to
-                    block_depth = helpers.compute_text_depth(new_text)
+                    block_depth = new_depth
                     if last_block_was_ingested:     # implies this block's author wrote a block before this one
-                        block.reply_chain = \
-                            accum.blocks[last_hash].reply_chain.copy()
-                        block.reply_chain.append(new_hash)
+                        accum.reply_parents[new_hash] = last_hash
                         accum.blocks[last_hash].is_followed = True
+                        accum.touch_block(last_hash)
                     else:
-                        reply_to_hash = accum.compute_reply_hash(
+                        accum.reply_parents[new_hash] = accum.compute_reply_hash(
                             last_hash, last_depth, block_depth)
-                        if reply_to_hash is not None:
-                            block.reply_chain = \
-                                accum.blocks[reply_to_hash].reply_chain.copy()
-                            block.reply_chain.append(new_hash)
-                        else:
-                            block.reply_chain = [new_hash]
                 else:
                     # someone edits comment that hasn't been seen
                     # assert(old_hash not in accum.hash_lookup) # NOTE: look into further. Python seems to mess this up
@@ -616,17 +1476,17 @@ def _parse_diff(revisions: list, diff: dict, accum: Intermediate) -> Intermediat
                     block.user = revisions[1].get("user", "userhidden")
                     block.ingested = False
                     block.revision_ids = ["unknown", revisions[1]["revid"]]
-                    block.reply_chain = [new_hash]
+                    accum.reply_parents[new_hash] = None
                     block.root_hash = curr_section_hash
                     accum.blocks[new_hash] = block
                     accum.hash_lookup[new_hash] = new_hash
                 last_hash = new_hash
-                last_depth = helpers.compute_text_depth(new_text)
+                last_depth = new_depth
                 last_block_was_ingested = True      # treat it like this author wrote this block
 
-            elif not helpers.is_line_number_tr(all_td):
-                logging.warning(all_td)
-                raise Exception("block has unknown behavior")
+            elif kind == OP_ERROR:
+                raise Exception(op[1])
+            applied += 1
     except Exception as e:
         logging.debug(e, exc_info=True)
         logging.warning("Error in processing revision %s:", str(revisions[1]["revid"]))
@@ -634,8 +1494,63 @@ def _parse_diff(revisions: list, diff: dict, accum: Intermediate) -> Intermediat
         logging.warning("Skipping this revision.")
         behavior = ["error"]
 
-    accum.revisions.append((revisions[1]["revid"], behavior, revisions[1]["timestamp"]))
-    return accum
+    accum.add_revision(revisions[1]["revid"], behavior, revisions[1]["timestamp"])
+    _record_revision_metrics(operations[:applied], behavior)
+    return applied
+
+
+def _record_revision_metrics(operations: list, behavior: list) -> None:
+    """Counts an ingested revision, and the blocks its applied operations created, modified,
+    removed and moved (those before the failure, if it failed)."""
+    metrics = get_metrics()
+    metrics.increment("revisions_total", status="error" if behavior == ["error"] else "ok")
+    counts = {}
+    for op in operations:
+        if op[0] in BLOCK_CHANGES:
+            counts[op[0]] = counts.get(op[0], 0) + 1
+    for kind, n in counts.items():
+        metrics.increment("blocks_total", n, change=BLOCK_CHANGES[kind])
+
+
+def _revision_delta(revisions: list, operations: list, accum: Intermediate, present: set) -> RevisionDelta:
+    """Describes the changes made by a revision whose operations have just been applied to accum.
+
+    :param revisions: two revisions
+    :type revisions: list
+    :param operations: the operations of revisions[1] that were applied, as returned by _parse_operations
+    (those before the failure, if the revision failed)
+    :type operations: list
+    :param accum: the Intermediate the operations were applied to
+    :type accum: Intermediate
+    :param present: the hashes removed by the operations that were blocks of accum before they were applied
+    :type present: set
+
+    :return: the RevisionDelta of revisions[1]
+    """
+    _, behavior, _ = accum.revisions[-1]
+    delta = RevisionDelta(revisions[1]["revid"], revisions[0]["revid"], revisions[1]["timestamp"],
+                          revisions[1].get("user", "userhidden"), behavior)
+
+    def reply_to(h):
+        parent = accum.reply_parents.get(h)
+        return accum.find_ultimate_hash(parent) if parent is not None else None
+
+    def root_hash(h):
+        block = accum.blocks.get(h)
+        return block.root_hash if block is not None else None
+
+    for op in operations:
+        kind = op[0]
+        if kind == OP_ADD:
+            delta.added.append({"hash": op[2], "text": op[1], "reply_to": reply_to(op[2]), "root_hash": root_hash(op[2])})
+        elif kind == OP_MODIFY:
+            delta.modified.append({"old_hash": op[3], "hash": op[2], "text": op[1], "reply_to": reply_to(op[2]),
+                                   "root_hash": root_hash(op[2])})
+        elif kind == OP_MOVE:
+            delta.moved.append({"old_hash": op[3], "hash": op[2], "root_hash": root_hash(op[2])})
+        elif kind == OP_REMOVE and op[1] in present:
+            delta.removed.append(op[1])
+    return delta
 
 
 def _corpus_utt_id_from_block_hashes(hashes: list, accum: Intermediate) -> str:
@@ -652,15 +1567,16 @@ def _corpus_utt_id_from_block_hashes(hashes: list, accum: Intermediate) -> str:
     return hashes[0]
 
 
-def _find_reply_to_from_segment(segment: list) -> str:
-    """Helper function. Finds the hash of the comment to which a comment given by the last segment in a list is replying.
+def _find_reply_to_from_segment(segment: tuple) -> str:
+    """Helper function. Finds the hash of the comment to which a comment given by the last segment of a reply chain is replying.
 
-    :param segment: a list of block segments produced by Intermediate.segment_continuous_blocks()
-    :type segment: list
+    :param segment: a segmentation (earlier segments, last segment) produced by Intermediate.segment_reply_chain()
+    :type segment: tuple
 
-    :return: the hash of the block to which the last segment in the list is replying.
+    :return: the hash of the block to which the last segment is replying.
     """
-    if len(segment) == 1:
+    earlier = segment[0]
+    if earlier is None:
         return None
     else:
-        return segment[-2][0]
+        return earlier[0][0]
@@ -0,0 +1,239 @@
+import time
+import asyncio
+import logging
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_MIN_INTERVAL = 2.0
+DEFAULT_MAX_INTERVAL = 600.0
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_SMOOTHING = 0.3
+# number of a topic's latest revisions its edit rate is first estimated from
+RATE_ESTIMATE_REVISIONS = 20
+REVISION_TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+class AsyncTokenBucket:
+    """A token bucket limiting the rate at which coroutines may proceed.
+
+    :param rate: number of tokens added to the bucket per second
+    :type rate: float
+    :param capacity: maximum number of tokens the bucket can hold (the allowed burst)
+    :type capacity: int
+    """
+
+    def __init__(self, rate: float, capacity: int = 1) -> None:
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self._tokens = float(self.capacity)
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Waits until a token is available, then consumes it.
+
+        :return: None
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class TopicState:
+    """Polling state and lag metrics of a single topic.
+
+    :ivar interval: seconds between the current and the next poll of the topic
+    :type interval: float
+    :ivar next_poll: time.monotonic() at which the topic is next due
+    :type next_poll: float
+    :ivar edit_rate: exponentially smoothed number of revisions per second (None until known)
+    :type edit_rate: float
+    :ivar polls: number of completed polls
+    :type polls: int
+    :ivar errors: number of failed polls
+    :type errors: int
+    :ivar revisions: number of revisions ingested
+    :type revisions: int
+    :ivar last_lag: seconds between the first revision ingested by the latest poll that found any and that poll
+    :type last_lag: float
+    :ivar max_lag: largest last_lag observed
+    :type max_lag: float
+    :ivar last_success: time.time() of the latest successful poll
+    :type last_success: float
+    """
+
+    def __init__(self, interval: float, edit_rate: float = None) -> None:
+        self.interval = interval
+        self.next_poll = time.monotonic()
+        self.edit_rate = edit_rate
+        self.polls = 0
+        self.errors = 0
+        self.revisions = 0
+        self.last_lag = None
+        self.max_lag = None
+        self.last_success = None
+        # the first poll observes the revisions made since the topic started being tracked
+        self._last_poll = time.monotonic()
+
+    def to_dict(self) -> dict:
+        return {
+            "interval": self.interval,
+            "edit_rate": self.edit_rate,
+            "polls": self.polls,
+            "errors": self.errors,
+            "revisions": self.revisions,
+            "last_lag": self.last_lag,
+            "max_lag": self.max_lag,
+            "staleness": None if self.last_success is None else time.time() - self.last_success,
+        }
+
+
+class PollScheduler:
+    """Polls many topics concurrently, adapting the interval of each topic to its observed edit rate:
+    a topic is polled about once per expected revision, but no more often than min_interval and no
+    less often than max_interval. A topic whose edit rate is not known yet starts at min_interval,
+    which doubles after each poll that finds nothing until a revision is seen. Failed polls back
+    off exponentially. Polls run in a thread pool, so a slow topic only holds up its own worker.
+
+    :param topics: the topics to poll
+    :type topics: list
+    :param poll: function called with a topic, returning a tuple (result, number of revisions ingested, timestamp of the first of them or None)
+    :type poll: callable
+    :param min_interval: shortest interval in seconds between two polls of a topic
+    :type min_interval: float
+    :param max_interval: longest interval in seconds between two polls of a topic
+    :type max_interval: float
+    :param requests_per_second: global budget of polls per second across all topics (None for no limit);
+    to budget the API requests the polls make, limit the rate of the APIClient instead
+    :type requests_per_second: float
+    :param max_concurrency: maximum number of polls running at once
+    :type max_concurrency: int
+    :param smoothing: weight of the latest observation in the smoothed edit rate, in (0, 1]
+    :type smoothing: float
+    :param edit_rates: initial estimates of the edit rates of topics, in revisions per second (see estimate_edit_rate)
+    :type edit_rates: dict
+    """
+
+    def __init__(self, topics: list, poll, min_interval: float = DEFAULT_MIN_INTERVAL,
+                 max_interval: float = DEFAULT_MAX_INTERVAL, requests_per_second: float = None,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, smoothing: float = DEFAULT_SMOOTHING,
+                 edit_rates: dict = None) -> None:
+        assert(0 < min_interval <= max_interval)
+        assert(0 < smoothing <= 1)
+        self.poll = poll
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.requests_per_second = requests_per_second
+        self.max_concurrency = max_concurrency
+        self.smoothing = smoothing
+        edit_rates = edit_rates or {}
+        self.states = {}
+        for topic in topics:
+            self.states[topic] = state = TopicState(min_interval, edit_rates.get(topic))
+            if state.edit_rate is not None:
+                state.interval = self._interval(state.edit_rate)
+
+    async def run(self):
+        """Polls the topics until cancelled, yielding (topic, result) for every poll that ingested new revisions."""
+        assert(len(self.states) > 0)
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        bucket = AsyncTokenBucket(self.requests_per_second) if self.requests_per_second else None
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            tasks = [asyncio.ensure_future(self._poll_forever(topic, loop, executor, semaphore, bucket, queue))
+                     for topic in self.states]
+            try:
+                while True:
+                    yield await queue.get()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        """Returns the polling state and lag metrics of every topic.
+
+        :return: a dictionary mapping topics to dicts of metrics
+        """
+        return {topic: state.to_dict() for topic, state in self.states.items()}
+
+    async def _poll_forever(self, topic, loop, executor, semaphore, bucket, queue) -> None:
+        state = self.states[topic]
+        while True:
+            await asyncio.sleep(max(0.0, state.next_poll - time.monotonic()))
+            if bucket is not None:
+                await bucket.acquire()
+            async with semaphore:
+                try:
+                    result, new_revisions, first_timestamp = await loop.run_in_executor(executor, self.poll, topic)
+                except Exception as e:
+                    logging.debug(e, exc_info=True)
+                    logging.warning("Polling %s failed: %s", topic, e)
+                    state.errors += 1
+                    state.interval = min(self.max_interval, state.interval * 2)
+                    state.next_poll = time.monotonic() + state.interval
+                    continue
+            self._record_poll(state, new_revisions, first_timestamp)
+            if new_revisions > 0:
+                await queue.put((topic, result))
+
+    def _record_poll(self, state: TopicState, new_revisions: int, first_timestamp: str) -> None:
+        """Updates the edit rate, lag metrics and next poll time of a topic after a successful poll."""
+        now = time.monotonic()
+        state.polls += 1
+        state.revisions += new_revisions
+        state.last_success = time.time()
+        observed_rate = new_revisions / max(now - state._last_poll, 1e-6)
+        if state.edit_rate is not None:
+            state.edit_rate += self.smoothing * (observed_rate - state.edit_rate)
+        elif new_revisions > 0:
+            state.edit_rate = observed_rate
+        state._last_poll = now
+        if new_revisions > 0:
+            lag = _seconds_since(first_timestamp)
+            if lag is not None:
+                state.last_lag = lag
+                state.max_lag = lag if state.max_lag is None else max(state.max_lag, lag)
+        if state.edit_rate is None:
+            state.interval = min(self.max_interval, state.interval * 2)
+        else:
+            state.interval = self._interval(state.edit_rate)
+        state.next_poll = now + state.interval
+
+    def _interval(self, edit_rate: float) -> float:
+        """Returns the interval between polls of a topic edited at edit_rate, aiming for about one revision per poll."""
+        interval = 1 / edit_rate if edit_rate > 0 else self.max_interval
+        return min(self.max_interval, max(self.min_interval, interval))
+
+
+def estimate_edit_rate(timestamps: list) -> float:
+    """Estimates the edit rate of a topic from the timestamps of its latest revisions, as the number
+    of revisions per second since the first of them.
+
+    :param timestamps: revision timestamps, chronologically
+    :type timestamps: list
+
+    :return: revisions per second, or None if there is no parseable timestamp
+    """
+    if len(timestamps) == 0:
+        return None
+    elapsed = _seconds_since(timestamps[0])
+    if elapsed is None:
+        return None
+    return len(timestamps) / max(elapsed, 1.0)
+
+
+def _seconds_since(timestamp: str) -> float:
+    """Returns the seconds elapsed since a revision timestamp, or None if it cannot be parsed."""
+    try:
+        then = datetime.strptime(timestamp, REVISION_TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return None
+    return (datetime.now(timezone.utc) - then).total_seconds()
@@ -0,0 +1,353 @@
+import json
+import sqlite3
+from collections.abc import MutableMapping
+from .block import Block
+from .helpers import find_root, materialize_chain, add_reply_chain_links
+
+SQLITE_SUFFIX = ".sqlite"
+BLOCK_CACHE_SIZE = 4096
+REPLY_CHAIN_CACHE_SIZE = 65536
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    hash TEXT PRIMARY KEY,
+    text TEXT,
+    timestamp TEXT,
+    user TEXT,
+    ingested INTEGER,
+    revision_ids TEXT,
+    last_revision_id INTEGER,
+    is_followed INTEGER,
+    is_header INTEGER,
+    root_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS blocks_root_hash ON blocks (root_hash);
+CREATE INDEX IF NOT EXISTS blocks_timestamp ON blocks (timestamp);
+CREATE INDEX IF NOT EXISTS blocks_last_revision_id ON blocks (last_revision_id);
+CREATE TABLE IF NOT EXISTS hash_lookup (
+    hash TEXT PRIMARY KEY,
+    target TEXT
+);
+CREATE TABLE IF NOT EXISTS reply_parents (
+    hash TEXT PRIMARY KEY,
+    parent TEXT
+);
+CREATE TABLE IF NOT EXISTS revisions (
+    seq INTEGER PRIMARY KEY,
+    revision_id INTEGER,
+    behavior TEXT,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS revisions_revision_id ON revisions (revision_id);
+CREATE INDEX IF NOT EXISTS revisions_timestamp ON revisions (timestamp);
+"""
+
+BLOCK_COLUMNS = "hash, text, timestamp, user, ingested, revision_ids, last_revision_id, is_followed, is_header, root_hash"
+
+
+def is_sqlite_path(filepath: str) -> bool:
+    """Returns whether filepath names an Intermediate stored in SQLite."""
+    return filepath is not None and filepath.endswith(SQLITE_SUFFIX)
+
+
+def _block_to_row(h: str, b: Block) -> tuple:
+    last_revision_id = b.revision_ids[-1] if b.revision_ids and b.revision_ids[-1] != "unknown" else None
+    revision_ids = None if b.revision_ids is None else json.dumps(b.revision_ids.to_list())
+    return (h, b.text, b.timestamp, b.user, b.ingested, revision_ids, last_revision_id,
+            b.is_followed, b.is_header, b.root_hash)
+
+
+def _row_to_block(row: tuple) -> Block:
+    block = Block()
+    block.text = row[1]
+    block.timestamp = row[2]
+    block.user = row[3]
+    block.ingested = None if row[4] is None else bool(row[4])
+    block.revision_ids = None if row[5] is None else json.loads(row[5])
+    block.is_followed = bool(row[7])
+    block.is_header = bool(row[8])
+    block.root_hash = row[9]
+    return block
+
+
+class SQLiteBlocks(MutableMapping):
+    """Dict-like view of the blocks table, mapping block hashes to Block objects.
+    Blocks read or assigned are kept in a cache so that in-place modifications of
+    them (recorded in dirty) are written back on the next commit.
+
+    :ivar dirty: the hashes of blocks set, deleted or touched since the last commit
+    :type dirty: set
+    """
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self._conn = conn
+        self._cache = {}
+        self.dirty = set()
+
+    def __getitem__(self, h: str) -> Block:
+        if h in self._cache:
+            return self._cache[h]
+        row = self._conn.execute("SELECT " + BLOCK_COLUMNS + " FROM blocks WHERE hash = ?", (h,)).fetchone()
+        if row is None:
+            raise KeyError(h)
+        if len(self._cache) >= BLOCK_CACHE_SIZE:
+            self._evict_clean()
+        block = _row_to_block(row)
+        self._cache[h] = block
+        return block
+
+    def __setitem__(self, h: str, block: Block) -> None:
+        self._cache[h] = block
+        self.dirty.add(h)
+
+    def __delitem__(self, h: str) -> None:
+        if h not in self:
+            raise KeyError(h)
+        self._cache.pop(h, None)
+        self._conn.execute("DELETE FROM blocks WHERE hash = ?", (h,))
+        self.dirty.add(h)
+
+    def __contains__(self, h) -> bool:
+        if h in self._cache:
+            return True
+        return self._conn.execute("SELECT 1 FROM blocks WHERE hash = ?", (h,)).fetchone() is not None
+
+    def __iter__(self):
+        self.write_pending()
+        return iter([row[0] for row in self._conn.execute("SELECT hash FROM blocks")])
+
+    def __len__(self) -> int:
+        self.write_pending()
+        return self._conn.execute("SELECT COUNT(*) FROM blocks").fetchone()[0]
+
+    def items(self):
+        """Iterates over (hash, Block) pairs with a single query."""
+        self.write_pending()
+        for row in self._conn.execute("SELECT " + BLOCK_COLUMNS + " FROM blocks"):
+            yield row[0], self._cache[row[0]] if row[0] in self._cache else _row_to_block(row)
+
+    def values(self):
+        for _, block in self.items():
+            yield block
+
+    def blocks_in_section(self, root_hash: str) -> list:
+        """Returns the hashes of the blocks whose root_hash is root_hash."""
+        self.write_pending()
+        return [row[0] for row in self._conn.execute("SELECT hash FROM blocks WHERE root_hash = ?", (root_hash,))]
+
+    def write_pending(self) -> None:
+        """Writes the dirty blocks to the database, within the current transaction."""
+        rows = [_block_to_row(h, self._cache[h]) for h in self.dirty if h in self._cache]
+        if rows:
+            self._conn.executemany("INSERT OR REPLACE INTO blocks (" + BLOCK_COLUMNS + ") VALUES (?,?,?,?,?,?,?,?,?,?)", rows)
+        self.dirty.clear()
+
+    def _evict_clean(self) -> None:
+        self._cache = {h: b for h, b in self._cache.items() if h in self.dirty}
+
+
+class SQLiteHashLookup(MutableMapping):
+    """Dict-like view of the hash_lookup table. Writes go straight to the current transaction.
+    Like HashLookup, resolves hashes to their most recent edit with find(), keeping path-compressed
+    shortcuts in memory.
+
+    :ivar dirty: the hashes set or deleted since the last commit
+    :type dirty: set
+    """
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self._conn = conn
+        self._compressed = {}
+        self.dirty = set()
+
+    def __getitem__(self, h: str) -> str:
+        row = self._conn.execute("SELECT target FROM hash_lookup WHERE hash = ?", (h,)).fetchone()
+        if row is None:
+            raise KeyError(h)
+        return row[0]
+
+    def __setitem__(self, h: str, target: str) -> None:
+        old = self.get(h)
+        if old is not None and old != h and old != target:
+            self._compressed.clear()
+        self._conn.execute("INSERT OR REPLACE INTO hash_lookup (hash, target) VALUES (?, ?)", (h, target))
+        self.dirty.add(h)
+
+    def __delitem__(self, h: str) -> None:
+        old = self.get(h)
+        if old is None:
+            raise KeyError(h)
+        if old != h:
+            self._compressed.clear()
+        self._conn.execute("DELETE FROM hash_lookup WHERE hash = ?", (h,))
+        self.dirty.add(h)
+
+    def find(self, h: str) -> str:
+        """Returns the hash of the most recent edit of the block given by h, or None if it has been removed."""
+        return find_root(h, self.get, self._compressed)
+
+    def __contains__(self, h) -> bool:
+        return self._conn.execute("SELECT 1 FROM hash_lookup WHERE hash = ?", (h,)).fetchone() is not None
+
+    def __iter__(self):
+        return iter([row[0] for row in self._conn.execute("SELECT hash FROM hash_lookup")])
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM hash_lookup").fetchone()[0]
+
+    def items(self):
+        return iter(self._conn.execute("SELECT hash, target FROM hash_lookup").fetchall())
+
+
+class SQLiteReplyParents(MutableMapping):
+    """Dict-like view of the reply_parents table. Writes go straight to the current transaction.
+    Like ReplyParents, materializes reply chains with chain(), caching them in memory.
+
+    :ivar dirty: the hashes set or deleted since the last commit
+    :type dirty: set
+    """
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self._conn = conn
+        self._chains = {}
+        self.dirty = set()
+
+    def __getitem__(self, h: str) -> str:
+        row = self._conn.execute("SELECT parent FROM reply_parents WHERE hash = ?", (h,)).fetchone()
+        if row is None:
+            raise KeyError(h)
+        return row[0]
+
+    def __setitem__(self, h: str, parent: str) -> None:
+        # a hash without a link may have been cached as the root of its chain
+        if self.get(h) != parent and (h in self._chains or h in self):
+            self._chains.clear()
+        self._conn.execute("INSERT OR REPLACE INTO reply_parents (hash, parent) VALUES (?, ?)", (h, parent))
+        self.dirty.add(h)
+
+    def __delitem__(self, h: str) -> None:
+        if h not in self:
+            raise KeyError(h)
+        self._chains.clear()
+        self._conn.execute("DELETE FROM reply_parents WHERE hash = ?", (h,))
+        self.dirty.add(h)
+
+    def chain(self, h: str) -> tuple:
+        """Returns the reply chain of the block given by h: the hashes from the first block of its thread down to h."""
+        if len(self._chains) > REPLY_CHAIN_CACHE_SIZE:
+            self._chains.clear()
+        return materialize_chain(h, self.get, self._chains)
+
+    def __contains__(self, h) -> bool:
+        return self._conn.execute("SELECT 1 FROM reply_parents WHERE hash = ?", (h,)).fetchone() is not None
+
+    def __iter__(self):
+        return iter([row[0] for row in self._conn.execute("SELECT hash FROM reply_parents")])
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM reply_parents").fetchone()[0]
+
+    def items(self):
+        return iter(self._conn.execute("SELECT hash, parent FROM reply_parents").fetchall())
+
+
+class SQLiteRevisions:
+    """List-like view of the revisions table, holding (revision id, behavior, timestamp) triples in ingestion order."""
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self._conn = conn
+
+    def append(self, revision: tuple) -> None:
+        revid, behavior, timestamp = revision
+        self._conn.execute("INSERT INTO revisions (revision_id, behavior, timestamp) VALUES (?, ?, ?)",
+                           (revid, json.dumps(behavior), timestamp))
+
+    def __len__(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM revisions").fetchone()[0]
+
+    def __getitem__(self, i: int) -> tuple:
+        if i < 0:
+            row = self._conn.execute("SELECT revision_id, behavior, timestamp FROM revisions ORDER BY seq DESC LIMIT 1 OFFSET ?",
+                                     (-i - 1,)).fetchone()
+        else:
+            row = self._conn.execute("SELECT revision_id, behavior, timestamp FROM revisions ORDER BY seq LIMIT 1 OFFSET ?",
+                                     (i,)).fetchone()
+        if row is None:
+            raise IndexError(i)
+        return (row[0], json.loads(row[1]), row[2])
+
+    def __iter__(self):
+        for row in self._conn.execute("SELECT revision_id, behavior, timestamp FROM revisions ORDER BY seq").fetchall():
+            yield (row[0], json.loads(row[1]), row[2])
+
+
+class SQLiteStorage:
+    """Stores the blocks, hash_lookup, reply_parents and revisions of an Intermediate in a SQLite database,
+    exposing them through the same dict and list interfaces as the in-memory Intermediate.
+    Changes are committed in one transaction per ingested revision.
+
+    :param filepath: location of the database (created if it does not exist)
+    :type filepath: str
+
+    :ivar blocks: the blocks of the Intermediate
+    :type blocks: SQLiteBlocks
+    :ivar hash_lookup: the hash lookup of the Intermediate
+    :type hash_lookup: SQLiteHashLookup
+    :ivar reply_parents: the reply tree of the Intermediate
+    :type reply_parents: SQLiteReplyParents
+    :ivar revisions: the revisions of the Intermediate
+    :type revisions: SQLiteRevisions
+    """
+
+    def __init__(self, filepath: str) -> None:
+        self.filepath = filepath
+        self._conn = sqlite3.connect(filepath)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+        self.blocks = SQLiteBlocks(self._conn)
+        self.hash_lookup = SQLiteHashLookup(self._conn)
+        self.reply_parents = SQLiteReplyParents(self._conn)
+        self.revisions = SQLiteRevisions(self._conn)
+        self._migrate_reply_chains()
+
+    def commit(self) -> None:
+        """Writes pending block changes and commits the current transaction."""
+        self.blocks.write_pending()
+        self.hash_lookup.dirty.clear()
+        self.reply_parents.dirty.clear()
+        self._conn.commit()
+
+    def import_intermediate(self, hash_lookup: dict, blocks: dict, revisions: list, reply_parents: dict) -> None:
+        """Bulk loads the contents of an in-memory Intermediate, replacing anything stored, in one transaction."""
+        self._conn.execute("DELETE FROM blocks")
+        self._conn.execute("DELETE FROM hash_lookup")
+        self._conn.execute("DELETE FROM reply_parents")
+        self._conn.execute("DELETE FROM revisions")
+        self._conn.executemany("INSERT INTO blocks (" + BLOCK_COLUMNS + ") VALUES (?,?,?,?,?,?,?,?,?,?)",
+                               (_block_to_row(h, b) for h, b in blocks.items()))
+        self._conn.executemany("INSERT INTO hash_lookup (hash, target) VALUES (?, ?)", hash_lookup.items())
+        self._conn.executemany("INSERT INTO reply_parents (hash, parent) VALUES (?, ?)", reply_parents.items())
+        self._conn.executemany("INSERT INTO revisions (revision_id, behavior, timestamp) VALUES (?, ?, ?)",
+                               ((r[0], json.dumps(r[1]), r[2]) for r in revisions))
+        self.blocks.dirty.clear()
+        self.reply_parents._chains.clear()
+        self._conn.commit()
+
+    def close(self) -> None:
+        self.commit()
+        self._conn.close()
+
+    def _migrate_reply_chains(self) -> None:
+        """Converts the reply_chain column of databases written by earlier versions, where each block
+        held a copy of its whole reply chain, to reply_parents links."""
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(blocks)")]
+        if "reply_chain" not in columns:
+            return
+        reply_chains = {row[0]: json.loads(row[1]) for row in
+                        self._conn.execute("SELECT hash, reply_chain FROM blocks WHERE reply_chain IS NOT NULL")}
+        if not reply_chains:
+            return
+        add_reply_chain_links(reply_chains, self.reply_parents)
+        self._conn.execute("UPDATE blocks SET reply_chain = NULL")
+        self.commit()